@@ -0,0 +1,189 @@
+"""
+Compares the bitboard tic-tac-toe engine with the list/string based one it replaced.
+Also checks that both pick the same moves.
+
+Run from the repository root: python benchmarks/tictactoe_bench.py
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import tictactoe  # noqa: E402
+
+
+class LegacyTicTacToe:
+    def __init__(self):
+        self.board = [0, 0, 0, 0, 0, 0, 0, 0, 0]
+        self.blanks = 9
+        self.game_over = False
+
+    def update(self, player=None, i=None, full_board=None):
+        if self.game_over:
+            raise ValueError("Game already over.")
+        if i is not None and player is not None:
+            if not self.is_blank(i):
+                raise ValueError("Board is not empty at i=" + str(i))
+            self.board[i] = player
+            self.blanks -= 1
+        elif full_board is not None:
+            for i in range(len(full_board)):
+                if full_board[i] == "0":
+                    self.blanks += 1
+                self.update(int(full_board[i:i+1]), i=i)
+        if self.blanks == 0:
+            self.game_over = True
+        if not self.check_win() == -1:
+            self.game_over = True
+
+    def is_blank(self, index: int):
+        return self.board[index] == 0
+
+    def check_win(self):
+        if legacy_check_win(self, 1):
+            return 1
+        if legacy_check_win(self, 2):
+            return 2
+        return -1
+
+    def get_string(self):
+        st = ""
+        for i in range(9):
+            st += str(self.board[i])
+        return st
+
+
+def legacy_check_win(board, player):
+    consecutive = 0
+    for x in range(3):
+        for y in range(3):
+            if board.board[3 * y + x] == player:
+                consecutive += 1
+        if consecutive == 3:
+            return True
+        consecutive = 0
+    for x in range(3):
+        for y in range(3):
+            if board.board[3 * x + y] == player:
+                consecutive += 1
+        if consecutive == 3:
+            return True
+        consecutive = 0
+    for n in range(3):
+        if board.board[4*n] == player:
+            consecutive += 1
+    if consecutive == 3:
+        return True
+    consecutive = 0
+    for n in range(3):
+        if board.board[(n+1)*2] == player:
+            consecutive += 1
+    if consecutive == 3:
+        return True
+    return False
+
+
+def legacy_compute_step(board, player):
+    if legacy_check_win(board, player):
+        return None
+    elif legacy_check_win(board, 1 if player == 2 else 2):
+        return None
+    elif board.blanks == 0:
+        return None
+    winning_moves = legacy_find_vacancy(board, player)
+    if len(winning_moves) > 0:
+        return winning_moves[0]
+    opponent_moves = legacy_find_vacancy(board, 1 if player == 2 else 2)
+    if len(opponent_moves) > 0:
+        return opponent_moves[0]
+    future_wins = legacy_find_vacancy(board, player, 2)
+    best_moves = [0, 0, 0, 0, 0, 0, 0, 0, 0]
+    for i in future_wins:
+        best_moves[i] += 1
+    if max(best_moves) > 0:
+        return best_moves.index(max(best_moves))
+    x = list(range(9))
+    random.shuffle(x)
+    for i in x:
+        if board.is_blank(i):
+            return i
+
+
+def legacy_find_vacancy(board, player, free_slots=1):
+    vacant = []
+    lines = [[0, 1, 2], [3, 4, 5], [6, 7, 8], [0, 3, 6], [1, 4, 7], [2, 5, 8], [0, 4, 8], [2, 4, 6]]
+    for line in lines:
+        row = ""
+        for i in line:
+            row += str(board.board[i])
+        if row.count(str(1 if player == 2 else 2)) > 0:
+            continue
+        if not row.count("0") == free_slots:
+            continue
+        for j in range(3):
+            if row[j] == "0":
+                vacant.append(line[j])
+    vacant.sort()
+    return vacant
+
+
+def positions(count: int, seed: int = 1):
+    """
+    Random unfinished positions, as board strings with the player to move
+    """
+    rng = random.Random(seed)
+    res = []
+    while len(res) < count:
+        board = tictactoe.TicTacToe()
+        player = 1
+        for _ in range(rng.randrange(9)):
+            board.update(player, rng.choice([i for i in range(9) if board.is_blank(i)]))
+            player = 3 - player
+            if board.game_over:
+                break
+        if not board.game_over:
+            res.append((board.get_string(), player))
+    return res
+
+
+def check_same_moves(cases):
+    for string, player in cases:
+        legacy, new = LegacyTicTacToe(), tictactoe.TicTacToe()
+        legacy.update(full_board=string)
+        new.update(full_board=string)
+        if legacy.check_win() != new.check_win() or legacy.blanks != new.blanks:
+            raise AssertionError("Engines disagree on " + string)
+        for free_slots in (1, 2):
+            if legacy_find_vacancy(legacy, player, free_slots) != tictactoe.find_vacancy(new, player, free_slots):
+                raise AssertionError("Engines disagree on vacancies of " + string)
+
+
+def main():
+    cases = positions(500)
+    check_same_moves(cases)
+    legacy_boards, new_boards = [], []
+    for string, player in cases:
+        legacy, new = LegacyTicTacToe(), tictactoe.TicTacToe()
+        legacy.update(full_board=string)
+        new.update(full_board=string)
+        legacy_boards.append((legacy, player))
+        new_boards.append((new, player))
+    benchmarks = {
+        "load board": (lambda: [LegacyTicTacToe().update(full_board=s) for s, _ in cases],
+                       lambda: [tictactoe.TicTacToe().update(full_board=s) for s, _ in cases]),
+        "check_win": (lambda: [b.check_win() for b, _ in legacy_boards],
+                      lambda: [b.check_win() for b, _ in new_boards]),
+        "compute_step": (lambda: [legacy_compute_step(b, p) for b, p in legacy_boards],
+                         lambda: [tictactoe.compute_step(b, p) for b, p in new_boards])
+    }
+    print(f"{len(cases)} positions per run, best of 5 runs")
+    for name, (legacy_fn, new_fn) in benchmarks.items():
+        legacy_time = min(timeit.repeat(legacy_fn, number=10, repeat=5)) / 10
+        new_time = min(timeit.repeat(new_fn, number=10, repeat=5)) / 10
+        print(f"{name:>13}: legacy {legacy_time * 1000:7.2f}ms, bitboard {new_time * 1000:7.2f}ms, "
+              f"{legacy_time / new_time:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import json
+import os
+import time
+from storage import Storage, as_key
+
+
+class CachedStorage(Storage):
+    """
+    Write-behind cache in front of another storage backend.
+    Every table is held in memory and reads never touch the backend.
+    Each write batch is validated, appended to a journal file as one line and then applied in memory, so a batch is
+    applied whole or not at all. Writes are flushed to the backend in batches by flush().
+    Pending writes to the same row are coalesced, so only the latest version of a row reaches the backend.
+    The journal is replayed into the backend on startup, so a crash between flushes loses nothing.
+    """
+    def __init__(self, backend: Storage, journal_path: str, fsync: bool = False):
+        """
+        :param backend: the storage to flush writes into
+        :param journal_path: file path for the write journal
+        :param fsync: fsync the journal after every write (survives power loss, not just a process crash)
+        """
+        super().__init__(backend.tables)
+        self.backend = backend
+        self.journal_path = journal_path
+        self.fsync = fsync
+        self._pending = {}  # (table, key) -> op tuple, in first-write order
+        self._rows = {}  # table -> {key: row}
+        self._indexes = {}  # table -> {column: {value: set of keys}}
+        self._stats = {
+            "writes": 0,
+            "coalesced": 0,
+            "flushes": 0,
+            "rows_flushed": 0,
+            "last_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+            "replayed": 0
+        }
+        self._stats["replayed"] = self._replay_journal()
+        self._load()
+        self._journal = open(self.journal_path, "a")
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return 0
+        ops = []
+        with open(self.journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:  # torn write from a crash, the batches before it are intact
+                    break
+                for e in entry["batch"] if "batch" in entry else [entry]:  # single ops from older journals
+                    if e["op"] == "upsert":
+                        ops.append(("upsert", e["table"], e["row"]))
+                    else:
+                        ops.append(("remove", e["table"], tuple(e["key"])))
+        if ops:
+            self.backend.write_batch(ops)
+        os.truncate(self.journal_path, 0)
+        return len(ops)
+
+    def _load(self):
+        for name, table in self.tables.items():
+            self._rows[name] = {}
+            self._indexes[name] = {col: {} for col in self._indexed_columns(table)}
+            for row in self.backend.all(name):
+                self._put(name, table.key_of(row), row)
+
+    @staticmethod
+    def _indexed_columns(table):
+        cols = list(table.key)
+        for index in table.indexes:
+            for col in index:
+                if col not in cols:
+                    cols.append(col)
+        return cols
+
+    def _put(self, table: str, key: tuple, row: dict):
+        self._drop(table, key)
+        self._rows[table][key] = row
+        for col, index in self._indexes[table].items():
+            index.setdefault(row.get(col), set()).add(key)
+
+    def _drop(self, table: str, key: tuple):
+        row = self._rows[table].pop(key, None)
+        if row is None:
+            return False
+        for col, index in self._indexes[table].items():
+            keys = index.get(row.get(col))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[row.get(col)]
+        return True
+
+    def get(self, table: str, key):
+        row = self._rows[self.table(table).name].get(as_key(key))
+        return None if row is None else dict(row)
+
+    def search(self, table: str, **fields):
+        t = self.table(table)
+        for col in fields:
+            if col not in t.all_columns:
+                raise KeyError(f"Unknown column {col} in table {table}")
+        indexes = self._indexes[table]
+        candidates = None
+        for col, value in fields.items():  # narrow down through the smallest matching index
+            if col in indexes:
+                keys = indexes[col].get(value, set())
+                if candidates is None or len(keys) < len(candidates):
+                    candidates = keys
+        rows = self._rows[table]
+        if candidates is None:
+            candidates = rows.keys()
+        return [dict(rows[key]) for key in list(candidates)
+                if all(rows[key].get(col) == value for col, value in fields.items())]
+
+    def all(self, table: str):
+        return [dict(row) for row in self._rows[self.table(table).name].values()]
+
+    def _prepare(self, op: str, table: str, arg):
+        """
+        Validates a write and builds its journal entry, without changing anything
+        :return: the write as (op, table, key, row), row being None for removes, and its journal entry
+        :raise KeyError: on an unknown table or a row or key not matching the table's key columns
+        :raise ValueError: on an unknown operation
+        """
+        t = self.table(table)
+        if op == "upsert":
+            missing = [col for col in t.key if arg.get(col) is None]
+            if missing:
+                raise KeyError(f"Row for table {table} is missing key columns {', '.join(missing)}")
+            row = {col: arg.get(col) for col in t.all_columns}
+            return ("upsert", table, t.key_of(row), row), {"op": "upsert", "table": table, "row": row}
+        if op == "remove":
+            key = as_key(arg)
+            if len(key) != len(t.key):
+                raise KeyError(f"Key {key} doesn't match the key columns of table {table}")
+            return ("remove", table, key, None), {"op": "remove", "table": table, "key": list(key)}
+        raise ValueError("Unknown storage operation " + str(op))
+
+    def write_batch(self, ops: list):
+        # validate and journal the whole batch before changing the cache, so a bad op leaves nothing half applied
+        prepared = [self._prepare(op, table, arg) for op, table, arg in ops]
+        if not prepared:
+            return 0
+        self._journal.write(json.dumps({"batch": [entry for _, entry in prepared]}) + "\n")  # one line per batch
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        changed = 0
+        for (op, table, key, row), _ in prepared:
+            if op == "upsert":
+                self._put(table, key, row)
+                pending = ("upsert", table, row)
+            elif self._drop(table, key):
+                pending = ("remove", table, key)
+            else:  # nothing to remove
+                continue
+            changed += 1
+            self._stats["writes"] += 1
+            if (table, key) in self._pending:
+                self._stats["coalesced"] += 1
+                del self._pending[(table, key)]  # re-insert so the row keeps its latest position
+            self._pending[(table, key)] = pending
+        return changed
+
+    def flush(self):
+        """
+        Writes all pending rows to the backend in a single batch and clears the journal
+        :return: number of rows flushed
+        """
+        if not self._pending:
+            return 0
+        start = time.perf_counter()
+        ops = list(self._pending.values())
+        self.backend.write_batch(ops)
+        self._pending.clear()
+        self._journal.truncate(0)
+        self._journal.seek(0)
+        elapsed = (time.perf_counter() - start) * 1000
+        self._stats["flushes"] += 1
+        self._stats["rows_flushed"] += len(ops)
+        self._stats["last_flush_ms"] = elapsed
+        self._stats["total_flush_ms"] += elapsed
+        return len(ops)
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    @property
+    def stats(self):
+        """
+        Cache counters: writes, coalesced writes, flushes, rows flushed, flush latency (ms) and replayed journal entries
+        """
+        res = dict(self._stats)
+        res["avg_flush_ms"] = res["total_flush_ms"] / res["flushes"] if res["flushes"] else 0.0
+        return res
+
+    def close(self):
+        self.flush()
+        self._journal.close()
+        self.backend.close()
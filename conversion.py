@@ -1,222 +1,305 @@
-import requests
-
-length = {
-    "mm": {
-        "name": "millimeters",
-        "base_value": 1
-    },
-    "cm": {
-        "name": "centimeters",
-        "base_value": 10
-    },
-    "m": {
-        "name": "meters",
-        "base_value": 1000
-    },
-    "km": {
-        "name": "kilometers",
-        "base_value": 1000000
-    },
-    "feet": {
-        "name": "feet",
-        "base_value": 304.8
-    },
-    "inch": {
-        "name": "inches",
-        "base_value": 25.4
-    },
-    "miles": {
-        "name": "miles",
-        "base_value": 1609344
-    },
-    "yards": {
-        "name": "yards",
-        "base_value": 914.4
-    },
-    "bananas": {
-        "name": "bananas",
-        "base_value": 177.8
-    }
-}
-weight = {
-    "kg": {
-        "name": "kilograms",
-        "base_value": 1000
-    },
-    "lbs": {
-        "name": "pounds",
-        "base_value": 453.59
-    },
-    "g": {
-        "name": "grams",
-        "base_value": 1
-    },
-    "st": {
-        "name": "stone",
-        "base_value": 6350.29
-    },
-    "ton": {
-        "name": "tonnes",
-        "base_value": 1000000
-    }
-}
-
-area = {
-    "acre": {
-        "name": "acre",
-        "base_value": 2.471
-    },
-    "hectare": {
-        "name": "hectare",
-        "base_value": 1
-    },
-    "sqm": {
-        "name": "square meters",
-        "base_value": 10000
-    },
-    "sqkm": {
-        "name": "square kilometers",
-        "base_value": 0.01
-    },
-    "sqft": {
-        "name": "square feet",
-        "base_value": 107639.104
-    },
-    "sqyd": {
-        "name": "square yards",
-        "base_value": 11959.9
-    }
-}
-
-speed = {
-    "kmh": {
-        "name": "kilometers per hour",
-        "base_value": 1
-    },
-    "mps": {
-        "name": "meters per second",
-        "base_value": 3.6
-    },
-    "mph": {
-        "name": "miles per hour",
-        "base_value": 1.609
-    },
-    "knots": {
-        "name": "knots",
-        "base_value": 0.5399
-    }
-}
-
-volume = {
-    "l": {
-        "name": "liters",
-        "base_value": 1000
-    },
-    "ml": {
-        "name": "milliliters",
-        "base_value": 1
-    },
-    "gallon": {
-        "name": "gallon (US)",
-        "base_value": 3785.411
-    },
-    "pint": {
-        "name": "pint (US)",
-        "base_value": 473.176
-    },
-    "cuft": {
-        "name": "cubic feet",
-        "base_value": 28316.846
-    },
-    "cuinch": {
-        "name": "cubic inches",
-        "base_value": 16.387
-    },
-    "cubed_m": {
-        "name": "M³",
-        "base_value": 1000000
-    }
-}
-
-temperature = {
-    "c": {
-        "name": "celsius"
-    },
-    "f": {
-        "name": "fahrenheit"
-    },
-    "k": {
-        "name": "kelvin"
-    }
-}
-
-
-def convert_length(quantity: float, fr: str, to: str):
-    return quantity * length[fr]["base_value"] / length[to]["base_value"]
-
-
-def convert_weight(quantity: float, fr: str, to: str):
-    return quantity * weight[fr]["base_value"] / weight[to]["base_value"]
-
-
-def convert_area(quantity: float, fr: str, to: str):
-    return quantity * area[fr]["base_value"] / area[to]["base_value"]
-
-
-def convert_speed(quantity: float, fr: str, to: str):
-    return quantity * speed[fr]["base_value"] / speed[to]["base_value"]
-
-
-def convert_volume(quantity: float, fr: str, to: str):
-    return quantity * volume[fr]["base_value"] / volume[to]["base_value"]
-
-
-def convert_temperature(quantity: float, fr: str, to: str):
-    if fr == "c":
-        if to == "k":
-            return quantity - 273.15
-        elif to == "f":
-            return (quantity * 1.8) + 32
-    elif fr == "k":
-        if to == "c":
-            return quantity + 273.15
-        elif to == "f":
-            return ((quantity + 273.15) * 1.8) + 32
-    else:
-        if to == "k":
-            return (quantity - 32) * 5 / 9 - 273.15
-        elif to == "c":
-            return (quantity - 32) * 5 / 9
-    return quantity
+import asyncio
+import time
+import numpy as np
+from http_client import shared_client, HttpError
+
+
+class Unit:
+    def __init__(self, code: str, name: str, scale: float, offset: float = 0.0):
+        """
+        A unit of measurement
+        :param code: short code used in commands
+        :param name: display name
+        :param scale: size of one unit in the dimension's base unit
+        :param offset: base unit value at zero of this unit, for affine units like celsius
+        """
+        self.code = code
+        self.name = name
+        self.scale = scale
+        self.offset = offset
+
+
+class Dimension:
+    """
+    A registry of units measuring the same thing, with conversion matrices precomputed on creation.
+    A quantity q in unit i is q * factor[i, j] + shift[i, j] in unit j.
+    """
+    def __init__(self, name: str, units: list):
+        self.name = name
+        self.units = {unit.code: unit for unit in units}
+        self.codes = [unit.code for unit in units]
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        scale = np.array([unit.scale for unit in units], dtype=np.float64)
+        offset = np.array([unit.offset for unit in units], dtype=np.float64)
+        self.factor = scale[:, np.newaxis] / scale[np.newaxis, :]
+        self.shift = (offset[:, np.newaxis] - offset[np.newaxis, :]) / scale[np.newaxis, :]
+
+    def __getitem__(self, code: str):
+        return self.units[code]
+
+    def choices(self):
+        """
+        :return: a list of (code, name) tuples
+        """
+        return [(code, self.units[code].name) for code in self.codes]
+
+    def _indices(self, codes: list):
+        missing = [code for code in codes if code not in self.index]
+        if missing:
+            raise ValueError(f"Unknown {self.name} units: " + ", ".join(missing))
+        return np.array([self.index[code] for code in codes], dtype=np.intp)
+
+    def convert(self, quantity: float, fr: str, to: str):
+        i, j = self._indices([fr, to])
+        return float(quantity * self.factor[i, j] + self.shift[i, j])
+
+    def convert_batch(self, quantities, fr: str, to: list):
+        """
+        Converts many quantities of one unit into several units at once
+        :param quantities: array-like of quantities in unit fr
+        :param fr: code of the unit to convert from
+        :param to: codes of the units to convert to
+        :return: an array of shape (len(quantities), len(to))
+        """
+        i = self._indices([fr])[0]
+        targets = self._indices(list(to))
+        quantities = np.asarray(quantities, dtype=np.float64)
+        return quantities[:, np.newaxis] * self.factor[i, targets] + self.shift[i, targets]
+
+
+dimensions = {dimension.name: dimension for dimension in [
+    Dimension("length", [  # base: millimeters
+        Unit("mm", "millimeters", 1),
+        Unit("cm", "centimeters", 10),
+        Unit("m", "meters", 1000),
+        Unit("km", "kilometers", 1000000),
+        Unit("feet", "feet", 304.8),
+        Unit("inch", "inches", 25.4),
+        Unit("miles", "miles", 1609344),
+        Unit("yards", "yards", 914.4),
+        Unit("bananas", "bananas", 177.8)
+    ]),
+    Dimension("weight", [  # base: grams
+        Unit("kg", "kilograms", 1000),
+        Unit("lbs", "pounds", 453.59237),
+        Unit("g", "grams", 1),
+        Unit("st", "stone", 6350.29318),
+        Unit("ton", "tonnes", 1000000)
+    ]),
+    Dimension("area", [  # base: square meters
+        Unit("acre", "acre", 4046.8564224),
+        Unit("hectare", "hectare", 10000),
+        Unit("sqm", "square meters", 1),
+        Unit("sqkm", "square kilometers", 1000000),
+        Unit("sqft", "square feet", 0.09290304),
+        Unit("sqyd", "square yards", 0.83612736)
+    ]),
+    Dimension("speed", [  # base: kilometers per hour
+        Unit("kmh", "kilometers per hour", 1),
+        Unit("mps", "meters per second", 3.6),
+        Unit("mph", "miles per hour", 1.609344),
+        Unit("knots", "knots", 1.852)
+    ]),
+    Dimension("volume", [  # base: milliliters
+        Unit("l", "liters", 1000),
+        Unit("ml", "milliliters", 1),
+        Unit("gallon", "gallon (US)", 3785.411784),
+        Unit("pint", "pint (US)", 473.176473),
+        Unit("cuft", "cubic feet", 28316.846592),
+        Unit("cuinch", "cubic inches", 16.387064),
+        Unit("cubed_m", "M³", 1000000)
+    ]),
+    Dimension("temperature", [  # base: kelvin
+        Unit("c", "celsius", 1, 273.15),
+        Unit("f", "fahrenheit", 5 / 9, 273.15 - 32 * 5 / 9),
+        Unit("k", "kelvin", 1)
+    ])
+]}
+
+
+class RateSource:
+    def __init__(self, name: str, url: str, interval: float, params: dict = None, invert: bool = False,
+                 retry_backoff: float = 60):
+        """
+        An upstream rate table
+        :param name: source name
+        :param url: API url returning {"rates": {code: rate}}
+        :param interval: seconds between refreshes
+        :param retry_backoff: seconds before retrying a failed refresh, doubled per failure up to interval
+        :param params: query string parameters
+        :param invert: True if the API quotes USD per unit instead of units per USD
+        """
+        self.name = name
+        self.url = url
+        self.interval = interval
+        self.params = params
+        self.invert = invert
+        self.retry_backoff = retry_backoff
+        self.failures = 0  # failed refreshes since the last successful one
+        self.rates = {}  # last good rates, in units per USD
+        self.updated = None  # unix time of the last successful refresh
+        self.etag = None
+        self.last_modified = None
+        self.next_refresh = 0
+
+    @property
+    def due(self):
+        return time.time() >= self.next_refresh
+
+    async def refresh(self):
+        """
+        Fetches the source's rates, sending a conditional request when the last response allowed it.
+        On failure the last good rates are kept and the refresh is retried after a backoff.
+        :raise HttpError: on a failed request, a response without rates or a missing parameter (e.g. an api key)
+        """
+        # until this refresh succeeds, the next try is due after the backoff
+        self.next_refresh = time.time() + min(self.retry_backoff * 2 ** self.failures, self.interval)
+        self.failures += 1
+        missing = [key for key, value in (self.params or {}).items() if value is None]
+        if missing:
+            raise HttpError(f"{self.name} isn't configured, missing " + ", ".join(missing))
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        res = await shared_client.request("GET", self.url, params=self.params, headers=headers)
+        if res.status == 304:
+            self._refreshed()
+            return
+        res.raise_for_status()
+        try:
+            data = res.json()
+        except ValueError:
+            raise HttpError(f"Invalid JSON from {self.name}", res.status)
+        if not data.get("rates"):
+            raise HttpError(f"No rates in response from {self.name}", res.status)
+        if self.invert:
+            self.rates = {code: 1 / rate if rate != 0 else 0 for code, rate in data["rates"].items()}
+        else:
+            self.rates = dict(data["rates"])
+        self.etag = res.headers.get("ETag")
+        self.last_modified = res.headers.get("Last-Modified")
+        self._refreshed()
+
+    def _refreshed(self):
+        self.updated = time.time()
+        self.failures = 0
+        self.next_refresh = self.updated + self.interval
+
+
+class RateTable:
+    def __init__(self, rates: dict, updated: dict):
+        """
+        An immutable snapshot of exchange rates, stored as a dense vector with a precomputed cross-rate matrix
+        :param rates: currency code -> units per USD
+        :param updated: source name -> unix time the source was last refreshed
+        """
+        self.rates = rates
+        self.updated = updated
+        self.codes = list(rates)
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.vector = np.array([rates[code] for code in self.codes], dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # cross[i, j] = units of currency j per unit of currency i
+            self.cross = self.vector[np.newaxis, :] / self.vector[:, np.newaxis]
+        self.cross[~np.isfinite(self.cross)] = np.nan  # currencies quoted at 0 can't be converted
+
+    @property
+    def last_updated(self):
+        """
+        Unix time of the oldest source refresh, i.e. how stale the table may be. None if never refreshed.
+        """
+        times = [t for t in self.updated.values() if t is not None]
+        return min(times) if times else None
+
+    def indices(self, codes: list):
+        """
+        Maps currency codes to their positions in the table
+        :raise ValueError: naming the codes that don't exist
+        """
+        missing = [code for code in codes if code not in self.index]
+        if missing:
+            raise ValueError("Currency codes passed do not exist: " + ", ".join(missing))
+        return np.array([self.index[code] for code in codes], dtype=np.intp)
 
 
 class CurrencyConverter:
-    def __init__(self, crypto_key):
-        url = "https://api.exchangerate-api.com/v4/latest/USD"
-        crypto_url = "http://api.coinlayer.com/api/live?access_key=" + crypto_key
-        self.data = requests.get(url).json()
-        if "rates" not in self.data:
-            self.data.update({"rates":{}})
-        self.crypto_data = requests.get(crypto_url).json()
-        if "rates" not in self.crypto_data:
-            self.crypto_data.update({"rates":{}})
-        self.currencies = self.data["rates"]
-        temp = map(
-            lambda x: (x[0], 1 / x[1] if x[1] != 0 else 0),
-            self.crypto_data["rates"].items()
-        )
-        self.currencies.update(temp)
+    """
+    Converts currencies using rate tables refreshed in the background.
+    Conversions read the current table snapshot and never wait on a refresh.
+    """
+    def __init__(self, crypto_key, fiat_interval: float = 3600, crypto_interval: float = 8 * 3600):
+        """
+        :param crypto_key: the coinlayer api key
+        :param fiat_interval: seconds between fiat rate refreshes
+        :param crypto_interval: seconds between crypto rate refreshes (coinlayer's free plan has a monthly quota)
+        """
+        self.sources = [
+            RateSource("exchangerate-api", "https://api.exchangerate-api.com/v4/latest/USD", fiat_interval),
+            RateSource("coinlayer", "http://api.coinlayer.com/api/live", crypto_interval,
+                       params={"access_key": crypto_key}, invert=True)
+        ]
+        self.table = RateTable({}, {})
+
+    @property
+    def currencies(self):
+        return self.table.rates
+
+    @property
+    def last_updated(self):
+        return self.table.last_updated
+
+    async def update_rates(self, force: bool = False, on_error=None):
+        """
+        Refreshes the sources that are due and swaps in a new rate table
+        :param force: refresh all sources, due or not
+        :param on_error: optional callback taking (source name, exception) for failed refreshes
+        :return: True if any source was refreshed
+        """
+        refreshed = False
+        for source in self.sources:
+            if not force and not source.due:
+                continue
+            try:
+                await source.refresh()
+            except HttpError as e:
+                if on_error is not None:
+                    on_error(source.name, e)
+            else:
+                refreshed = True
+        if refreshed:
+            rates = {}
+            for source in self.sources:  # later sources win on overlapping codes
+                rates.update(source.rates)
+            self.table = RateTable(rates, {source.name: source.updated for source in self.sources})
+        return refreshed
+
+    async def run_refresher(self, check_every: float = 60, on_error=None):
+        """
+        Keeps the rate tables fresh, checking every check_every seconds for sources that are due
+        """
+        while True:
+            await asyncio.sleep(check_every)
+            await self.update_rates(on_error=on_error)
 
     def convert(self, from_currency, to_currency, amount):
-        # first convert it into USD if it is not in USD.
-        # because our base currency is USD
-        from_currency = from_currency.upper()
-        to_currency = to_currency.upper()
-        if from_currency not in self.currencies or to_currency not in self.currencies:
-            raise ValueError("A currency code passed does not exist")
-        if from_currency != 'USD':
-            amount /= self.currencies[from_currency]
-
-            # limiting the precision to 4 decimal places
-        amount = round(amount * self.currencies[to_currency], 4)
-        return amount
+        # limiting the precision to 4 decimal places
+        return round(float(self.convert_batch(from_currency, [to_currency], [amount])[0, 0]), 4)
+
+    def convert_batch(self, from_currency: str, to_currencies: list, amounts: list):
+        """
+        Converts amounts of one currency into several currencies in one pass
+        :param from_currency: code of the currency to convert from
+        :param to_currencies: codes of the currencies to convert to
+        :param amounts: amounts to convert
+        :return: an array of shape (len(amounts), len(to_currencies))
+        :raise ValueError: if a currency code doesn't exist or can't be converted
+        """
+        table = self.table  # one snapshot for the whole conversion
+        source = table.indices([from_currency.upper()])[0]
+        targets = table.indices([code.upper() for code in to_currencies])
+        cross_rates = table.cross[source, targets]
+        if np.isnan(cross_rates).any():
+            raise ValueError("A currency passed has no usable rate")
+        return np.outer(np.asarray(amounts, dtype=np.float64), cross_rates)
@@ -0,0 +1,95 @@
+import asyncio
+import random
+import aiohttp
+import discord
+
+
+class DMDispatcher:
+    """
+    Sends direct messages to many users concurrently.
+    Sends are paced to stay under Discord's rate limits (discord.py also waits out per-route buckets itself),
+    temporary failures (rate limits, server and connection errors) are retried with backoff,
+    and a failed DM doesn't stop the others.
+    """
+    def __init__(self, client: discord.Client, workers: int = 5, per_second: float = 5.0, retries: int = 3,
+                 backoff: float = 2.0):
+        """
+        :param client: the bot client
+        :param workers: DMs in flight at once
+        :param per_second: most DMs started per second
+        :param retries: retries of a DM after the first attempt
+        :param backoff: base delay for exponential backoff between retries, in seconds
+        """
+        self.client = client
+        self.workers = workers
+        self.interval = 1 / per_second
+        self.retries = retries
+        self.backoff = backoff
+        self._next_send = 0.0
+        self._pace_lock = asyncio.Lock()
+
+    async def _pace(self):
+        async with self._pace_lock:
+            now = asyncio.get_running_loop().time()
+            wait = self._next_send - now
+            self._next_send = max(now, self._next_send) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _send(self, user_id: int, send_kwargs: dict):
+        attempt = 0
+        while True:
+            await self._pace()
+            try:
+                user = self.client.get_user(user_id) or await self.client.fetch_user(user_id)
+                await user.send(**send_kwargs)
+                return
+            except discord.HTTPException as e:
+                # only rate limits and server errors are temporary, e.g. closed DMs or a bad request aren't
+                if not (e.status == 429 or e.status >= 500) or attempt >= self.retries:
+                    raise
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= self.retries:
+                    raise
+            attempt += 1
+            await asyncio.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+
+    async def dispatch(self, jobs: list, on_sent=None, on_progress=None, progress_every: float = 10.0):
+        """
+        Sends all DMs
+        :param jobs: a list of (key, user_id, send kwargs) tuples, the key identifying the job to the callbacks
+        :param on_sent: optional callback taking the key of each DM once it's sent
+        :param on_progress: optional async callback taking (sent, failed, total), called every progress_every
+        seconds while sending
+        :param progress_every: seconds between progress reports
+        :return: a dict with the "sent" keys and the "failed" keys mapped to their errors
+        """
+        queue = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+        result = {"sent": [], "failed": {}}
+
+        async def worker():
+            while not queue.empty():
+                key, user_id, send_kwargs = queue.get_nowait()
+                try:
+                    await self._send(user_id, send_kwargs)
+                except (discord.DiscordException, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    result["failed"][key] = e
+                else:
+                    result["sent"].append(key)
+                    if on_sent is not None:
+                        on_sent(key)
+
+        async def report():
+            while True:
+                await asyncio.sleep(progress_every)
+                await on_progress(len(result["sent"]), len(result["failed"]), len(jobs))
+
+        reporter = asyncio.ensure_future(report()) if on_progress is not None else None
+        try:
+            await asyncio.gather(*[worker() for _ in range(min(self.workers, len(jobs)))])
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+        return result
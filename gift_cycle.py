@@ -0,0 +1,388 @@
+import random
+
+
+class NoCycleError(ValueError):
+    """
+    Raised when no gift cycle satisfying the bans could be found.
+    definite is True when it's proven that none exists, False when the search gave up.
+    """
+    def __init__(self, message: str, definite: bool = True):
+        super().__init__(message)
+        self.definite = definite
+
+
+def gift_cycle(people: list, bans: dict = None, rng: random.Random = None, attempts: int = 8):
+    """
+    Finds a single gift cycle through everyone: order[i] gives to order[i + 1] and the last person gives to the first.
+    First tries a randomized min-conflicts repair of a shuffled cycle, which settles in linear time when bans are
+    sparse. If that stalls, builds a giver -> receiver perfect matching with augmenting paths (its cycles cover
+    everyone) and merges its cycles into one by swapping receivers between cycles.
+    :param people: participant ids
+    :param bans: giver id -> ids the giver may not give to
+    :param rng: random generator to use, for reproducible draws
+    :param attempts: matchings to try merging before giving up
+    :return: the participant ids in cycle order
+    :raise NoCycleError: if there are fewer than two people, no valid assignment exists,
+    or no matching's cycles could be merged
+    """
+    rng = rng if rng is not None else random.Random()
+    people = list(dict.fromkeys(people))
+    if len(people) < 2:
+        raise NoCycleError("Not enough people to exchange gifts.")
+    index = {p: i for i, p in enumerate(people)}
+    banned = [set() for _ in people]  # giver index -> receiver indexes the giver may not give to
+    for giver, receivers in (bans or {}).items():
+        if giver in index:
+            banned[index[giver]].update(index[r] for r in receivers if r in index)
+    for i in range(len(people)):
+        banned[i].add(i)
+    order = _min_conflicts(banned, rng)
+    for attempt in range(attempts):
+        if order is not None:
+            break
+        try:
+            order = _merge_cycles(_cycle_cover(banned, rng), banned, rng)
+        except NoCycleError as e:
+            if e.definite or attempt == attempts - 1:
+                raise
+    return [people[i] for i in order]
+
+
+def assignments(order: list):
+    """
+    :param order: a gift cycle, as returned by gift_cycle
+    :return: a dict of giver -> receiver
+    """
+    return {order[i - 1]: order[i] for i in range(len(order))}
+
+
+def _min_conflicts(banned: list, rng: random.Random, max_steps: int = None):
+    n = len(banned)
+    order = list(range(n))
+    rng.shuffle(order)
+
+    def conflict(i):  # the edge leaving position i is banned
+        return order[(i + 1) % n] in banned[order[i]]
+
+    conflicts = {i for i in range(n) if conflict(i)}
+    steps = max_steps if max_steps is not None else 20 * n + 200
+    for _ in range(steps):
+        if not conflicts:
+            return order
+        i = rng.choice(tuple(conflicts)) if len(conflicts) < 64 else next(iter(conflicts))
+        a, b = (i + 1) % n, rng.randrange(n)  # move someone else into the conflicting receiver's place
+        if a == b:
+            continue
+        edges = {(a - 1) % n, a, (b - 1) % n, b}
+        before = sum(1 for e in edges if e in conflicts)
+        order[a], order[b] = order[b], order[a]
+        after = [e for e in edges if conflict(e)]
+        if len(after) > before:
+            order[a], order[b] = order[b], order[a]
+            continue
+        conflicts.difference_update(edges)
+        conflicts.update(after)
+    return None
+
+
+def _cycle_cover(banned: list, rng: random.Random):
+    """
+    A perfect matching of givers to receivers, built from a random assignment and completed with augmenting paths
+    :return: receiver index for every giver index
+    :raise NoCycleError: if there's no perfect matching (and so no gift cycle)
+    """
+    n = len(banned)
+    receivers = list(range(n))
+    rng.shuffle(receivers)
+    match = [None] * n  # giver -> receiver
+    giver_of = [None] * n  # receiver -> giver
+    for giver, receiver in enumerate(receivers):
+        if receiver not in banned[giver]:
+            match[giver], giver_of[receiver] = receiver, giver
+    candidates = list(range(n))
+    for giver in range(n):
+        if match[giver] is not None:
+            continue
+        # breadth first search for an augmenting path from giver to a receiver nobody gives to yet
+        rng.shuffle(candidates)
+        parent = {}  # receiver -> giver reaching it
+        queue = [giver]
+        end = None
+        while queue and end is None:
+            next_queue = []
+            for g in queue:
+                for r in candidates:
+                    if r in parent or r in banned[g]:
+                        continue
+                    parent[r] = g
+                    if giver_of[r] is None:
+                        end = r
+                        break
+                    next_queue.append(giver_of[r])
+                if end is not None:
+                    break
+            queue = next_queue
+        if end is None:
+            raise NoCycleError("The bans leave no way to give everyone a Santa.")
+        r = end
+        while r is not None:  # flip the path
+            g = parent[r]
+            previous = match[g]
+            match[g], giver_of[r] = r, g
+            r = previous
+    return match
+
+
+def _merge_cycles(match: list, banned: list, rng: random.Random):
+    """
+    Joins the cycles of a giver -> receiver matching into a single cycle.
+    Two cycles with edges a -> b and c -> d merge into one by giving a -> d and c -> b instead.
+    :return: the cycle as an order of indexes
+    """
+    match = list(match)
+    seen = [False] * len(match)
+    cycles = []
+    for start in range(len(match)):
+        if seen[start]:
+            continue
+        cycle = []
+        i = start
+        while not seen[i]:
+            seen[i] = True
+            cycle.append(i)
+            i = match[i]
+        cycles.append(cycle)
+    cycles.sort(key=len, reverse=True)
+    main = cycles[0]
+    for cycle in cycles[1:]:
+        givers = list(main)
+        rng.shuffle(givers)
+        for a in givers:
+            c = next((c for c in cycle if match[c] not in banned[a] and match[a] not in banned[c]), None)
+            if c is not None:
+                match[a], match[c] = match[c], match[a]
+                main.extend(cycle)
+                break
+        else:
+            raise NoCycleError("Couldn't join everyone into a single gift cycle with these bans.", definite=False)
+    order = [0]
+    while len(order) < len(match):
+        order.append(match[order[-1]])
+    return order
+
+
+def check_bans(people: list, bans: dict = None, names: dict = None):
+    """
+    Looks for bans that make a gift cycle impossible, before searching for one.
+    The allowed giver -> receiver graph is kept as bitsets. Checks, in order:
+    everyone has someone to give to and someone to give to them, the givers can all be matched to different
+    receivers (Hall's condition, checked by building the matching) and everyone can reach everyone else.
+    Passing the checks doesn't guarantee gift_cycle succeeds, but every failure found is certain.
+    :param people: participant ids
+    :param bans: giver id -> ids the giver may not give to
+    :param names: optional id -> name, for the reasons
+    :return: a list of problems, each a dict with a "reason" and the "bans" (a list of (giver, receiver) id pairs)
+    that cause it. Removing any one of a problem's bans resolves that problem. Empty if no problem was found.
+    """
+    people = list(dict.fromkeys(people))
+    n = len(people)
+    if n < 2:
+        return [{"reason": "Not enough people to exchange gifts.", "bans": []}]
+    index = {p: i for i, p in enumerate(people)}
+    full = (1 << n) - 1
+    banned = [0] * n
+    for giver, receivers in (bans or {}).items():
+        if giver in index:
+            for r in receivers:
+                if r in index and r != giver:
+                    banned[index[giver]] |= 1 << index[r]
+    allowed = [full & ~banned[i] & ~(1 << i) for i in range(n)]
+
+    def name(i: int):
+        return str(names.get(people[i], people[i])) if names else str(people[i])
+
+    def pairs(givers: int, receivers: int):
+        """
+        The bans from any of the givers to any of the receivers, as id pairs
+        """
+        return [(people[g], people[r]) for g in _bits(givers) for r in _bits(banned[g] & receivers)]
+
+    problems = []
+    for i in range(n):
+        if not allowed[i]:
+            problems.append({"reason": f"{name(i)} isn't allowed to give to anyone.",
+                             "bans": pairs(1 << i, full)})
+    receivable = 0
+    for i in range(n):
+        receivable |= allowed[i]
+    for i in _bits(full & ~receivable):
+        problems.append({"reason": f"No one is allowed to give to {name(i)}.",
+                         "bans": pairs(full, 1 << i)})
+    if problems:
+        return problems
+
+    givers, receivers = _hall_violator(allowed, full)
+    if givers:
+        givers_names = ", ".join(name(g) for g in _bits(givers))
+        options = ", ".join(name(r) for r in _bits(receivers))
+        problems.append({
+            "reason": f"{givers_names} can only give to {options} between them, too few to go around.",
+            "bans": pairs(givers, full & ~receivers)
+        })
+        return problems
+
+    reached = _reachable(allowed, 0, full)
+    if reached != full:  # nobody reached from person 0 can give to the rest
+        problems.append({"reason": "The bans split the group into parts that can't give to each other.",
+                         "bans": pairs(reached, full & ~reached)})
+        return problems
+    reached = 1  # everyone who can reach person 0
+    changed = True
+    while changed:
+        changed = False
+        for g in _bits(full & ~reached):
+            if allowed[g] & reached:
+                reached |= 1 << g
+                changed = True
+    if reached != full:  # the rest can't give to anyone who leads back to person 0
+        problems.append({"reason": "The bans split the group into parts that can't give to each other.",
+                         "bans": pairs(full & ~reached, reached)})
+    return problems
+
+
+def _bits(mask: int):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def _reachable(edges: list, start: int, full: int):
+    reached = frontier = 1 << start
+    while frontier:
+        step = 0
+        for i in _bits(frontier):
+            step |= edges[i]
+        frontier = step & full & ~reached
+        reached |= frontier
+    return reached
+
+
+def _hall_violator(allowed: list, full: int):
+    """
+    Builds a giver -> receiver matching over bitset adjacency
+    :return: (givers, receivers) bitsets where the givers can only give to the fewer receivers,
+    or (0, 0) if everyone could be matched
+    """
+    n = len(allowed)
+    giver_of = [None] * n  # receiver -> giver
+    free = full
+    unmatched = []
+    for g in range(n):  # greedy start
+        options = allowed[g] & free
+        if options:
+            r = (options & -options).bit_length() - 1
+            giver_of[r] = g
+            free &= ~(1 << r)
+        else:
+            unmatched.append(g)
+    match = [None] * n
+    for r in range(n):
+        if giver_of[r] is not None:
+            match[giver_of[r]] = r
+    for giver in unmatched:
+        unseen = full
+        parent = {}
+        visited = 1 << giver
+        queue = [giver]
+        end = None
+        while queue and end is None:
+            next_queue = []
+            for g in queue:
+                new = allowed[g] & unseen
+                unseen &= ~new
+                for r in _bits(new):
+                    parent[r] = g
+                    if giver_of[r] is None:
+                        end = r
+                        break
+                    next_queue.append(giver_of[r])
+                    visited |= 1 << giver_of[r]
+                if end is not None:
+                    break
+            queue = next_queue
+        if end is None:
+            return visited, full & ~unseen
+        r = end
+        while r is not None:  # flip the path
+            g = parent[r]
+            previous = match[g]
+            match[g], giver_of[r] = r, g
+            r = previous
+    return 0, 0
+
+
+def splice_out(assignment: dict, person, bans: dict = None, rng: random.Random = None):
+    """
+    Removes someone from a gift cycle, changing as few assignments as possible.
+    Their Santa takes over their target. If that's banned, their Santa (or their target) is moved to another spot
+    in the cycle instead, which changes three assignments.
+    :param assignment: giver -> receiver of the current cycle
+    :param person: the person leaving
+    :param bans: giver id -> ids the giver may not give to
+    :param rng: random generator to use, for reproducible draws
+    :return: giver -> new receiver for the givers whose target changed
+    :raise NoCycleError: if too few people would be left or no repair respects the bans
+    """
+    rng = rng if rng is not None else random.Random()
+    bans = bans or {}
+
+    def allowed(giver, receiver):
+        return giver != receiver and receiver not in bans.get(giver, ())
+
+    giver = next(g for g, r in assignment.items() if r == person)
+    receiver = assignment[person]
+    if len(assignment) <= 2:
+        raise NoCycleError("Not enough people left to exchange gifts.")
+    if allowed(giver, receiver):
+        return {giver: receiver}
+    order = [receiver]  # the cycle without person, from their target round to their Santa
+    while order[-1] != giver:
+        order.append(assignment[order[-1]])
+    n = len(order)
+    repairs = []
+    # move their Santa between two neighbours a -> b: Santa's own giver takes over their target
+    before_giver = order[-2]
+    for i in range(n - 2):
+        a, b = order[i], order[i + 1]
+        if allowed(before_giver, receiver) and allowed(a, giver) and allowed(giver, b):
+            repairs.append({before_giver: receiver, a: giver, giver: b})
+    # or move their target between two neighbours a -> b: their Santa takes over the target's target
+    after_receiver = order[1]
+    for i in range(1, n - 1):
+        a, b = order[i], order[i + 1]
+        if allowed(giver, after_receiver) and allowed(a, receiver) and allowed(receiver, b):
+            repairs.append({giver: after_receiver, a: receiver, receiver: b})
+    if not repairs:
+        raise NoCycleError("The bans don't allow removing them without a new draw.", definite=False)
+    return rng.choice(repairs)
+
+
+def splice_in(assignment: dict, person, bans: dict = None, rng: random.Random = None):
+    """
+    Adds someone to a gift cycle between a giver and their target, changing one assignment and adding theirs
+    :param assignment: giver -> receiver of the current cycle
+    :param person: the person joining
+    :param bans: giver id -> ids the giver may not give to
+    :param rng: random generator to use, for reproducible draws
+    :return: giver -> new receiver for the givers whose target changed, including the new person
+    :raise NoCycleError: if no spot in the cycle respects the bans
+    """
+    rng = rng if rng is not None else random.Random()
+    bans = bans or {}
+    spots = [(giver, receiver) for giver, receiver in assignment.items()
+             if person not in bans.get(giver, ()) and receiver not in bans.get(person, ())]
+    if not spots:
+        raise NoCycleError("The bans don't allow adding them without a new draw.", definite=False)
+    giver, receiver = rng.choice(spots)
+    return {giver: person, person: receiver}
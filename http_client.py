@@ -0,0 +1,155 @@
+import asyncio
+import json
+import random
+from urllib.parse import urlsplit
+import aiohttp
+from multidict import CIMultiDict
+
+
+class HttpError(Exception):
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+class HttpResponse:
+    def __init__(self, status: int, headers: CIMultiDict, body: bytes, url: str):
+        """
+        A finished response, its body already read. Header lookups are case-insensitive.
+        """
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.url = url
+
+    @property
+    def ok(self):
+        return 200 <= self.status < 400
+
+    def text(self):
+        return self.body.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.body)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise HttpError(f"HTTP {self.status} from {self.url}", self.status)
+
+
+class HttpClient:
+    """
+    Shared asyncio HTTP client for all outbound API calls.
+    Keeps one pooled keep-alive session, limits concurrent requests per host and retries failed requests with backoff.
+    Requests that aren't idempotent (e.g. POST) are only retried when they can't have been applied.
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+    def __init__(self, limit: int = 64, limit_per_host: int = 8, timeout: float = 10, retries: int = 2,
+                 backoff: float = 0.5, max_backoff: float = 10, host_limits: dict = None):
+        """
+        :param limit: maximum open connections overall
+        :param limit_per_host: default maximum concurrent requests per host
+        :param timeout: default total timeout per attempt, in seconds
+        :param retries: default number of retries after the first attempt
+        :param backoff: base delay for exponential backoff between retries, in seconds
+        :param max_backoff: longest wait before a retry, in seconds. A longer Retry-After gives up instead.
+        :param host_limits: per-host overrides for limit_per_host, e.g. {"api.tinyurl.com": 4}
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.host_limits = host_limits if host_limits is not None else {}
+        self._session = None
+        self._semaphores = {}
+
+    def _get_session(self):
+        # created lazily so it binds to the running event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, ttl_dns_cache=300, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def _semaphore(self, host: str):
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.host_limits.get(host, self.limit_per_host))
+        return self._semaphores[host]
+
+    async def request(self, method: str, url: str, *, params: dict = None, data=None, json_body=None,
+                      headers: dict = None, timeout: float = None, retries: int = None) -> HttpResponse:
+        """
+        Sends a request, retrying on connection errors, timeouts, 429 and 5xx responses.
+        Non-idempotent requests are only retried on 429 responses and connections that couldn't be opened.
+        :param method: HTTP method
+        :param url: request url
+        :param params: query string parameters
+        :param data: form body
+        :param json_body: JSON body
+        :param headers: extra headers
+        :param timeout: total timeout per attempt, in seconds
+        :param retries: number of retries after the first attempt
+        :return: an HttpResponse (any status, the body already read)
+        """
+        retries = self.retries if retries is None else retries
+        client_timeout = aiohttp.ClientTimeout(total=self.timeout if timeout is None else timeout)
+        semaphore = self._semaphore(urlsplit(url).netloc)
+        idempotent = method.upper() in self.IDEMPOTENT_METHODS
+        retry_statuses = self.RETRY_STATUSES if idempotent else (429,)
+        attempt = 0
+        while True:
+            delay = min(self.backoff * (2 ** attempt) * (0.5 + random.random()), self.max_backoff)
+            try:
+                async with semaphore:
+                    async with self._get_session().request(method, url, params=params, data=data, json=json_body,
+                                                           headers=headers, timeout=client_timeout) as res:
+                        response = HttpResponse(res.status, CIMultiDict(res.headers), await res.read(), str(res.url))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # a request that reached the server may have been applied already
+                if attempt >= retries or not (idempotent or isinstance(e, aiohttp.ClientConnectorError)):
+                    raise HttpError(f"{method} {url} failed: {e!r}") from e
+            else:
+                if response.status not in retry_statuses or attempt >= retries:
+                    return response
+                retry_after = response.headers.get("Retry-After")
+                if retry_after is not None:
+                    try:
+                        retry_after = float(retry_after)
+                    except ValueError:  # an HTTP date, use the backoff
+                        pass
+                    else:
+                        if retry_after > self.max_backoff:  # not worth waiting for
+                            return response
+                        delay = max(delay, retry_after)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def get_json(self, url: str, **kwargs):
+        """
+        GETs a url and decodes the JSON body
+        :raise HttpError: on a failed request, an error status or an invalid body
+        """
+        res = await self.request("GET", url, **kwargs)
+        res.raise_for_status()
+        try:
+            return res.json()
+        except ValueError as e:
+            raise HttpError(f"Invalid JSON from {url}", res.status) from e
+
+    async def post_json(self, url: str, **kwargs):
+        res = await self.request("POST", url, **kwargs)
+        res.raise_for_status()
+        try:
+            return res.json()
+        except ValueError as e:
+            raise HttpError(f"Invalid JSON from {url}", res.status) from e
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+shared_client = HttpClient(host_limits={"api.tinyurl.com": 4})
@@ -0,0 +1,133 @@
+import asyncio
+import re
+from imdb import IMDb
+from storage import Storage
+from ttl_cache import TTLCache
+
+
+def normalize_query(query: str):
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+def people_record(people):
+    """
+    Turns IMDbPY Person objects into plain dicts
+    :param people: a Person, a list of Persons or None
+    :return: a list of {"name", "personID"} dicts
+    """
+    if people is None:
+        return []
+    if not isinstance(people, list):
+        people = [people]
+    return [{"name": p.get("name"), "personID": p.personID} for p in people if p.get("name")]
+
+
+def title_record(movie):
+    """
+    Extracts the fields the bot uses from an IMDbPY Movie into a JSON serializable dict
+    """
+    return {
+        "imdbID": movie.movieID,
+        "kind": movie.get("kind"),
+        "title": movie.get("title"),
+        "year": movie.get("year"),
+        "series years": movie.get("series years"),
+        "genres": movie.get("genres"),
+        "runtimes": movie.get("runtimes"),
+        "plot": movie.get("plot"),
+        "cover url": movie.get("cover url"),
+        "number of seasons": movie.get("number of seasons"),
+        "directors": people_record(movie.get("directors")),
+        "writers": people_record(movie.get("writers")),
+        "writer": people_record(movie.get("writer")),
+        "creator": people_record(movie.get("creator")),
+        "cast": people_record(movie.get("cast"))[:10]
+    }
+
+
+class ImdbCache:
+    """
+    Caches IMDb searches (by normalized query) and title records (by imdbID), each with its own TTL.
+    """
+    def __init__(self, imdb_client: IMDb, storage: Storage = None, search_ttl: float = 6 * 3600,
+                 title_ttl: float = 7 * 24 * 3600, max_items: int = 256):
+        """
+        :param imdb_client: the IMDbPY client to fetch misses with
+        :param storage: storage with a "cache" table for the on-disk level
+        :param search_ttl: seconds to keep search results
+        :param title_ttl: seconds to keep title records
+        :param max_items: in-memory entries per cache level
+        """
+        self.imdb_client = imdb_client
+        self.searches = TTLCache("imdb_search", search_ttl, max_items, storage)
+        self.titles = TTLCache("imdb_title", title_ttl, max_items, storage)
+
+    def search(self, query: str):
+        """
+        Searches IMDb titles
+        :param query: the search query
+        :return: a list of {"imdbID", "kind", "title", "year"} dicts in IMDb's ranking order
+        :raise IMDbError: on an IMDb failure
+        """
+        key = normalize_query(query)
+        results = self.searches.get(key)
+        if results is None:
+            results = [{
+                "imdbID": movie.movieID,
+                "kind": movie.get("kind"),
+                "title": movie.get("title"),
+                "year": movie.get("year")
+            } for movie in self.imdb_client.search_movie(query)]
+            self.searches.set(key, results)
+        return results
+
+    def title(self, imdb_id: str):
+        """
+        Gets a title's main and plot info
+        :param imdb_id: the imdbID, without the "tt" prefix
+        :return: a record from title_record
+        :raise IMDbError: on an IMDb failure
+        """
+        record = self.titles.get(imdb_id)
+        if record is None:
+            record = title_record(self.imdb_client.get_movie(imdb_id, info=["main", "plot"]))
+            self.titles.set(imdb_id, record)
+        return record
+
+    async def fetch_titles(self, imdb_ids: list, deadline: float, workers: int = 5, on_error=None):
+        """
+        Fetches several titles concurrently on worker threads
+        :param imdb_ids: imdbIDs, in the order the results should come back in
+        :param deadline: seconds to wait before giving up on the titles still being fetched
+        :param workers: maximum titles fetched at once
+        :param on_error: optional callback taking the exception of a failed title
+        :return: a list of records in the order of imdb_ids, None for failed or late titles
+        """
+        semaphore = asyncio.Semaphore(workers)
+
+        async def fetch(imdb_id):
+            async with semaphore:
+                return await asyncio.to_thread(self.title, imdb_id)
+
+        tasks = [asyncio.ensure_future(fetch(imdb_id)) for imdb_id in imdb_ids]
+        if not tasks:
+            return []
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+        for task in pending:  # threads already running finish in the background and still fill the cache
+            task.cancel()
+        records = []
+        for task in tasks:
+            if task in done and task.exception() is None:
+                records.append(task.result())
+            else:
+                if task in done and on_error is not None:
+                    on_error(task.exception())
+                records.append(None)
+        return records
+
+    @property
+    def stats(self):
+        return {
+            "search": dict(self.searches.stats, hit_ratio=self.searches.hit_ratio, size=len(self.searches)),
+            "title": dict(self.titles.stats, hit_ratio=self.titles.hit_ratio, size=len(self.titles))
+        }
@@ -1,19 +1,28 @@
 # System imports
 import asyncio
-import datetime
 import re
 import time
 import os
 import json
-import requests as http_request
 from dotenv import load_dotenv
 from datetime import datetime as dt
 from urllib.parse import quote_plus
 # Project imports
+from startup import StartupTimer, Lazy
+startup_timer = StartupTimer()  # started before the heavy imports below
 from utils import *
 import conversion
 import tictactoe as ttt
+import polls
 from loggable import Loggable
+from storage import SQLiteStorage, CACHE_TABLES, migrate_tinydb
+from cached_storage import CachedStorage
+from http_client import shared_client, HttpError
+from imdb_cache import ImdbCache
+from shortener import MagnetShortener
+from watchlist import WatchlistIndex
+from members import MemberResolver
+from timezones import Gazetteer, OfflineTimezoneResolver, localize
 # Framework imports
 import discord
 import discord_slash
@@ -23,26 +32,59 @@ from discord_slash.utils import manage_commands, manage_components
 from discord_slash.model import ButtonStyle, ContextMenuType
 from discord_slash.context import MenuContext
 # Helper package imports
-from tinydb import TinyDB, where, operations
 from tpblite import TPB
-from imdb import IMDb, IMDbError, helpers
+from imdb import IMDb, IMDbError
 from mal import Anime, AnimeSearch
 from random import randint
 from colorama import init, Fore
 
+startup_timer.mark("import")
+
+
+def open_storage():
+    sqlite_storage = SQLiteStorage("./databases/main.sqlite3")
+    migrate_tinydb(sqlite_storage, "./databases/main.db", ("poll", "watchlist", "tictactoe"))
+    return CachedStorage(sqlite_storage, "./databases/main.journal")
+
+
 # Package initializations
 load_dotenv()
 init()
 client = discord.Client(intents=discord.Intents.all())
 slash = SlashCommand(client, sync_commands=True)
-imdb_client = IMDb()
-main_db = TinyDB("./databases/main.db")
-poll_db = main_db.table("poll")
-watchlist_db = main_db.table("watchlist")
-tictactoe_db = main_db.table("tictactoe")
+# external clients and databases are created on first use, or warmed in the background after on_ready
+imdb_client = Lazy(IMDb, "imdb", startup_timer)
+storage = Lazy(open_storage, "storage", startup_timer)
+poll_tally = polls.PollTally(storage)
+watchlist_index = WatchlistIndex(storage)
+member_resolver = MemberResolver()
+cache_storage = Lazy(lambda: SQLiteStorage("./databases/cache.sqlite3", CACHE_TABLES), "cache", startup_timer)
+imdb_cache = ImdbCache(imdb_client, cache_storage)
+magnet_shortener = MagnetShortener(os.getenv("TINYURL_TOKEN"), cache_storage, os.getenv("REDIRECT_BASE_URL"))
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", "./data/cities15000.txt")
+
+
+def open_timezone_resolver():
+    try:
+        gazetteer = Gazetteer(GAZETTEER_PATH)
+    except OSError as e:
+        log.error(f"Couldn't load the city gazetteer at {GAZETTEER_PATH}, /timestamp will only take timezone names "
+                  f"and coordinates. Download cities15000.zip from https://download.geonames.org/export/dump/ "
+                  f"and extract it there, or set GAZETTEER_PATH: {e}")
+        gazetteer = None
+    return OfflineTimezoneResolver(gazetteer)
+
+
+timezone_resolver = Lazy(open_timezone_resolver, "timezones", startup_timer)
+STORAGE_FLUSH_INTERVAL = 5  # seconds between write-behind flushes
+WATCHLIST_RANKED_MAX = 25  # films listed by /watchlist mode:ranked
 token = os.getenv("SHIBBER_TOKEN")
 currency_convert = conversion.CurrencyConverter(os.getenv("COINLAYER_TOKEN"))
-tpb = TPB("https://tpb.party/")
+CURRENCY_CHECK_INTERVAL = 60  # seconds between checks for exchange rate sources due a refresh or retry
+CURRENCY_MAX_ITEMS = 10  # most amounts and target currencies in one /convert currency
+tpb = Lazy(lambda: TPB("https://tpb.party/"), "tpb", startup_timer)
+tictactoe_solver = Lazy(ttt.Solver, "tictactoe", startup_timer)
+tictactoe_games = ttt.GameRegistry(storage)
 log = Loggable(
     "./logs/" + dt.now().strftime("%H%M%S_%d%m%Y.log"),
     colors=[
@@ -62,16 +104,85 @@ log = Loggable(
     file_wrapper=lambda msg, lt: f"[{dt.now().strftime('%H:%M:%S %d/%m/%y')}] {lt.name} | {msg}",
     print_wrapper=lambda msg, lt: f"[{dt.now().strftime('%H:%M:%S %d/%m/%y')}] {msg}"
 )
+if os.getenv("COINLAYER_TOKEN") is None:
+    log.warning("COINLAYER_TOKEN isn't set, crypto currencies can't be converted.")
 
 with open("bot-values.json") as f:
     _bot_values = json.load(f)
 if not _bot_values:
     _bot_values = {"slash_cmd_guilds": []}
+poll_editor = polls.EditScheduler(
+    _bot_values.get("poll_edit_window", 2.0),  # seconds between edits of the same poll message
+    on_error=lambda msg_id, e: log.error(f"Failed to edit poll {msg_id}: {e}")
+)
+
+
+_background_tasks = {}
 
 
 @client.event
 async def on_ready():
     log.success("Bot Connected")
+    if "warm_up" not in _background_tasks:
+        startup_timer.mark("connect")
+        _background_tasks["warm_up"] = client.loop.create_task(warm_up())
+    if "storage_flush" not in _background_tasks:
+        _background_tasks["storage_flush"] = client.loop.create_task(flush_storage())
+    if "currency_refresh" not in _background_tasks:
+        _background_tasks["currency_refresh"] = client.loop.create_task(
+            currency_convert.run_refresher(CURRENCY_CHECK_INTERVAL, on_error=log_rate_error))
+    if "tictactoe_evict" not in _background_tasks:
+        _background_tasks["tictactoe_evict"] = client.loop.create_task(evict_tictactoe_games())
+    if magnet_shortener.redirect_base and "redirect_server" not in _background_tasks:
+        _background_tasks["redirect_server"] = await magnet_shortener.start_redirect_server(
+            "0.0.0.0", int(os.getenv("REDIRECT_PORT", "8080")))
+        log.success("Magnet redirect server started.")
+
+
+def log_rate_error(source, e):
+    log.warning(f"Exchange rate refresh from {source} failed, keeping the last good rates: {e}")
+
+
+async def warm_up():
+    """
+    Creates the lazy clients and loads exchange rates in the background, then logs the startup timings
+    """
+    async def update_rates():
+        start = time.perf_counter()
+        await currency_convert.update_rates(force=True, on_error=log_rate_error)
+        startup_timer.record("init:currency", time.perf_counter() - start)
+
+    def create_clients():
+        for lazy in (storage, cache_storage, imdb_client, tpb, timezone_resolver, tictactoe_solver):
+            try:
+                lazy.instance()
+            except Exception as e:  # leave it to be retried on first use
+                log.error("Background init failed: " + str(e))
+
+    await asyncio.gather(update_rates(), asyncio.to_thread(create_clients))
+    startup_timer.mark("warm")
+    log.success("Startup timings: " + startup_timer.report())
+    try:
+        startup_timer.save("./logs/startup.jsonl", os.getenv("SHIBBER_RELEASE"))
+    except OSError as e:
+        log.warning("Couldn't save startup timings: " + str(e))
+
+
+async def flush_storage():
+    """
+    Periodically flushes the write-behind cache into the database
+    """
+    while True:
+        await asyncio.sleep(STORAGE_FLUSH_INTERVAL)
+        try:
+            flushed = storage.flush()
+        except Exception as e:
+            log.error("Storage flush failed, will retry: " + str(e))
+            continue
+        if flushed:
+            stats = storage.stats
+            log.standard(f"Storage flushed {flushed} rows in {stats['last_flush_ms']:.1f}ms "
+                         f"({stats['coalesced']} of {stats['writes']} writes coalesced so far)")
 
 
 @client.event
@@ -101,14 +212,14 @@ async def youtube(ctx):
                         hidden=True)
         return
 
-    member = await ctx.guild.fetch_member(ctx.author_id)
-    if not member.voice:  # if the author isn't connected to voice
+    channel = await member_resolver.voice_channel(ctx.guild, ctx.author_id)
+    if channel is None:  # if the author isn't connected to voice
         log.warning(f"/youtube: User not connected to VC, handling canceled.")
         await ctx.send(content="You don't appear to be in any voice channel.", hidden=True)
         return
 
     r = Route("POST", "/channels/{channel_id}/invites",
-              channel_id=ctx.author.voice.channel.id)
+              channel_id=channel.id)
     payload = {
         "max_age": 86400,
         "max_uses": 0,
@@ -181,18 +292,12 @@ async def poll(ctx, **options):
     for option in options:  # import all options into an indexed list except for the question
         if not option == "question":
             choices.append(options[option])
-    embed = discord.Embed(
+    poll_item = polls.new_poll(
         title=f"Poll by {ctx.author.name}#{ctx.author.discriminator}",
         description="**" + options["question"] + "**",
-        color=randint(0x000000, 0xffffff))
-    i = 0
-    for choice in choices:  # add a field for each poll choice
-        i += 1
-        embed.add_field(
-            name=f"{get_number_emoji(i)} - {choice}",
-            value=f"0 votes (0%)\n{'░' * 20}",
-            inline=False
-        )
+        color=randint(0x000000, 0xffffff),
+        choices=choices)
+    embed = polls.render_embed(poll_item)
     components = []
     for i in range(len(choices)):
         components.append(
@@ -208,7 +313,8 @@ async def poll(ctx, **options):
     else:
         max_row_width = 5  # if less or equal 5, put them all in one row
     actionrows = manage_components.spread_to_rows(*components, max_in_row=max_row_width)
-    await ctx.send(embed=embed, components=actionrows)
+    message = await ctx.send(embed=embed, components=actionrows)
+    poll_tally.save(message.id, poll_item)
     log.success("/poll: Handling finished.")
 
 
@@ -218,52 +324,42 @@ async def handle_poll_component(ctx: discord_slash.ComponentContext):
         log.warning("Failed to locate origin message for " + ctx.custom_id)
         await ctx.send("Error occurred with voting. Try later?", hidden=True)
         return
-    embed = ctx.origin_message.embeds[0]  # make the poll embed into a dict
-    vote_count = []
-    for field in embed.fields:  # scrub current embed for data
-        vote_count.append(int(field.value.split()[0])),  # split by whitespace, take first choice = vote count
-
-    if poll_db.contains(
-            (where('poll_id') == ctx.origin_message_id) &
-            (where('user_id') == ctx.author.id)):  # if voted on msg
-
-        res = poll_db.search(
-            (where('poll_id') == ctx.origin_message_id) &
-            (where('user_id') == ctx.author.id))  # look it up
-
-        last_vote = res[0]["option_id"]  # get the last voted item
-        vote_count[int(last_vote.split("_")[1])] -= 1  # reduce vote from previous vote
-    vote_count[int(ctx.custom_id.split("_")[1])] += 1  # increase vote for current vote
-    poll_db.upsert({  # update database if exist, insert if doesn't
-        "poll_id": ctx.origin_message_id,  # poll_id = poll message id
-        "option_id": ctx.custom_id,  # option_id = poll button custom id ("poll_{N}")
-        "user_id": ctx.author.id  # user_id = user who pressed a button
-    }, (where('poll_id') == ctx.origin_message_id) &
-       (where('user_id') == ctx.author.id))  # the query for checking if exists
-
-    total_votes = 0  # total poll votes
-    for field in vote_count:  # reconstruct embed with new values
-        total_votes += field
-    new_embed = discord.Embed(title=embed.title, color=embed.color, description=embed.description)
-    for i in range(len(embed.fields)):
-        percent = int(vote_count[i] / total_votes * 100)
-        new_value = f"{vote_count[i]} votes ({percent}%)\n"
-        new_value += "▓" * int(percent // 5)
-        new_value += "░" * int(20 - (percent // 5))
-        new_embed.add_field(name=embed.fields[i].name, value=new_value, inline=False)
+    if poll_tally.get(ctx.origin_message_id) is None:  # poll posted before counters were kept
+        poll_tally.adopt(ctx.origin_message_id, ctx.origin_message.embeds[0])
+    poll_tally.vote(ctx.origin_message_id, ctx.author.id, int(ctx.custom_id.split("_")[1]))
+    await ctx.defer(ignore=True)  # acknowledge the click, the embed is updated by the scheduler
 
-    try:
-        await ctx.edit_origin(embed=new_embed)
-    except discord.DiscordException:
-        log.error("Failed to edit origin message for " + ctx.custom_id)
-    else:
-        log.success("Poll choice handling finished.")
+    async def edit_poll(channel_id=ctx.channel_id, poll_id=ctx.origin_message_id):
+        new_embed = polls.render_embed(poll_tally.get(poll_id))  # render the latest tally when the edit runs
+        await client.http.edit_message(channel_id, poll_id, embed=new_embed.to_dict())
+
+    poll_editor.request(ctx.origin_message_id, edit_poll)
+    log.success(f"Poll choice handling finished. ({poll_editor.saved} poll edits saved so far)")
 
 
 # ===========================/POLL==============================>>>
 
 
 # <<<=======================/IMDB==================================
+IMDB_DEADLINE = 8  # seconds to wait for title details before replying with what arrived
+IMDB_WORKERS = 5  # concurrent IMDb scrapes per /imdb command
+
+
+async def yts_lookup(movie_id: str):
+    """
+    Looks a movie's torrents up on YTS
+    :param movie_id: the imdbID, without the "tt" prefix
+    :return: the YTS response, or None on failure
+    """
+    try:
+        return await shared_client.get_json("https://yts.mx/api/v2/list_movies.json", params={
+            "query_term": f"tt{movie_id}"
+        })
+    except HttpError as e:
+        log.error(str(e))
+        return None
+
+
 @slash.slash(name="imdb",
              description="Searches imdb",
              guild_ids=_bot_values["slash_cmd_guilds"],
@@ -297,30 +393,24 @@ async def imdb(ctx, **options):
     embeds = []
     if options["search_type"] == "movie":  # if search for movie
         try:
-            movies = imdb_client.search_movie(options["query"])[:5]  # Take the top 5 results
+            movies = (await asyncio.to_thread(imdb_cache.search, options["query"]))[:5]  # Take the top 5 results
         except IMDbError as e:
             log.error("IMDb API error: " + str(e) + "\nCanceled handling.")
             await ctx.reply("Sorry, but there seems to have been a disagreement between the bot and IMDb.", hidden=True)
             return
-        print(movies)
         movie_info = []  # container to hold the movie information we're gonna use for the embed
         if movies:
-            i = 1
-            for movie in movies:
-                if i <= 0:
-                    break
-                try:
-                    imdb_client.update(movie, info=[
-                        "main", "plot"
-                    ])
-                except IMDbError as e:
-                    log.error("IMDb API error: " + str(e) + "\nCanceled handling.")
-                    await ctx.reply("Sorry, but there seems to have been a disagreement between the bot and IMDb.",
-                                    hidden=True)
-                    return
+            # start the torrent lookup for the likely pick while IMDb is still being queried
+            likely = next((m["imdbID"] for m in movies if m["kind"] == "movie"), None)
+            yts_tasks = {}
+            if likely is not None:
+                yts_tasks[likely] = asyncio.ensure_future(yts_lookup(likely))
+            records = await imdb_cache.fetch_titles(
+                [m["imdbID"] for m in movies], IMDB_DEADLINE, IMDB_WORKERS,
+                on_error=lambda e: log.error("IMDb API error: " + str(e)))
+            for movie in records:  # records keep the search ranking, failed or late ones are None
                 # skip iteration if 'tv movie' or 'movie'
-                print(movie["kind"])
-                if not movie["kind"] == "movie":
+                if movie is None or not movie["kind"] == "movie":
                     continue
                 movie_info.append({
                     "title": none2str(movie["title"]),
@@ -329,47 +419,17 @@ async def imdb(ctx, **options):
                     "runtime": list2str(movie.get("runtimes")),
                     "plot": list2str(movie.get("plot")),
                     "cover": none2str(movie.get("cover url")),
-                    "id": none2str(movie["imdbID"])
-                })
-                person2str = helpers.makeObject2Txt(personTxt=u"[%(name)s](https://www.imdb.com/name/nm%(personID)s/)")
-                temp_directors = movie.get("directors")
-                temp_writers = movie.get("writers")
-                temp_cast = movie.get("cast")
-                directors = []
-                writers = []
-                cast = []
-
-                if isinstance(temp_directors, list):
-                    for person in temp_directors:
-                        person_str = person2str(person)
-                        if not person_str == "":
-                            directors.append(person_str)
-                else:
-                    directors = person2str(temp_directors)
-
-                if isinstance(temp_writers, list):
-                    for person in temp_writers:
-                        person_str = person2str(person)
-                        if not person_str == "":
-                            writers.append(person_str)
-                else:
-                    writers = person2str(temp_writers)
-
-                if isinstance(temp_writers, list):
-                    for person in temp_cast:
-                        person_str = person2str(person)
-                        if not person_str == "":
-                            cast.append(person_str)
-                else:
-                    cast = person2str(temp_cast)
-                print(f"{temp_writers=}")
-                print(f"{writers=}")
-                movie_info[-1].update({
-                    "directors": list2str(directors, 3),
-                    "writers": list2str(writers, 3),
-                    "cast": list2str(cast, 5),
+                    "id": none2str(movie["imdbID"]),
+                    "directors": list2str(person_links(movie["directors"]), 3),
+                    "writers": list2str(person_links(movie["writers"]), 3),
+                    "cast": list2str(person_links(movie["cast"]), 5)
                 })
-                i -= 1
+                break
+            for task in [t for mov_id, t in yts_tasks.items() if not any(m["id"] == mov_id for m in movie_info)]:
+                task.cancel()
+            if not movie_info:
+                log.error("/imdb failed: no movie enriched in time")
+                await ctx.send("Movie not found or other error occurred.", hidden=True)
             for movie in movie_info:
                 embed = discord.Embed(title=f"{movie['title']} ({movie['year']})",
                                       url=f"https://www.imdb.com/title/tt{movie['id']}",
@@ -401,13 +461,10 @@ async def imdb(ctx, **options):
                         custom_id="watchlist_list"
                     )]
                 tor_buttons = []
-                try:
-                    res = http_request.get("https://yts.mx/api/v2/list_movies.json", params={
-                        "query_term": f"tt{movie['id']}"
-                    }).json()
-                except Exception as e:
-                    log.error(str(e))
-                else:
+                if movie["id"] not in yts_tasks:
+                    yts_tasks[movie["id"]] = asyncio.ensure_future(yts_lookup(movie["id"]))
+                res = await yts_tasks[movie["id"]]
+                if res is not None and res["status"] == "ok":
                     trackers = "tr=udp://open.demonii.com:1337/announce\
                     &tr=udp://tracker.openbittorrent.com:80\
                     &tr=udp://tracker.coppersurfer.tk:6969\
@@ -416,20 +473,24 @@ async def imdb(ctx, **options):
                     &tr=udp://torrent.gresille.org:80/announce\
                     &tr=udp://p4p.arenabg.com:1337\
                     &tr=udp://tracker.leechers-paradise.org:6969"
-                    if res["status"] == "ok":
-                        if res["data"]["movie_count"] == 1:
-                            torrent_res = res["data"]["movies"][0]
-                            for i in range(len(torrent_res["torrents"])):
-                                tor = torrent_res["torrents"][i]
-                                # print(torrent_res)
-                                tor_buttons.append(manage_components.create_button(
-                                    style=ButtonStyle.URL,
-                                    label=f"{tor['quality']} {tor['type'].title()} "
-                                          f"({tor['size']} | ▲{tor['seeds']} ▼{tor['peers']})",
-                                    url=magnet_shorten(os.getenv("TINYURL_TOKEN"),
-                                                       f"magnet:?xt=urn:btih:{tor['hash']}"
-                                                       f"&dn={quote_plus(torrent_res['title_long'])}&{trackers}")
-                                ))
+                    if res["data"]["movie_count"] == 1:
+                        torrent_res = res["data"]["movies"][0]
+                        torrents = torrent_res["torrents"]
+                        links = await magnet_shortener.shorten_many([  # shorten all torrents at once
+                            f"magnet:?xt=urn:btih:{tor['hash']}"
+                            f"&dn={quote_plus(torrent_res['title_long'])}&{trackers}"
+                            for tor in torrents
+                        ])
+                        for tor, link in zip(torrents, links):
+                            if link is None:
+                                log.error(f"Couldn't shorten torrent {tor['hash']}")
+                                continue
+                            tor_buttons.append(manage_components.create_button(
+                                style=ButtonStyle.URL,
+                                label=f"{tor['quality']} {tor['type'].title()} "
+                                      f"({tor['size']} | ▲{tor['seeds']} ▼{tor['peers']})",
+                                url=link
+                            ))
                 try:
                     if len(tor_buttons) > 0:
                         await ctx.send(embeds=embeds, components=[
@@ -444,30 +505,21 @@ async def imdb(ctx, **options):
                     log.success("/imdb: Handling finished.")
         else:
             log.error("/imdb failed: not Movie")
-            ctx.send("Movie not found or other error occurred.", hidden=True)
+            await ctx.send("Movie not found or other error occurred.", hidden=True)
     elif options["search_type"] == "tv":  # if search for tv series
         try:
-            shows = imdb_client.search_movie(options["query"])
+            shows = (await asyncio.to_thread(imdb_cache.search, options["query"]))[:5]  # Take the top 5 results
         except IMDbError as e:
             log.error("IMDb API error: " + str(e) + "\nCanceled handling.")
             await ctx.reply("Sorry, but there seems to have been a disagreement between the bot and IMDb.", hidden=True)
             return
         show_info = []
         if shows:
-            i = 1
-            for show in shows:
-                if i <= 0:
-                    break
-                try:
-                    imdb_client.update(show, info=[
-                        "main", "plot"
-                    ])
-                except IMDbError as e:
-                    log.error("IMDb API error: " + str(e) + "\nCanceled handling.")
-                    await ctx.reply("Sorry, there seems to have been a disagreement between the bot and IMDb.",
-                                    hidden=True)
-                    return
-                if not show["kind"] == "tv series" and not show["kind"] == "tv mini series":
+            records = await imdb_cache.fetch_titles(
+                [s["imdbID"] for s in shows], IMDB_DEADLINE, IMDB_WORKERS,
+                on_error=lambda e: log.error("IMDb API error: " + str(e)))
+            for show in records:  # records keep the search ranking, failed or late ones are None
+                if show is None or show["kind"] not in ("tv series", "tv mini series"):
                     continue
                 show_info.append({
                     "title": none2str(show["title"]),
@@ -476,46 +528,15 @@ async def imdb(ctx, **options):
                     "plot": list2str(show.get("plot")),
                     "cover": none2str(show.get("cover url")),
                     "seasons": none2str(show.get("number of seasons")),
-                    "id": none2str(show["imdbID"])
-                })
-                person2str = helpers.makeObject2Txt(personTxt=u"[%(name)s](https://www.imdb.com/name/nm%(personID)s/)")
-                temp_writers = show.get("writer")
-                temp_creators = show.get("creator")
-                temp_cast = show.get("cast")
-                writers = []
-                creators = []
-                cast = []
-
-                if isinstance(temp_writers, list):
-                    for person in temp_writers:
-                        person_str = person2str(person)
-                        if not person_str == "":
-                            writers.append(person_str)
-                else:
-                    writers = person2str(temp_writers)
-
-                if isinstance(temp_creators, list):
-                    for person in temp_creators:
-                        person_str = person2str(person)
-                        if not person_str == "":
-                            creators.append(person_str)
-                else:
-                    creators = person2str(temp_creators)
-
-                if isinstance(temp_cast, list):
-                    for person in temp_cast:
-                        person_str = person2str(person)
-                        if not person_str == "":
-                            cast.append(person_str)
-                else:
-                    cast = person2str(temp_cast)
-
-                show_info[-1].update({
-                    "writers": list2str(writers, 3),
-                    "creators": list2str(creators, 3),
-                    "cast": list2str(cast, 5),
+                    "id": none2str(show["imdbID"]),
+                    "writers": list2str(person_links(show["writer"]), 3),
+                    "creators": list2str(person_links(show["creator"]), 3),
+                    "cast": list2str(person_links(show["cast"]), 5)
                 })
-                i -= 1
+                break
+            if not show_info:
+                log.error("/imdb failed: no show enriched in time")
+                await ctx.send("Show not found or other error occurred.", hidden=True)
             for show in show_info:
                 embed = discord.Embed(title=f"{show['title']} ({show['year']})",
                                       url=f"https://www.imdb.com/title/tt{show['id']}",
@@ -524,7 +545,7 @@ async def imdb(ctx, **options):
 {ellipsis_truncate(show['plot'], 200)}""",
                                       color=randint(0x000000, 0xffffff))
                 embed.set_thumbnail(url=show['cover'])
-                if not show["creators"] is None:
+                if show["creators"]:
                     embed.add_field(name="Created by:", value=show["creators"], inline=False)
                 else:
                     embed.add_field(name="Written by:", value=show["writers"], inline=False)
@@ -537,6 +558,12 @@ async def imdb(ctx, **options):
                     log.error("Couldn't reply to /imdb. Error:" + str(e))
                 else:
                     log.success("/imdb: Handling finished.")
+    stats = imdb_cache.stats
+    log.standard(f"Magnet shortener: {magnet_shortener.hit_ratio:.0%} cache hits, "
+                 f"{magnet_shortener.avg_ms:.0f}ms average per link")
+    log.standard(f"IMDb cache hit ratio: search {stats['search']['hit_ratio']:.0%} "
+                 f"({stats['search']['size']} in memory), title {stats['title']['hit_ratio']:.0%} "
+                 f"({stats['title']['size']} in memory)")
 
 
 # ==========================/IMDB=================================>>>
@@ -553,6 +580,16 @@ async def imdb(ctx, **options):
             description="User/users to send watchlist for",
             option_type=3,
             required=False
+        ),
+        manage_commands.create_option(
+            name="mode",
+            description="Films everyone wants (default), or films anyone wants ranked by how many want them",
+            option_type=3,
+            required=False,
+            choices=[
+                manage_commands.create_choice(name="common", value="common"),
+                manage_commands.create_choice(name="ranked", value="ranked")
+            ]
         )
     ]
 )
@@ -574,46 +611,61 @@ async def watchlist(ctx, **options):
             log.warning("Command dispatched with no users")
             return
     msg_str += ":\n"
-    film_doc_list = watchlist_db.search(where("user_id") == users[0])
-    for i in range(1, len(users)):
-        for j in range(len(film_doc_list)):
-            if not watchlist_db.contains((where("user_id") == users[i]) &
-                                         (where("film_id") == film_doc_list[j]["film_id"])):
-                film_doc_list.remove(film_doc_list[j])
-    for i in range(len(film_doc_list)):
-        film_id = film_doc_list[i]["film_id"]
-        temp = imdb_client.get_movie(film_id[2::])
-        msg_str += f"**{temp.get('title')}** ({temp.get('year')})\n"
-    if len(msg_str) > 0:
+    if options.get("mode") == "ranked":
+        films = watchlist_index.ranked(users)[:WATCHLIST_RANKED_MAX]
+    else:
+        films = [(film_id, len(users)) for film_id in watchlist_index.common(users)]
+    missing = [film_id for film_id, _ in films if watchlist_index.details(film_id) is None]
+    if missing:  # rows saved before titles were stored with them
+        records = await imdb_cache.fetch_titles([film_id[2::] for film_id in missing], IMDB_DEADLINE, IMDB_WORKERS,
+                                                on_error=lambda e: log.error("IMDb API error: " + str(e)))
+        for film_id, record in zip(missing, records):
+            if record is not None:
+                watchlist_index.set_details(film_id, record["title"], record["year"])
+    for film_id, wanted in films:
+        temp = watchlist_index.details(film_id) or {"title": film_id, "year": "?"}
+        msg_str += f"**{temp.get('title')}** ({temp.get('year')})"
+        msg_str += f" - {wanted}/{len(users)}\n" if options.get("mode") == "ranked" else "\n"
+    if len(films) > 0:
         await ctx.send(msg_str)
     else:
         await ctx.send("There are no movies in this list.")
 
 
+def parse_title_year(embed_title: str):
+    """
+    Splits an /imdb embed title, e.g. "Alien (1979)"
+    :return: (title, year), year being None if missing
+    """
+    match = re.fullmatch(r"(.*) \((\d*)\)", embed_title or "")
+    if match is None:
+        return embed_title, None
+    return match.group(1), int(match.group(2)) if match.group(2) else None
+
+
 async def handle_watchlist_component(ctx):
     if ctx.custom_id == "watchlist_add":
-        mov_id = ctx.origin_message.embeds[0].footer.text
-        if not watchlist_db.contains((where("user_id") == ctx.author_id) & (where("film_id") == mov_id)):
-            watchlist_db.insert({"user_id": ctx.author_id, "film_id": mov_id})
+        embed = ctx.origin_message.embeds[0]
+        title, year = parse_title_year(embed.title)
+        if watchlist_index.add(ctx.author_id, embed.footer.text, title, year):
             await ctx.send("Movie added to your watchlist.", hidden=True)
         else:
             await ctx.send("Movie already on your watchlist.", hidden=True)
     elif ctx.custom_id == "watchlist_remove":
         mov_id = ctx.origin_message.embeds[0].footer.text
-        if watchlist_db.contains((where("user_id") == ctx.author_id) & (where("film_id") == mov_id)):
-            watchlist_db.remove((where("user_id") == ctx.author_id) & (where("film_id") == mov_id))
+        if watchlist_index.remove(ctx.author_id, mov_id):
             await ctx.send("Movie removed from your watchlist.", hidden=True)
         else:
             await ctx.send("Movie wasn't on your watchlist.", hidden=True)
     elif ctx.custom_id == "watchlist_list":
         mov_id = ctx.origin_message.embeds[0].footer.text
-        interested = watchlist_db.search(where("film_id") == mov_id)
+        interested = []
         msg = "People interested in **" + ctx.origin_message.embeds[0].title + "**:\n"
-        for item in interested:
-            if await ctx.guild.fetch_member(item["user_id"]) is not None:
-                msg += "<@" + str(item["user_id"]) + ">"
-            else:
-                interested.remove(item)
+        members = await member_resolver.get_many(ctx.guild, sorted(watchlist_index.users(mov_id)))
+        for user_id in members:
+            msg += "<@" + str(user_id) + ">"
+            interested.append(user_id)
+        log.standard(f"Member lookups: {member_resolver.stats}")
         msg = msg.replace("><", ">, <")
         if len(interested) > 0:
             await ctx.send(msg, hidden=True)
@@ -642,14 +694,14 @@ async def anime(ctx, **options):
     await ctx.defer()
     await asyncio.sleep(3)
     log.event("/Anime command received.")
-    search = AnimeSearch(options["search_query"])
+    search = await asyncio.to_thread(AnimeSearch, options["search_query"])  # mal-api scrapes synchronously
     if not search:
         log.warning("/Anime: Couldn't find a result.")
         log.event("/Anime: Handling finished.")
         await ctx.send(f"Couldn't find a result for \"{options['search_query']}\"", hidden=True)
         return
     try:
-        result = Anime(search.results[0].mal_id)
+        result = await asyncio.to_thread(Anime, search.results[0].mal_id)
     except Exception as e:
         log.error(str(e))
         log.error("Stopping /Anime execution")
@@ -690,21 +742,20 @@ async def piratebay(ctx, **options):
     tor_limit = 5
     res_embeds = []
     print(options["query"])
-    piratebay_torrents = tpb.search(options["query"])
+    # tpblite scrapes synchronously, and the client is created on first use, so both happen on a worker thread
+    piratebay_torrents = await asyncio.to_thread(lambda: list(tpb.instance().search(options["query"]))[:tor_limit])
     # create piratebay embed
     temp_embed = discord.Embed(title="PirateBay Results", description=f"Query: {options['query']}")
+    magnets = await magnet_shortener.shorten_many([tor.magnetlink for tor in piratebay_torrents])
+    if piratebay_torrents and not any(magnets):
+        log.error("/piratebay: couldn't shorten any magnet link")
+        await ctx.send("There was an error in processing your request. Please try again later.", hidden=True)
+        return
     i = 1
-    for tor in piratebay_torrents:
-        if i > tor_limit:
-            break
-        try:
-            magnet = magnet_shorten(os.getenv("TINYURL_TOKEN"), tor.magnetlink)
-        except NameError as e:
-            log.error(str(e))
-            await ctx.send("There was an error in processing your request. Please try again later.", hidden=True)
-            return
+    for tor, magnet in zip(piratebay_torrents, magnets):
+        name = f"[{tor.title}]({magnet})" if magnet is not None else tor.title
         temp_embed.add_field(
-            value=f"{i}) **Name: [{tor.title}]({magnet})**\n*{tor.category}*",
+            value=f"{i}) **Name: {name}**\n*{tor.category}*",
             name=f"Size: {tor.filesize} | Seeders: {tor.seeds} | Leechers: {tor.leeches}",
             inline=False
         )
@@ -712,6 +763,8 @@ async def piratebay(ctx, **options):
     res_embeds.append(temp_embed)
     await ctx.send(embeds=res_embeds)
     log.success("/piratebay: handling finished")
+    log.standard(f"Magnet shortener: {magnet_shortener.hit_ratio:.0%} cache hits, "
+                 f"{magnet_shortener.avg_ms:.0f}ms average per link")
 
 
 # ==========================/PIRATEBAY============================>>>
@@ -887,6 +940,20 @@ async def kessify(ctx, message):
 
 
 # <<<=======================/CONVERT================================
+def unit_choices(dimension: str):
+    return [manage_commands.create_choice(name=name, value=code)
+            for code, name in conversion.dimensions[dimension].choices()]
+
+
+async def send_unit_conversion(ctx, dimension: str, options: dict):
+    log.event(f"/convert {dimension} command received")
+    units = conversion.dimensions[dimension]
+    result = units.convert(options["quantity"], options["from"], options["to"])
+    await ctx.send(
+        f"{options['quantity']} {units[options['from']].name} "
+        f"is {result:.2f} {units[options['to']].name}")
+
+
 @slash.subcommand(
     base="convert",
     name="length",
@@ -904,29 +971,19 @@ async def kessify(ctx, message):
             option_type=3,
             required=True,
             description="Convert from",
-            choices=list(map(
-                lambda x: manage_commands.create_choice(name=x[1]['name'], value=x[0]),
-                conversion.length.items()
-            ))
+            choices=unit_choices("length")
         ),
         manage_commands.create_option(
             name="to",
             option_type=3,
             required=True,
             description="Convert to",
-            choices=list(map(
-                lambda x: manage_commands.create_choice(name=x[1]['name'], value=x[0]),
-                conversion.length.items()
-            ))
+            choices=unit_choices("length")
         )
     ]
 )
 async def _convert_length(ctx, **options):
-    log.event("/convert length command received")
-    await ctx.send(
-        f"{options['quantity']} {conversion.length[options['from']]['name']} "
-        f"is {conversion.convert_length(options['quantity'], options['from'], options['to']):.2f}"
-        f" {conversion.length[options['to']]['name']}")
+    await send_unit_conversion(ctx, "length", options)
 
 
 @slash.subcommand(
@@ -946,29 +1003,19 @@ async def _convert_length(ctx, **options):
             option_type=3,
             required=True,
             description="Convert from",
-            choices=list(map(
-                lambda x: manage_commands.create_choice(name=x[1]['name'], value=x[0]),
-                conversion.weight.items()
-            ))
+            choices=unit_choices("weight")
         ),
         manage_commands.create_option(
             name="to",
             option_type=3,
             required=True,
             description="Convert to",
-            choices=list(map(
-                lambda x: manage_commands.create_choice(name=x[1]['name'], value=x[0]),
-                conversion.weight.items()
-            ))
+            choices=unit_choices("weight")
         )
     ]
 )
 async def _convert_weight(ctx, **options):
-    log.event("/convert weight command received")
-    await ctx.send(
-        f"{options['quantity']} {conversion.weight[options['from']]['name']} "
-        f"is {conversion.convert_weight(options['quantity'], options['from'], options['to']):.2f}"
-        f" {conversion.weight[options['to']]['name']}")
+    await send_unit_conversion(ctx, "weight", options)
 
 
 @slash.subcommand(
@@ -988,29 +1035,19 @@ async def _convert_weight(ctx, **options):
             option_type=3,
             required=True,
             description="Convert from",
-            choices=list(map(
-                lambda x: manage_commands.create_choice(name=x[1]['name'], value=x[0]),
-                conversion.area.items()
-            ))
+            choices=unit_choices("area")
         ),
         manage_commands.create_option(
             name="to",
             option_type=3,
             required=True,
             description="Convert to",
-            choices=list(map(
-                lambda x: manage_commands.create_choice(name=x[1]['name'], value=x[0]),
-                conversion.area.items()
-            ))
+            choices=unit_choices("area")
         )
     ]
 )
 async def _convert_area(ctx, **options):
-    log.event("/convert area command received")
-    await ctx.send(
-        f"{options['quantity']} {conversion.area[options['from']]['name']} "
-        f"is {conversion.convert_area(options['quantity'], options['from'], options['to']):.2f}"
-        f" {conversion.area[options['to']]['name']}")
+    await send_unit_conversion(ctx, "area", options)
 
 
 @slash.subcommand(
@@ -1030,29 +1067,19 @@ async def _convert_area(ctx, **options):
             option_type=3,
             required=True,
             description="Convert from",
-            choices=list(map(
-                lambda x: manage_commands.create_choice(name=x[1]['name'], value=x[0]),
-                conversion.speed.items()
-            ))
+            choices=unit_choices("speed")
         ),
         manage_commands.create_option(
             name="to",
             option_type=3,
             required=True,
             description="Convert to",
-            choices=list(map(
-                lambda x: manage_commands.create_choice(name=x[1]['name'], value=x[0]),
-                conversion.speed.items()
-            ))
+            choices=unit_choices("speed")
         )
     ]
 )
 async def _convert_speed(ctx, **options):
-    log.event("/convert speed command received")
-    await ctx.send(
-        f"{options['quantity']} {conversion.speed[options['from']]['name']} "
-        f"is {conversion.convert_speed(options['quantity'], options['from'], options['to']):.2f}"
-        f" {conversion.speed[options['to']]['name']}")
+    await send_unit_conversion(ctx, "speed", options)
 
 
 @slash.subcommand(
@@ -1072,29 +1099,19 @@ async def _convert_speed(ctx, **options):
             option_type=3,
             required=True,
             description="Convert from",
-            choices=list(map(
-                lambda x: manage_commands.create_choice(name=x[1]['name'], value=x[0]),
-                conversion.volume.items()
-            ))
+            choices=unit_choices("volume")
         ),
         manage_commands.create_option(
             name="to",
             option_type=3,
             required=True,
             description="Convert to",
-            choices=list(map(
-                lambda x: manage_commands.create_choice(name=x[1]['name'], value=x[0]),
-                conversion.volume.items()
-            ))
+            choices=unit_choices("volume")
         )
     ]
 )
 async def _convert_volume(ctx, **options):
-    log.event("/convert volume command received")
-    await ctx.send(
-        f"{options['quantity']} {conversion.volume[options['from']]['name']} "
-        f"is {conversion.convert_volume(options['quantity'], options['from'], options['to']):.2f}"
-        f" {conversion.volume[options['to']]['name']}")
+    await send_unit_conversion(ctx, "volume", options)
 
 
 @slash.subcommand(
@@ -1114,37 +1131,25 @@ async def _convert_volume(ctx, **options):
             option_type=3,
             required=True,
             description="Convert from",
-            choices=[
-                manage_commands.create_choice(name="celsius", value="c"),
-                manage_commands.create_choice(name="fahrenheit", value="f"),
-                manage_commands.create_choice(name="kelvin", value="k")
-            ]
+            choices=unit_choices("temperature")
         ),
         manage_commands.create_option(
             name="to",
             option_type=3,
             required=True,
             description="Convert to",
-            choices=[
-                manage_commands.create_choice(name="celsius", value="c"),
-                manage_commands.create_choice(name="fahrenheit", value="f"),
-                manage_commands.create_choice(name="kelvin", value="k")
-            ]
+            choices=unit_choices("temperature")
         )
     ]
 )
 async def _convert_temperature(ctx, **options):
-    log.event("/convert temperature command received")
-    await ctx.send(
-        f"{options['quantity']} {conversion.temperature[options['from']]['name']} "
-        f"is {conversion.convert_temperature(options['quantity'], options['from'], options['to']):.2f}"
-        f" {conversion.temperature[options['to']]['name']}")
+    await send_unit_conversion(ctx, "temperature", options)
 
 
 @slash.subcommand(
     base="convert",
     name="currency",
-    description="Converts from a currency to another",
+    description="Converts amounts from a currency to one or more others",
     guild_ids=_bot_values["slash_cmd_guilds"],
     options=[
         manage_commands.create_option(
@@ -1163,7 +1168,13 @@ async def _convert_temperature(ctx, **options):
             name="to",
             option_type=3,
             required=True,
-            description="3 Letter code of currency to convert to"
+            description=f"3 Letter codes of currencies to convert to, separated by spaces (up to {CURRENCY_MAX_ITEMS})"
+        ),
+        manage_commands.create_option(
+            name="more_amounts",
+            option_type=3,
+            required=False,
+            description="More amounts to convert, separated by spaces or commas"
         )
     ]
 )
@@ -1171,17 +1182,39 @@ async def _convert_currency(ctx, **options):
     await ctx.defer()
     log.event("/convert currency command received")
     check_pattern = r"\A[a-zA-Z]{3}\Z"
-    if not re.search(check_pattern, options["from"]) or not re.search(check_pattern, options["to"]):
+    targets = re.split(r"[\s,]+", options["to"].strip())
+    if not re.search(check_pattern, options["from"]) or \
+            not all(re.search(check_pattern, target) for target in targets):
         log.warning("Handling canceled due to false currency string.")
         await ctx.send("One of the currency codes specified was incorrect (not 3 letters)", hidden=True)
         return
+    amounts = [options["quantity"]]
+    if "more_amounts" in options:
+        try:
+            amounts += [float(x) for x in re.split(r"[\s,]+", options["more_amounts"].strip()) if x]
+        except ValueError:
+            await ctx.send("One of the amounts specified isn't a number.", hidden=True)
+            return
+    if len(targets) > CURRENCY_MAX_ITEMS or len(amounts) > CURRENCY_MAX_ITEMS:
+        await ctx.send(f"You can convert up to {CURRENCY_MAX_ITEMS} amounts into up to {CURRENCY_MAX_ITEMS} "
+                       f"currencies at once.", hidden=True)
+        return
+    if not currency_convert.currencies:
+        log.warning("Handling canceled, exchange rates not loaded yet.")
+        await ctx.send("Exchange rates are still loading, try again in a moment.", hidden=True)
+        return
     try:
-        result = currency_convert.convert(options["from"], options["to"], options["quantity"])
-    except ValueError:
-        log.error("Error occurred with currency conversion, handling canceled")
+        results = currency_convert.convert_batch(options["from"], targets, amounts)
+    except ValueError as e:
+        log.error(f"Error occurred with currency conversion, handling canceled: {e}")
         await ctx.send("An error occurred converting, likely due to wrong currency codes.", hidden=True)
         return
-    await ctx.send(f"{options['quantity']} {options['from'].upper()} = {result:.2f} {options['to'].upper()}")
+    from_code = options["from"].upper()
+    lines = []
+    for amount, row in zip(amounts, results):
+        lines.append(f"{amount:g} {from_code} = " +
+                     " | ".join(f"{value:.2f} {target.upper()}" for value, target in zip(row, targets)))
+    await ctx.send("\n".join(lines) + f"\n*Rates updated <t:{int(currency_convert.last_updated)}:R>*")
     log.success("/convert currency handling finished")
 
 
@@ -1225,7 +1258,7 @@ async def _convert_currency(ctx, **options):
                  ),
                  manage_commands.create_option(
                      name="timezone_location",
-                     description="Enter a location in your timezone",
+                     description="Enter a city, \"lat, lon\" or timezone name (e.g. Europe/London)",
                      option_type=3,
                      required=True
                  )
@@ -1246,35 +1279,26 @@ async def timestamp(ctx, **options):
     if not 0 <= options["minutes"] <= 59:
         await ctx.send("Minutes not in valid range (0 <= minutes <= 59)", hidden=True)
         return
-    url = "http://api.positionstack.com/v1/forward"
-    res = http_request.get(url, {
-        "access_key": os.getenv("POSITIONSTACK_TOKEN"),
-        "query": options["timezone_location"],
-        "timezone_module": 1
-    }).json()
-    if "error" in res:
-        print(f"{res=}")
-        log.error("PositionStack error.")
-        await ctx.send("Problem finding timezone.", hidden=True)
+    try:
+        # the resolver is created on first use, so get it on the worker thread too
+        zone = await asyncio.to_thread(lambda: timezone_resolver.instance().resolve(options["timezone_location"]))
+    except ImportError:
+        log.error("tzwhere isn't installed, can't look up coordinates.")
+        await ctx.send("Looking up coordinates isn't available, try a city or timezone name.", hidden=True)
         return
-    elif "data" not in res:
-        log.error("res contains no error or data.")
-        await ctx.send("Problem finding timezone.", hidden=True)
+    if zone is None and timezone_resolver.gazetteer is None:
+        log.warning("/timestamp: location not found, city lookup unavailable without the gazetteer.")
+        await ctx.send("Looking up cities isn't available right now. Try \"lat, lon\" or a timezone name like "
+                       "Europe/London.", hidden=True)
+        return
+    if zone is None:
+        log.warning("/timestamp: location not found.")
+        await ctx.send("Couldn't find that location. Try a city, \"lat, lon\" or a timezone name like Europe/London.",
+                       hidden=True)
         return
-    else:
-        if "timezone_module" in res["data"][0]:
-            tz = res["data"][0]["timezone_module"]
-            print(tz)
-        else:
-            log.error("'timezone_module' not in res.")
-            await ctx.send("Problem finding timezone.", hidden=True)
-            return
     try:
         o = options
-        time_str = f"{o['day']:02}/{o['month']:02}/{o['year']} {o['hour']:02}:{o['minutes']:02} "\
-                   f"{tz['offset_string'].replace(':','')}"
-        print(time_str)
-        stamp = datetime.datetime.strptime(time_str, "%d/%m/%Y %H:%M %z")
+        stamp = localize(zone, o['year'], o['month'], o['day'], o['hour'], o['minutes'])
     except ValueError:
         await ctx.send("Error in parsing date. Likely that the day chosen does not exist in that month.", hidden=True)
         return
@@ -1292,6 +1316,74 @@ async def timestamp(ctx, **options):
 
 
 # <<<======================TICTACTOE:USER===============================
+TICTACTOE_DEFAULT_DIFFICULTY = "hard"  # bot difficulty when it's challenged through the context menu
+TICTACTOE_EVICT_INTERVAL = 600  # seconds between checks for abandoned games
+
+
+def tictactoe_header(player1: int, player2: int, difficulty: str = None):
+    header = f"🟦 <@{player1}> vs  🟥 <@{player2}>"
+    if difficulty is not None:
+        header += f" ({difficulty})"
+    return header + "\n"
+
+
+def tictactoe_status(game: dict, board: ttt.TicTacToe):
+    """
+    Renders the game message: the header, then whose turn it is or the result
+    """
+    msg_content = tictactoe_header(game["player1"], game["player2"], game.get("difficulty"))
+    if not board.game_over:
+        msg_content += f"**<@{game['player' + str(game['turn'])]}>'s turn!**"
+    elif board.check_win() == -1:
+        msg_content += "**Tie! No one won.**"
+    else:
+        msg_content += f"<@{game['player1']}>" if board.check_win() == 1 else f"<@{game['player2']}>"
+        msg_content += " won the game!"
+    return msg_content
+
+
+def tictactoe_bot_move(game: dict, board: ttt.TicTacToe):
+    """
+    Plays the bot's move if it's the bot's turn, and passes the turn on
+    """
+    if board.game_over or not game[f"player{game['turn']}"] == client.user.id:
+        return
+    difficulty = game.get("difficulty") or TICTACTOE_DEFAULT_DIFFICULTY
+    board.update(player=game["turn"], i=tictactoe_solver.choose(board, game["turn"], difficulty))
+    game["turn"] = 2 if game["turn"] == 1 else 1
+
+
+async def evict_tictactoe_games():
+    """
+    Periodically drops games no one has played in for a while
+    """
+    while True:
+        await asyncio.sleep(TICTACTOE_EVICT_INTERVAL)
+        evicted = tictactoe_games.evict()
+        if evicted:
+            log.standard(f"Evicted {len(evicted)} abandoned TicTacToe games, {len(tictactoe_games)} still live.")
+
+
+async def start_tictactoe(ctx, player1: int, player2: int, difficulty: str = None):
+    """
+    Posts a new game. Player 1 moves first.
+    :param ctx: the command context
+    :param player1: user id of player 1
+    :param player2: user id of player 2
+    :param difficulty: bot difficulty, if the bot is playing
+    """
+    if tictactoe_games.playing(ctx.author_id):
+        await ctx.send("You need to finish your existing games first.", hidden=True)
+        log.warning("Player tried creating a new game despite having an unfinished one.")
+        return
+    board = ttt.TicTacToe()
+    game = {"player1": player1, "player2": player2, "turn": 1, "difficulty": difficulty}
+    tictactoe_bot_move(game, board)
+    message = await ctx.send(content=tictactoe_status(game, board), components=board.get_buttons())
+    tictactoe_games.save(dict(game, game_id=message.id, board=board.get_string()))
+    log.success("TicTacToe game posted.")
+
+
 @slash.context_menu(name="TicTacToe",
                     target=ContextMenuType.USER,
                     guild_ids=_bot_values["slash_cmd_guilds"])
@@ -1299,144 +1391,87 @@ async def tictactoe(ctx: MenuContext):
     log.event("TicTacToe context action detected.")
     player1 = ctx.target_author.id
     player2 = ctx.author_id
-    if tictactoe_db.contains(where("player1") == ctx.author_id) \
-            or tictactoe_db.contains(where("player2") == ctx.author_id):
-        await ctx.send("You need to finish your existing games first.", hidden=True)
-        log.warning("Player tried creating a new game despite having an unfinished one.")
-        return
-    msg_content = ""
-    msg_content += f"🟦 <@{player1}> vs  🟥 <@{player2}>\n"
-    board = ttt.TicTacToe()
-    if player1 == client.user.id:
-        msg_content += f"**<@{player2}>'s turn!**"
-        board.update(1, ttt.compute_step(board, 1))
-    else:
-        msg_content += f"**<@{player1}>'s turn!**"
-    components = board.get_buttons()
-    message = await ctx.send(content=msg_content, components=components)
-    tictactoe_db.insert({
-        "game_id": message.id,
-        "player1": player1,
-        "player2": player2,
-        "board": board.get_string(),
-        "turn": 1 if board.blanks == 9 else 2
-    })
-    log.success("TicTacToe game posted.")
+    difficulty = TICTACTOE_DEFAULT_DIFFICULTY if client.user.id in (player1, player2) else None
+    await start_tictactoe(ctx, player1, player2, difficulty)
+
+
+@slash.slash(name="tictactoe",
+             description="Play tic-tac-toe against the bot",
+             guild_ids=_bot_values["slash_cmd_guilds"],
+             options=[
+                 manage_commands.create_option(
+                     name="difficulty",
+                     description="How well the bot plays (default: hard)",
+                     option_type=3,
+                     required=False,
+                     choices=[manage_commands.create_choice(name=name, value=name) for name in ttt.DIFFICULTIES]
+                 )
+             ])
+async def tictactoe_bot(ctx, **options):
+    log.event("/tictactoe command received")
+    await start_tictactoe(ctx, ctx.author_id, client.user.id,
+                          options.get("difficulty", TICTACTOE_DEFAULT_DIFFICULTY))
 
 
 async def handle_tictactoe_component(ctx):
-    db_item = tictactoe_db.get(where("game_id") == ctx.origin_message_id)
-    if db_item is None:  # check for message
+    game = tictactoe_games.get(ctx.origin_message_id)
+    if game is None:  # check for message
         if ctx.custom_id == "tictactoe_restart":
             board = ttt.TicTacToe()
-            players = re.findall(r"<@(\d+)>.*<@(\d+)>.*", ctx.origin_message.content)[0]
-            print(players)
-            if int(players[0]) == client.user.id:
-                board.update(1, ttt.compute_step(board, 1))
-                tictactoe_db.insert({
-                    "game_id": ctx.origin_message_id,
-                    "player1": int(players[0]),
-                    "player2": int(players[1]),
-                    "board": board.get_string(),
-                    "turn": 2
-                })
+            players = re.search(r"<@(\d+)>.*?<@(\d+)>(?: \((\w+)\))?", ctx.origin_message.content)
+            game = {
+                "game_id": ctx.origin_message_id,
+                "player1": int(players.group(1)),
+                "player2": int(players.group(2)),
+                "difficulty": players.group(3)
+            }
+            if game["player1"] == client.user.id:
+                game["turn"] = 1
             else:
-                tictactoe_db.insert({
-                    "game_id": ctx.origin_message_id,
-                    "player1": int(players[0]),
-                    "player2": int(players[1]),
-                    "board": board.get_string(),
-                    "turn": 1 if ctx.author_id == int(players[1]) else 2
-                })
-            db_item = tictactoe_db.get(where("game_id") == ctx.origin_message_id)
-            msg_content = ""
-            msg_content += f"🟦 <@{db_item['player1']}> vs  🟥 <@{db_item['player2']}>\n"
-            msg_content += f"**<@{db_item['player' + str(db_item['turn'])]}>'s turn!**"
-
-            await ctx.edit_origin(content=msg_content, components=board.get_buttons())
+                game["turn"] = 1 if ctx.author_id == game["player2"] else 2
+            tictactoe_bot_move(game, board)
+            tictactoe_games.save(dict(game, board=board.get_string()))
+            await ctx.edit_origin(content=tictactoe_status(game, board), components=board.get_buttons())
             log.success("Component action handled.")
             return
         else:
-            log.error("Component call from message not in DB.")
-            await ctx.send("There was an error handling your move.", hidden=True)
+            log.warning("Component call from a game that ended or expired.")
+            await ctx.send("This game has ended or expired. Press \"Restart game\" to play again.", hidden=True)
             return
     if ctx.custom_id == "tictactoe_restart":
         await ctx.send("Can only restart a stopped or finished game.", hidden=True)
         return
-    if not ctx.author_id == db_item["player1"] and not ctx.author_id == db_item["player2"]:
+    if not ctx.author_id == game["player1"] and not ctx.author_id == game["player2"]:
         # check if player is in the game
         log.warning("Non player attempted move. Ignoring")
         await ctx.send(f"You're not a part of this game."
                        f" You can challenge someone by right clicking their name and choosing Apps->TicTacToe",
                        hidden=True)
         return
+    board = ttt.TicTacToe()
+    board.update(full_board=game["board"])
     if ctx.custom_id == "tictactoe_stop":
-        board = ttt.TicTacToe()
-        board.update(full_board=db_item["board"])
-        msg_content = ""
-        msg_content += f"🟦 <@{db_item['player1']}> vs  🟥 <@{db_item['player2']}>\n"
+        tictactoe_games.end(ctx.origin_message_id)
+        msg_content = tictactoe_header(game["player1"], game["player2"], game.get("difficulty"))
         msg_content += f"**Game stopped by <@{ctx.author_id}>**"
         await ctx.edit_origin(content=msg_content, components=board.get_buttons(force_stop=True))
-        tictactoe_db.remove(where("game_id") == ctx.origin_message_id)
         log.success("Game stopped.")
         return
-    if not ctx.author_id == db_item[f"player{db_item['turn']}"]:
+    if not ctx.author_id == game[f"player{game['turn']}"]:
         # check if player's turn
         log.warning("Player tried to play on opponent's turn. Ignoring")
         await ctx.send("You must wait your turn to play!", hidden=True)
         return
-    board = ttt.TicTacToe()
-    board.update(full_board=db_item["board"])
-    board.update(player=db_item["turn"], i=int(ctx.custom_id[-1]))
-    tictactoe_db.update(
-        operations.set("turn", 2 if db_item["turn"] == 1 else 1),
-        where("game_id") == ctx.origin_message_id
-    )
-    tictactoe_db.update(
-        operations.set("board", board.get_string()),
-        where("game_id") == ctx.origin_message_id
-    )
+    board.update(player=game["turn"], i=int(ctx.custom_id[-1]))
+    game["turn"] = 2 if game["turn"] == 1 else 1
+    tictactoe_bot_move(game, board)
     if board.game_over:
-        msg_content = ""
-        msg_content += f"🟦 <@{db_item['player1']}> vs 🟥 <@{db_item['player2']}>\n"
-        if board.check_win() == -1:
-            msg_content += "**Tie! No one won.**"
-        else:
-            msg_content += f"<@{db_item['player1']}>" if board.check_win() == 1 else f"<@{db_item['player2']}>"
-            msg_content += " won the game!"
-        await ctx.edit_origin(content=msg_content, components=board.get_buttons())
-        tictactoe_db.remove(where("game_id") == ctx.origin_message_id)
+        tictactoe_games.end(ctx.origin_message_id)
         log.success("Game ended. Discarding.")
-        return
-    db_item = tictactoe_db.get(where("game_id") == ctx.origin_message_id)  # update item from db
-    if db_item[f"player{db_item['turn']}"] == client.user.id:
-        board.update(player=db_item['turn'], i=ttt.compute_step(board, 1))
-        if board.game_over:
-            msg_content = ""
-            msg_content += f"🟦 <@{db_item['player1']}> vs 🟥 <@{db_item['player2']}>\n"
-            if board.check_win() == -1:
-                msg_content += "**Tie! No one won.**"
-            else:
-                msg_content += f"<@{db_item['player1']}>" if board.check_win() == 1 else f"<@{db_item['player2']}>"
-                msg_content += " won the game!"
-            await ctx.edit_origin(content=msg_content, components=board.get_buttons())
-            tictactoe_db.remove(where("game_id") == ctx.origin_message_id)
-            log.success("Game ended. Discarding.")
-            return
-        tictactoe_db.update(
-            operations.set("turn", 2 if db_item["turn"] == 1 else 1),
-            where("game_id") == ctx.origin_message_id
-        )
-        tictactoe_db.update(
-            operations.set("board", board.get_string()),
-            where("game_id") == ctx.origin_message_id
-        )
-        await ctx.edit_origin(content=ctx.origin_message.content, components=board.get_buttons())
-        return
-    msg_content = ""
-    msg_content += f"🟦 <@{db_item['player1']}> vs  🟥 <@{db_item['player2']}>\n"
-    msg_content += f"**<@{db_item['player' + str(db_item['turn'])]}>'s turn!**"
-    await ctx.edit_origin(content=msg_content, components=board.get_buttons())
+    else:
+        game["board"] = board.get_string()
+        tictactoe_games.save(game)  # the move and the bot's reply in one write
+    await ctx.edit_origin(content=tictactoe_status(game, board), components=board.get_buttons())
     log.success("Component action handled.")
 # =========================TICTACTOE:USER============================>>>
 
@@ -1446,14 +1481,14 @@ async def handle_tictactoe_component(ctx):
                     name="Summon",
                     guild_ids=_bot_values["slash_cmd_guilds"])
 async def summon(ctx: MenuContext):
-    member = await ctx.guild.fetch_member(ctx.author_id)
-    if not member.voice:
+    channel = await member_resolver.voice_channel(ctx.guild, ctx.author_id)
+    if channel is None:
         log.warning("Couldn't send a summon - user not in a voice channel")
         await ctx.send("You must be in a voice channel to summon someone.", hidden=True)
         return
     embed = discord.Embed(title="You've been summoned by " + str(ctx.author) + "!",
-                          description=f"They are connected to {member.voice.channel.name}")
-    invite = await member.voice.channel.create_invite(max_uses=1, temporary=True, max_age=900)
+                          description=f"They are connected to {channel.name}")
+    invite = await channel.create_invite(max_uses=1, temporary=True, max_age=900)
     button = [
         manage_components.create_actionrow(
             manage_components.create_button(style=ButtonStyle.URL,
@@ -1474,4 +1509,7 @@ async def send_a_heart(ctx: MenuContext):
 # ==========================SEND LOVE:USER============================>>>
 
 
+startup_timer.mark("init")
 client.run(token)  # run the bot
+if storage.initialized:
+    storage.close()  # flush anything still pending
@@ -0,0 +1,75 @@
+import asyncio
+import discord
+
+
+class MemberResolver:
+    """
+    Looks up guild members from the gateway cache first (the client runs with all intents, so members and voice
+    states are cached). Cache misses are requested together through the gateway in chunks, and only fetched one by
+    one over REST if that fails.
+    """
+    def __init__(self, chunk_size: int = 100):
+        """
+        :param chunk_size: most members requested per gateway chunk request (Discord allows 100)
+        """
+        self.chunk_size = chunk_size
+        self.stats = {
+            "cache_hits": 0,
+            "chunk_requests": 0,
+            "chunked": 0,
+            "rest_fallbacks": 0,
+            "not_found": 0
+        }
+
+    async def get(self, guild: discord.Guild, user_id: int):
+        """
+        :return: the guild member, or None if the user isn't in the guild
+        """
+        return (await self.get_many(guild, [user_id])).get(user_id)
+
+    async def get_many(self, guild: discord.Guild, user_ids: list):
+        """
+        Resolves several members with at most one gateway request per chunk_size misses
+        :return: a dict of user id -> member, users not in the guild are left out
+        """
+        members = {}
+        misses = []
+        for user_id in dict.fromkeys(user_ids):
+            member = guild.get_member(user_id)
+            if member is not None:
+                members[user_id] = member
+            else:
+                misses.append(user_id)
+        self.stats["cache_hits"] += len(members)
+        for i in range(0, len(misses), self.chunk_size):
+            chunk = misses[i:i + self.chunk_size]
+            try:
+                self.stats["chunk_requests"] += 1
+                found = await guild.query_members(user_ids=chunk, limit=len(chunk), cache=True)
+            except (asyncio.TimeoutError, discord.ClientException):
+                found = await self._fetch(guild, chunk)
+            else:
+                self.stats["chunked"] += len(found)
+            for member in found:
+                members[member.id] = member
+        self.stats["not_found"] += sum(1 for user_id in misses if user_id not in members)
+        return members
+
+    async def _fetch(self, guild: discord.Guild, user_ids: list):
+        found = []
+        for user_id in user_ids:
+            self.stats["rest_fallbacks"] += 1
+            try:
+                found.append(await guild.fetch_member(user_id))
+            except (discord.NotFound, discord.Forbidden):
+                pass
+        return found
+
+    async def voice_channel(self, guild: discord.Guild, user_id: int):
+        """
+        :return: the voice channel the member is connected to, or None
+        """
+        member = await self.get(guild, user_id)
+        if member is None or member.voice is None:
+            return None
+        return member.voice.channel
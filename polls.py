@@ -0,0 +1,168 @@
+import asyncio
+import time
+import discord
+from storage import Storage
+from utils import get_number_emoji
+
+
+def new_poll(title: str, description: str, color: int, choices: list):
+    """
+    Creates a poll record with zeroed counters
+    :param title: embed title
+    :param description: embed description (the question)
+    :param color: embed color as an int
+    :param choices: list of choice strings
+    :return: a poll dict, ready for render_embed and PollTally.save
+    """
+    return {
+        "poll_id": None,
+        "title": title,
+        "description": description,
+        "color": color,
+        "choices": list(choices),
+        "counts": [0] * len(choices)
+    }
+
+
+def render_embed(poll: dict):
+    """
+    Renders a poll embed from its stored counters
+    :param poll: a poll dict
+    :return: a discord.Embed
+    """
+    total_votes = sum(poll["counts"])
+    embed = discord.Embed(title=poll["title"], color=poll["color"], description=poll["description"])
+    for i in range(len(poll["choices"])):
+        percent = int(poll["counts"][i] / total_votes * 100) if total_votes > 0 else 0
+        value = f"{poll['counts'][i]} votes ({percent}%)\n"
+        value += "▓" * int(percent // 5)
+        value += "░" * int(20 - (percent // 5))
+        embed.add_field(name=f"{get_number_emoji(i + 1)} - {poll['choices'][i]}", value=value, inline=False)
+    return embed
+
+
+class PollTally:
+    """
+    Keeps the authoritative vote counters for every poll in storage.
+    Votes are kept in the "poll" table (one row per voter) and counters in the "polls" table (one row per poll).
+    """
+    def __init__(self, storage: Storage):
+        self.storage = storage
+
+    def save(self, poll_id: int, poll: dict):
+        poll["poll_id"] = poll_id
+        self.storage.upsert("polls", poll)
+        return poll
+
+    def get(self, poll_id: int):
+        return self.storage.get("polls", poll_id)
+
+    def adopt(self, poll_id: int, embed: discord.Embed):
+        """
+        Creates counters for a poll posted before counters were kept.
+        Labels come from the embed, counts are rebuilt from the stored votes.
+        :param poll_id: the poll message id
+        :param embed: the poll's embed
+        :return: the poll dict
+        """
+        choices = [field.name.split(" - ", 1)[-1] for field in embed.fields]
+        poll = new_poll(embed.title, embed.description, embed.color.value, choices)
+        for vote in self.storage.search("poll", poll_id=poll_id):
+            option = int(vote["option_id"].split("_")[1])
+            if option < len(poll["counts"]):
+                poll["counts"][option] += 1
+        return self.save(poll_id, poll)
+
+    def vote(self, poll_id: int, user_id: int, option: int):
+        """
+        Casts or changes a user's vote
+        :param poll_id: the poll message id
+        :param user_id: the voting user
+        :param option: index of the chosen option
+        :return: the updated poll dict, or None if the poll is unknown
+        """
+        poll = self.get(poll_id)
+        if poll is None:
+            return None
+        if not 0 <= option < len(poll["counts"]):
+            raise ValueError("Option out of range for poll " + str(poll_id))
+        option_id = f"poll_{option}"
+        previous = self.storage.get("poll", (poll_id, user_id))
+        if previous is not None and previous["option_id"] == option_id:
+            return poll
+        counts = list(poll["counts"])
+        if previous is not None:
+            counts[int(previous["option_id"].split("_")[1])] -= 1
+        counts[option] += 1
+        poll["counts"] = counts
+        self.storage.write_batch([
+            ("upsert", "poll", {"poll_id": poll_id, "user_id": user_id, "option_id": option_id}),
+            ("upsert", "polls", poll)
+        ])
+        return poll
+
+
+class EditScheduler:
+    """
+    Coalesces message edits so each message gets at most one edit per window.
+    Every edit renders the latest state when it runs, so edits requested during the window are folded into it.
+    """
+    def __init__(self, window: float, on_error=None):
+        """
+        :param window: minimum seconds between two edits of the same message
+        :param on_error: optional callback taking (message_id, exception) for failed edits
+        """
+        self.window = window
+        self.on_error = on_error
+        self._pending = {}  # message_id -> async callable doing the edit
+        self._tasks = {}  # message_id -> running edit task
+        self._last_edit = {}  # message_id -> time.monotonic() of the last edit
+        self.stats = {
+            "requested": 0,
+            "performed": 0,
+            "failed": 0
+        }
+
+    @property
+    def saved(self):
+        """
+        Number of requested edits that were folded into a later one
+        """
+        return self.stats["requested"] - self.stats["performed"] - self.stats["failed"] - len(self._pending)
+
+    def request(self, message_id: int, edit):
+        """
+        Schedules an edit of a message. Replaces any edit still waiting for that message.
+        :param message_id: the message to edit
+        :param edit: an async callable without arguments, rendering the latest state and editing the message
+        """
+        self.stats["requested"] += 1
+        self._pending[message_id] = edit
+        if message_id not in self._tasks:
+            self._tasks[message_id] = asyncio.ensure_future(self._run(message_id))
+
+    async def _run(self, message_id: int):
+        try:
+            while message_id in self._pending:
+                last_edit = self._last_edit.get(message_id)
+                delay = 0 if last_edit is None else last_edit + self.window - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                edit = self._pending.pop(message_id)
+                self._last_edit[message_id] = time.monotonic()
+                try:
+                    await edit()
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    if self.on_error is not None:
+                        self.on_error(message_id, e)
+                else:
+                    self.stats["performed"] += 1
+        finally:
+            del self._tasks[message_id]
+            self._prune()
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.window
+        for message_id in [m for m, t in self._last_edit.items() if t < cutoff and m not in self._tasks]:
+            del self._last_edit[message_id]
@@ -1,13 +1,15 @@
+import asyncio
 import os
-import random
 import discord
 from dotenv import load_dotenv
 from datetime import datetime as dt
 from discord_slash import SlashCommand
 from discord_slash.utils import manage_commands
 from discord_slash.model import SlashCommandPermissionType
-from tinydb import TinyDB, where
+from storage import SQLiteStorage, SANTA_TABLES, migrate_tinydb
 from loggable import Loggable
+from gift_cycle import gift_cycle, check_bans, splice_in, splice_out, NoCycleError
+from dm_dispatch import DMDispatcher
 from colorama import init, Fore
 
 init()
@@ -15,9 +17,11 @@ load_dotenv()
 wankbunker = _____
 client = discord.Client(intents=discord.Intents.all())
 slash = SlashCommand(client, sync_commands=True)
-main_db = TinyDB("./databases/main.db")
-santa_db = main_db.table("santa")
-modifiers_db = main_db.table("modifiers")
+storage = SQLiteStorage("./databases/santa.sqlite3", SANTA_TABLES)
+migrate_tinydb(storage, "./databases/main.db", ("santa", "modifiers"))
+dm_dispatcher = DMDispatcher(client)
+santa_lock = asyncio.Lock()  # held while the gift cycle is read, drawn or repaired, and written back
+SANTA_PROGRESS_INTERVAL = 10  # seconds between progress reports while sending the Santa DMs
 token = os.getenv("BOTTINGSON_TOKEN")
 log = Loggable(
     "./santa_logs/" + dt.now().strftime("%H%M%S_%d%m%Y.log"),
@@ -83,14 +87,31 @@ async def on_ready():
              ])
 async def joinlist(ctx, **address):
     log.success(str(ctx.author) + " has joined this year's secret Santa!")
-    santa_db.upsert({
-        "userID": ctx.author_id,
-        "firstName": address["firstname"],
-        "lastName": address["lastname"],
-        "address1": address["address1"],
-        "address2": address["address2"],
-        "country": address["country"]
-    }, where("userID") == ctx.author_id)
+    receivers = []
+    async with santa_lock:  # read, splice and write the cycle without awaiting in between
+        santas = {row["userID"]: row for row in storage.all("santa")}
+        joining = ctx.author_id not in santas
+        santas[ctx.author_id] = dict(santas.get(ctx.author_id, {}), **{  # keep any assignment
+            "userID": ctx.author_id,
+            "firstName": address["firstname"],
+            "lastName": address["lastname"],
+            "address1": address["address1"],
+            "address2": address["address2"],
+            "country": address["country"]
+        })
+        assignment = current_assignment(santas)
+        if joining and assignment:  # Santas were already drawn, fit them into the cycle
+            bans = load_bans()
+            if ctx.author_id not in bans:  # same rule as assign_chimneys
+                log.warning(f"No modifiers entry, {address['firstname']} not added to the Santa cycle.")
+            else:
+                try:
+                    receivers = repair_cycle(santas, splice_in(assignment, ctx.author_id, bans))
+                except NoCycleError as e:
+                    log.warning(f"Couldn't fit {address['firstname']} into the Santa cycle, needs a reshuffle: {e}")
+        rows = {row["userID"]: row for row in receivers}
+        rows[ctx.author_id] = santas[ctx.author_id]
+        storage.write_batch([("upsert", "santa", row) for row in rows.values()])
     reply_embed = discord.Embed(
         title="You've successfully joined this year's secret Santa!",
         description="The following is the address you entered, you may use the command again to update it:\n```" +
@@ -99,6 +120,8 @@ async def joinlist(ctx, **address):
         color=0xF40000
     )
     await ctx.send(embed=reply_embed, ephemeral=True)
+    if receivers:
+        await send_santa_dms(None, santas, receivers)
 
 
 @slash.slash(
@@ -117,13 +140,32 @@ async def joinlist(ctx, **address):
 )
 async def leavelist(ctx, **options):
     if options["ireallywannaleave"]:
-        removed = santa_db.remove(where("userID") == ctx.author_id)
-        if len(removed) == 0:
+        receivers = []
+        async with santa_lock:  # read, splice and write the cycle without awaiting in between
+            santas = {row["userID"]: row for row in storage.all("santa")}
+            leaving = santas.get(ctx.author_id)
+            assignment = current_assignment(santas)
+            if leaving is not None and ctx.author_id in assignment:
+                try:  # Santas were already drawn, close the gap they leave in the cycle
+                    receivers = repair_cycle(santas, splice_out(assignment, ctx.author_id, load_bans()))
+                except NoCycleError as e:
+                    log.error(f"Couldn't take {leaving['firstName']} out of the Santa cycle: {e}")
+                    leaving = False
+            if leaving:
+                del santas[ctx.author_id]
+                storage.write_batch([("upsert", "santa", row) for row in receivers] +
+                                    [("remove", "santa", ctx.author_id)])
+        if leaving is None:  # not in the list
             await ctx.send("Seems you weren't in the list in the first place.", ephemeral=True)
+        elif leaving is False:  # couldn't be spliced out
+            await ctx.send("Santas have already been assigned and you can't be taken out without a new draw. "
+                           "Please ask the organizer.", ephemeral=True)
         else:
             await ctx.send("Sad to see you leave! Enjoy your holiday, hope you join us next year!", ephemeral=True)
+            if receivers:
+                await send_santa_dms(None, santas, receivers)
     else:
-        if santa_db.contains(where("userID") == ctx.author_id):
+        if storage.contains("santa", ctx.author_id):
             await ctx.send("Glad to have you with us!", ephemeral=True)
         else:
             await ctx.send("It seems you're not yet in the list, use /joinlist to join!", ephemeral=True)
@@ -136,52 +178,172 @@ async def leavelist(ctx, **options):
     default_permission=False,
     permissions={
         wankbunker: [manage_commands.create_permission(_____, SlashCommandPermissionType.USER, True)]
-    }
+    },
+    options=[
+        manage_commands.create_option(
+            name="reshuffle",
+            option_type=5,
+            description="Draw new Santas for everyone, even if Santas were already assigned.",
+            required=False
+        )
+    ]
 )
-async def assign_chimneys(ctx):
-    ban_seed = modifiers_db.all()
-    joined_santas = []
-    santas = santa_db.all()
-    for i in range(len(santas)):
-        for j in range(len(ban_seed)):
-            if ban_seed[j]["id"] == santas[i]["userID"]:
-                joined_santas.append(ban_seed[j])
-    else:
-        random.shuffle(joined_santas)
-        santa_list = find_list(joined_santas, [])
-    if not santa_list:
-        await ctx.send("Can't find a no-repeat list.", ephemeral=True)
-    if len(santa_list) <= 1:
-        await ctx.send("Not enough people have joined!", ephemeral=True)
+async def assign_chimneys(ctx, **options):
+    async with santa_lock:  # no joins or leaves between reading the list and storing the draw
+        error, santas, receivers = await draw_santas(options.get("reshuffle"))
+    if error is not None:
+        await ctx.send(error, ephemeral=True)
         return
+    await send_santa_dms(ctx, santas, receivers)
+
+
+async def draw_santas(reshuffle: bool):
+    """
+    Draws and stores a Santa for everyone who opted in, or picks up the last draw's unsent DMs.
+    Must be called holding santa_lock.
+    :param reshuffle: draw again even if Santas were already assigned
+    :return: an error message for the organizer (None on success), userID -> santa row,
+    and the rows whose Santas should be sent their target
+    """
+    santas = {row["userID"]: row for row in storage.all("santa")}
+    assigned = [row for row in santas.values() if row.get("santaID") is not None]
+    if assigned and not reshuffle:  # resume sending the DMs of the last draw
+        # only rows drawn by this bot have notified=False, older or migrated draws (None) were already sent
+        pending = [row for row in assigned if row.get("notified") is False]
+        if not pending:
+            return "Every Santa already knows their target. Use reshuffle to draw again.", santas, []
+        log.event(f"Resuming Santa DMs: {len(pending)} of {len(assigned)} left.")
+        return None, santas, pending
+    modifiers = {row["id"]: row for row in storage.all("modifiers")}
+    joined_santas = [modifiers[user_id] for user_id in santas if user_id in modifiers]
+    skipped = [santas[user_id]["firstName"] for user_id in santas if user_id not in modifiers]
+    if skipped:
+        log.warning("No modifiers entry, not assigned: " + ", ".join(skipped))
+    if len(joined_santas) <= 1:
+        return "Not enough people have joined!", santas, []
+    names = {user_id: row["firstName"] for user_id, row in santas.items()}
+    bans = {s["id"]: s["ban"] or [] for s in joined_santas}
+    problems = check_bans(list(bans), bans, names)
+    if problems:
+        log.error(f"Santa bans can't be satisfied: {problems}")
+        return "Can't find a no-repeat list:\n" + describe_ban_problems(problems, names), santas, []
+    try:
+        santa_list = await asyncio.to_thread(gift_cycle, list(bans), bans)
+    except NoCycleError as e:
+        log.error("Couldn't assign Santas: " + str(e))
+        return "Can't find a no-repeat list. " + str(e), santas, []
+    for user_id in santas:  # clear draws of anyone left out this time
+        santas[user_id] = dict(santas[user_id], santaID=None, notified=None)
     for i in range(len(santa_list)):
-        # print(f"{santa_list[i] = }")
-        receiver = santa_db.get(where("userID") == santa_list[i]["id"])
-        giver = santa_db.get(where("userID") == santa_list[i-1]["id"])
-        user = await client.fetch_user(giver["userID"])
-        embed = discord.Embed(title=f"Merry Christmas {giver['firstName']}!",
-                              description=f"This year, you will be {receiver['firstName']}'s Santa!\n"
-                                          f"**Their address is:**\n```{receiver['firstName']} {receiver['lastName']}\n"
-                                          f"{receiver['address1']}\n{receiver['address2']}\n{receiver['country']}```\n"
-                                          f"***The Rules are as follows:***",
-                              color=0xf50000)
-        embed.add_field(name="Rule #1", value="All gifts must be under the total of £25. Shipping not included.",
-                        inline=False)
-        embed.add_field(name="Rule #2", value="Try to prevent people knowing who their Santa is.", inline=False)
-        embed.add_field(name="Rule #3", value="*No* NSFW gifts!",
-                        inline=False)
-        embed.add_field(name="Rule #4", value="Try to give people a gift they'd like, even if it's some weeb shit.",
-                        inline=False)
-        embed.add_field(name="Rule #5", value="All gifts should arrive at least a week before Dec 25th."
-                                              f" We'll try to open them together on Christmas week"
-                                              f" (probably won't happen)",
-                        inline=False)
-        santa_db.update({"santaID": giver["userID"]}, where("userID") == receiver["userID"])
-        santa_db.update({"received": False}, where("userID") == receiver["userID"])
-        await user.send(embed=embed)
+        santas[santa_list[i]] = dict(santas[santa_list[i]], santaID=santa_list[i - 1], received=False, notified=False)
+    storage.write_batch([  # every assignment in one transaction
+        ("upsert", "santa", row) for row in santas.values()
+    ])
+    return None, santas, [santas[user_id] for user_id in santa_list]
+
+
+def load_bans():
+    return {row["id"]: row["ban"] or [] for row in storage.all("modifiers")}
+
+
+def current_assignment(santas: dict):
+    """
+    :param santas: userID -> santa row
+    :return: giver -> receiver of the current draw, empty if Santas weren't assigned yet
+    """
+    return {row["santaID"]: user_id for user_id, row in santas.items() if row.get("santaID") is not None}
+
+
+def repair_cycle(santas: dict, changes: dict):
+    """
+    Applies a locally repaired gift cycle to the santa rows, leaving whether gifts were received untouched
+    :param santas: userID -> santa row, updated in place
+    :param changes: giver -> new receiver, from splice_in or splice_out
+    :return: the receiver rows whose Santa changed, to store and DM
+    """
+    receivers = []
+    for giver, receiver in changes.items():
+        santas[receiver] = dict(santas[receiver], santaID=giver, notified=False)
+        receivers.append(santas[receiver])
+    log.event("Santa cycle repaired, new targets for: " + ", ".join(santas[giver]["firstName"] for giver in changes))
+    return receivers
+
+
+def santa_embed(giver: dict, receiver: dict):
+    embed = discord.Embed(title=f"Merry Christmas {giver['firstName']}!",
+                          description=f"This year, you will be {receiver['firstName']}'s Santa!\n"
+                                      f"**Their address is:**\n```{receiver['firstName']} {receiver['lastName']}\n"
+                                      f"{receiver['address1']}\n{receiver['address2']}\n{receiver['country']}```\n"
+                                      f"***The Rules are as follows:***",
+                          color=0xf50000)
+    embed.add_field(name="Rule #1", value="All gifts must be under the total of £25. Shipping not included.",
+                    inline=False)
+    embed.add_field(name="Rule #2", value="Try to prevent people knowing who their Santa is.", inline=False)
+    embed.add_field(name="Rule #3", value="*No* NSFW gifts!",
+                    inline=False)
+    embed.add_field(name="Rule #4", value="Try to give people a gift they'd like, even if it's some weeb shit.",
+                    inline=False)
+    embed.add_field(name="Rule #5", value="All gifts should arrive at least a week before Dec 25th."
+                                          f" We'll try to open them together on Christmas week"
+                                          f" (probably won't happen)",
+                    inline=False)
+    return embed
+
+
+async def send_santa_dms(ctx, santas: dict, receivers: list):
+    """
+    DMs each receiver's Santa their target, marking the receiver's row as notified once sent
+    :param ctx: the organizer's command context for progress reports, or None to send without reporting
+    :param santas: userID -> santa row, of everyone taking part
+    :param receivers: the rows whose Santas should be sent their target
+    """
+    jobs = [(receiver["userID"], receiver["santaID"], {"embed": santa_embed(santas[receiver["santaID"]], receiver)})
+            for receiver in receivers]
+
+    def mark_notified(user_id):
+        storage.update("santa", user_id, notified=True)
+
+    async def progress(sent, failed, total):
+        log.standard(f"Santa DMs: {sent}/{total} sent, {failed} failed.")
+        await ctx.send(f"{sent}/{total} sent, {failed} failed so far.", ephemeral=True)
+
+    if ctx is not None:
+        await ctx.send(f"Sending {len(jobs)} Santa DMs...", ephemeral=True)
+    result = await dm_dispatcher.dispatch(jobs, on_sent=mark_notified, on_progress=progress if ctx else None,
+                                          progress_every=SANTA_PROGRESS_INTERVAL)
+    for user_id, e in result["failed"].items():  # left unnotified, the next /assign_chimneys resends them
+        log.error(f"Couldn't DM {santas[santas[user_id]['santaID']]['firstName']}'s target: {e}")
+    if ctx is None:
+        return
+    if result["failed"]:
+        failed = ", ".join(santas[santas[user_id]["santaID"]]["firstName"] for user_id in result["failed"])
+        await ctx.send(f"Sent {len(result['sent'])} of {len(jobs)}. Couldn't DM: {failed}. "
+                       f"Run the command again (without reshuffle) to retry them.", ephemeral=True)
+        return
+    log.success(f"Santa list sent to {len(jobs)} Santas.")
     await ctx.send("Santa list sent!", ephemeral=True)
 
 
+def describe_ban_problems(problems: list, names: dict, max_bans: int = 10):
+    """
+    Formats check_bans problems for the organizer
+    :param problems: problems from check_bans
+    :param names: userID -> first name
+    :param max_bans: most bans to list per problem
+    :return: a message listing each problem and the bans causing it
+    """
+    lines = []
+    for problem in problems:
+        lines.append("- " + problem["reason"])
+        bans = [f"{names.get(giver, giver)} -> {names.get(receiver, receiver)}"
+                for giver, receiver in problem["bans"][:max_bans]]
+        if len(problem["bans"]) > max_bans:
+            bans.append(f"and {len(problem['bans']) - max_bans} more")
+        if bans:
+            lines.append("  Lifting any one of these bans fixes it: " + ", ".join(bans))
+    return "\n".join(lines)
+
+
 @slash.slash(
     name="dearsanta",
     description="Send your Santa a message!",
@@ -196,7 +358,10 @@ async def assign_chimneys(ctx):
     ]
 )
 async def dearsanta(ctx, message):
-    receiver = santa_db.get(where("userID") == ctx.author_id)
+    receiver = storage.get("santa", ctx.author_id)
+    if receiver is None or receiver["santaID"] is None:
+        await ctx.send("You don't have a Santa yet.", ephemeral=True)
+        return
     santa = await client.fetch_user(int(receiver["santaID"]))
     if not santa:
         await ctx.send("Couldn't find santa - Report the problem to Siv.", ephemeral=True)
@@ -222,7 +387,11 @@ async def dearsanta(ctx, message):
     ]
 )
 async def hohoho(ctx, message):
-    santa = santa_db.get(where("santaID") == ctx.author_id)
+    targets = storage.search("santa", santaID=ctx.author_id)
+    if not targets:
+        await ctx.send("You haven't been assigned anyone yet.", ephemeral=True)
+        return
+    santa = targets[0]
     receiver = await client.fetch_user(int(santa["userID"]))
     if not receiver:
         await ctx.send("Couldn't find target - Report the problem to Siv.", ephemeral=True)
@@ -234,32 +403,4 @@ async def hohoho(ctx, message):
     await ctx.send(f"Message sent to {santa['firstName']}.", ephemeral=True)
 
 
-def find_list(remaining, solution):
-    if not remaining:
-        if not solution:
-            raise ValueError("Both parameter lists empty.")
-        if len(solution) == 1:
-            return solution
-        if solution[0]["id"] not in solution[-1]["ban"] and solution[1]["id"] not in solution[0]["ban"]:
-            return solution
-        return None
-    for i in range(len(remaining)):
-        # print(f"{i = }, {remaining = }")
-        if not solution:
-            temp = find_list(remove_from_list(remaining.copy(), i), [remaining[i]])
-            if temp is not None:
-                return temp
-        elif remaining[i]["id"] not in solution[-1]["ban"]:
-            temp = find_list(remove_from_list(remaining.copy(), i), [*solution, remaining.copy().pop(i)])
-            if temp is not None:
-                return temp
-    return None
-
-
-def remove_from_list(lst: list, index: int):
-    temp = lst.copy()
-    temp.remove(temp[index])
-    return temp
-
-
 client.run(token)  # run the bot
@@ -0,0 +1,122 @@
+import asyncio
+import re
+import time
+from aiohttp import web
+from storage import Storage
+from ttl_cache import TTLCache
+from utils import magnet_shorten
+
+
+def info_hash(magnet: str):
+    """
+    Extracts the info-hash of a magnet link
+    :param magnet: a magnet link
+    :return: the lowercase info-hash, or None if the link has none
+    """
+    match = re.search(r"xt=urn:btih:([0-9a-zA-Z]+)", magnet)
+    return match.group(1).lower() if match else None
+
+
+class MagnetShortener:
+    """
+    Shortens magnet links through TinyURL, caching short links by info-hash.
+    Misses are shortened concurrently. If TinyURL is slow or failing, a link to the local redirect server is used
+    instead (when one is configured), while the TinyURL request keeps going in the background to fill the cache.
+    """
+    def __init__(self, token: str, storage: Storage = None, redirect_base: str = None, timeout: float = 3,
+                 ttl: float = 180 * 24 * 3600):
+        """
+        :param token: the TinyURL api token
+        :param storage: storage with a "cache" table to persist links in
+        :param redirect_base: public base url of the local redirect server, e.g. "https://bot.example.com"
+        :param timeout: seconds to wait for TinyURL before falling back to the local redirect
+        :param ttl: seconds to keep short links
+        """
+        self.token = token
+        self.redirect_base = redirect_base.rstrip("/") if redirect_base else None
+        self.timeout = timeout
+        self.links = TTLCache("magnet", ttl, 2048, storage)
+        self.targets = TTLCache("magnet_target", ttl, 2048, storage)  # info-hash -> magnet, for the redirects
+        self._in_flight = {}  # info-hash -> TinyURL task
+        self.stats = {
+            "calls": 0,
+            "fallbacks": 0,
+            "failures": 0,
+            "total_ms": 0.0,
+            "last_ms": 0.0
+        }
+
+    @property
+    def hit_ratio(self):
+        return self.links.hit_ratio
+
+    @property
+    def avg_ms(self):
+        return self.stats["total_ms"] / self.stats["calls"] if self.stats["calls"] else 0.0
+
+    async def _tinyurl(self, key: str, magnet: str):
+        try:
+            link = await magnet_shorten(self.token, magnet)
+        finally:
+            self._in_flight.pop(key, None)
+        self.links.set(key, link)
+        return link
+
+    async def shorten(self, magnet: str):
+        """
+        Gets a short link for a magnet link
+        :param magnet: a magnet link
+        :return: a short link, or None if shortening failed and there's no local redirect to fall back to
+        """
+        start = time.perf_counter()
+        try:
+            return await self._shorten(magnet)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.stats["calls"] += 1
+            self.stats["total_ms"] += elapsed
+            self.stats["last_ms"] = elapsed
+
+    async def _shorten(self, magnet: str):
+        key = info_hash(magnet) or magnet
+        link = self.links.get(key)
+        if link is not None:
+            return link
+        if key not in self._in_flight:
+            self._in_flight[key] = asyncio.ensure_future(self._tinyurl(key, magnet))
+            self._in_flight[key].add_done_callback(lambda t: t.cancelled() or t.exception())  # mark errors as seen
+        task = self._in_flight[key]
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.timeout)
+        except (asyncio.TimeoutError, NameError):
+            if self.redirect_base is None or key == magnet:
+                self.stats["failures"] += 1
+                return None
+            self.stats["fallbacks"] += 1
+            self.targets.set(key, magnet)
+            return f"{self.redirect_base}/m/{key}"
+
+    async def shorten_many(self, magnets: list):
+        """
+        Shortens several magnet links at once
+        :return: a list of short links (None for failures) in the order of magnets
+        """
+        return list(await asyncio.gather(*[self.shorten(magnet) for magnet in magnets]))
+
+    async def redirect(self, request: web.Request):
+        magnet = self.targets.get(request.match_info["info_hash"].lower())
+        if magnet is None:
+            raise web.HTTPNotFound()
+        raise web.HTTPFound(magnet)
+
+    async def start_redirect_server(self, host: str, port: int):
+        """
+        Serves /m/{info_hash} redirects to the magnet links handed out as fallbacks
+        :return: the aiohttp runner, to clean up with runner.cleanup()
+        """
+        app = web.Application()
+        app.router.add_get("/m/{info_hash}", self.redirect)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
@@ -0,0 +1,93 @@
+import json
+import threading
+import time
+from datetime import datetime as dt
+
+
+class StartupTimer:
+    """
+    Measures how long each startup phase takes, so cold starts can be compared across releases.
+    """
+    def __init__(self):
+        self._last = time.perf_counter()
+        self.started = self._last
+        self.phases = {}  # phase name -> seconds, in the order they were recorded
+
+    def mark(self, phase: str):
+        """
+        Ends a phase that started at the previous mark
+        :param phase: phase name
+        :return: the phase's duration in seconds
+        """
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+        return self.phases[phase]
+
+    def record(self, phase: str, seconds: float):
+        """
+        Records a phase measured elsewhere (e.g. on a worker thread), without moving the marks
+        """
+        self.phases[phase] = seconds
+
+    @property
+    def total(self):
+        return self._last - self.started
+
+    def report(self):
+        return ", ".join(f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in self.phases.items())
+
+    def save(self, path: str, release: str = None):
+        """
+        Appends the timings as a JSON line to a file
+        :param path: file to append to
+        :param release: release identifier to store alongside the timings
+        """
+        with open(path, "a+") as f:
+            f.write(json.dumps({
+                "time": dt.now().isoformat(timespec="seconds"),
+                "release": release,
+                "total_ms": round(self.total * 1000, 1),
+                "phases_ms": {phase: round(seconds * 1000, 1) for phase, seconds in self.phases.items()}
+            }) + "\n")
+
+
+class Lazy:
+    """
+    Creates an object on first use. Attribute access is forwarded to the object, so a Lazy can stand in for it.
+    Its own public names (instance, initialized) shadow the object's, so they mustn't clash with the methods of
+    the objects it wraps (e.g. Storage.get).
+    """
+    def __init__(self, factory, name: str, timer: StartupTimer = None):
+        """
+        :param factory: callable without arguments creating the object
+        :param name: name to record the creation time under
+        :param timer: optional StartupTimer to record the creation time in
+        """
+        self._factory = factory
+        self._name = name
+        self._timer = timer
+        self._instance = None
+        self._lock = threading.Lock()
+
+    @property
+    def initialized(self):
+        return self._instance is not None
+
+    def instance(self):
+        """
+        :return: the object, created on the first call
+        """
+        if self._instance is None:
+            with self._lock:  # the object may be warming on another thread
+                if self._instance is None:
+                    start = time.perf_counter()
+                    self._instance = self._factory()
+                    if self._timer is not None:
+                        self._timer.record("init:" + self._name, time.perf_counter() - start)
+        return self._instance
+
+    def __getattr__(self, item):
+        if item.startswith("_"):
+            raise AttributeError(item)
+        return getattr(self.instance(), item)
@@ -0,0 +1,267 @@
+import json
+import os
+import sqlite3
+import threading
+
+
+class Table:
+    def __init__(self, name: str, key: tuple, columns: tuple = (), indexes: tuple = (), json_columns: tuple = (),
+                 bool_columns: tuple = ()):
+        """
+        Describes a storage table
+        :param name: The table name
+        :param key: Tuple of column names that uniquely identify a row (indexed as the primary key)
+        :param columns: Tuple of the remaining column names
+        :param indexes: Tuple of column tuples to build secondary indexes on
+        :param json_columns: Columns whose values are lists/dicts and get stored as JSON
+        :param bool_columns: Columns whose values are booleans (SQLite stores them as 0 and 1)
+        """
+        self.name = name
+        self.key = key
+        self.columns = columns
+        self.indexes = indexes
+        self.json_columns = json_columns
+        self.bool_columns = bool_columns
+
+    @property
+    def all_columns(self):
+        return self.key + self.columns
+
+    def key_of(self, row: dict):
+        return tuple(row[col] for col in self.key)
+
+
+# All tables the bot keeps. Primary keys double as the lookup indexes used by the handlers.
+TABLES = {
+    "meta": Table("meta", key=("name",), columns=("value",)),
+    "poll": Table("poll", key=("poll_id", "user_id"), columns=("option_id",)),
+    "polls": Table("polls", key=("poll_id",), columns=("title", "description", "color", "choices", "counts"),
+                   json_columns=("choices", "counts")),
+    "watchlist": Table("watchlist", key=("user_id", "film_id"), columns=("title", "year"), indexes=(("film_id",),)),
+    "tictactoe": Table("tictactoe", key=("game_id",),
+                       columns=("player1", "player2", "board", "turn", "difficulty", "updated"),
+                       indexes=(("player1",), ("player2",)))
+}
+
+# Tables of the secret Santa bot (santa.py), kept in their own database file.
+SANTA_TABLES = {
+    "meta": TABLES["meta"],
+    "santa": Table("santa", key=("userID",),
+                   columns=("firstName", "lastName", "address1", "address2", "country", "santaID", "received",
+                            "notified"),  # notified: this row's Santa was sent their target
+                   indexes=(("santaID",),), bool_columns=("received", "notified")),
+    "modifiers": Table("modifiers", key=("id",), columns=("ban",), json_columns=("ban",))
+}
+
+# Tables for disposable caches, kept in their own database file.
+CACHE_TABLES = {
+    "cache": Table("cache", key=("namespace", "key"), columns=("value", "expires"), json_columns=("value",))
+}
+
+
+class Storage:
+    """
+    Base class for the bot's storage backends.
+    Rows are plain dicts, keys are tuples ordered like Table.key (a single value is accepted for one-column keys).
+    Backends implement get, search, all, write_batch and close.
+    """
+    def __init__(self, tables: dict = None):
+        self.tables = TABLES if tables is None else tables
+
+    def table(self, name: str) -> Table:
+        if name not in self.tables:
+            raise KeyError("Unknown table " + name)
+        return self.tables[name]
+
+    def get(self, table: str, key):
+        """
+        Gets a single row by its key
+        :param table: table name
+        :param key: key tuple (or a single value for one-column keys)
+        :return: the row as a dict, or None if missing
+        """
+        raise NotImplementedError()
+
+    def search(self, table: str, **fields):
+        """
+        Finds all rows whose columns equal the passed values
+        :param table: table name
+        :param fields: column=value pairs to match
+        :return: a list of rows
+        """
+        raise NotImplementedError()
+
+    def all(self, table: str):
+        raise NotImplementedError()
+
+    def write_batch(self, ops: list):
+        """
+        Applies several writes atomically
+        :param ops: a list of ("upsert", table, row) and ("remove", table, key) tuples
+        :return: number of rows changed
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def contains(self, table: str, key):
+        return self.get(table, key) is not None
+
+    def upsert(self, table: str, row: dict):
+        self.write_batch([("upsert", table, row)])
+
+    def remove(self, table: str, key):
+        """
+        Removes a row by its key
+        :return: True if a row was removed
+        """
+        return self.write_batch([("remove", table, key)]) > 0
+
+    def update(self, table: str, key, **fields):
+        """
+        Updates columns of an existing row
+        :return: the updated row, or None if there was no such row
+        """
+        row = self.get(table, key)
+        if row is None:
+            return None
+        row.update(fields)
+        self.upsert(table, row)
+        return row
+
+
+def as_key(key):
+    return key if isinstance(key, tuple) else (key,)
+
+
+class SQLiteStorage(Storage):
+    """
+    SQLite backed storage, using a write-ahead log so reads don't wait on writes.
+    """
+    def __init__(self, path: str, tables: dict = None):
+        super().__init__(tables)
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+
+    def _create_tables(self):
+        with self._lock:
+            for table in self.tables.values():
+                self._conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table.name} "
+                    f"({', '.join(table.all_columns)}, PRIMARY KEY ({', '.join(table.key)}))"
+                )
+                existing = {row["name"] for row in self._conn.execute(f"PRAGMA table_info({table.name})")}
+                for col in table.all_columns:
+                    if col not in existing:  # columns added after the table was first created
+                        self._conn.execute(f"ALTER TABLE {table.name} ADD COLUMN {col}")
+                for index in table.indexes:
+                    self._conn.execute(
+                        f"CREATE INDEX IF NOT EXISTS ix_{table.name}_{'_'.join(index)} "
+                        f"ON {table.name} ({', '.join(index)})"
+                    )
+
+    def _decode(self, table: Table, row: sqlite3.Row):
+        res = dict(row)
+        for col in table.json_columns:
+            if res.get(col) is not None:
+                res[col] = json.loads(res[col])
+        for col in table.bool_columns:
+            if res.get(col) is not None:
+                res[col] = bool(res[col])
+        return res
+
+    def _encode(self, table: Table, row: dict):
+        return [json.dumps(row.get(col)) if col in table.json_columns and row.get(col) is not None else row.get(col)
+                for col in table.all_columns]
+
+    def get(self, table: str, key):
+        t = self.table(table)
+        key = as_key(key)
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT * FROM {t.name} WHERE {' AND '.join(col + ' = ?' for col in t.key)}", key
+            ).fetchone()
+        return None if row is None else self._decode(t, row)
+
+    def search(self, table: str, **fields):
+        t = self.table(table)
+        for col in fields:
+            if col not in t.all_columns:
+                raise KeyError(f"Unknown column {col} in table {table}")
+        query = f"SELECT * FROM {t.name}"
+        if fields:
+            query += " WHERE " + " AND ".join(col + " = ?" for col in fields)
+        with self._lock:
+            rows = self._conn.execute(query, list(fields.values())).fetchall()
+        return [self._decode(t, row) for row in rows]
+
+    def all(self, table: str):
+        return self.search(table)
+
+    def write_batch(self, ops: list):
+        changed = 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for op, table, arg in ops:
+                    t = self.table(table)
+                    if op == "upsert":
+                        cur = self._conn.execute(
+                            f"INSERT OR REPLACE INTO {t.name} ({', '.join(t.all_columns)}) "
+                            f"VALUES ({', '.join('?' * len(t.all_columns))})",
+                            self._encode(t, arg)
+                        )
+                    elif op == "remove":
+                        cur = self._conn.execute(
+                            f"DELETE FROM {t.name} WHERE {' AND '.join(col + ' = ?' for col in t.key)}",
+                            as_key(arg)
+                        )
+                    else:
+                        raise ValueError("Unknown storage operation " + str(op))
+                    changed += cur.rowcount
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            else:
+                self._conn.execute("COMMIT")
+        return changed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def migrate_tinydb(storage: Storage, tinydb_path: str, tables: tuple):
+    """
+    Copies tables out of a TinyDB JSON file into the storage, once per table.
+    The TinyDB file is left in place.
+    :param storage: the storage to migrate into
+    :param tinydb_path: path of the TinyDB file
+    :param tables: names of the tables to migrate
+    :return: number of rows migrated
+    """
+    pending = [name for name in tables if storage.get("meta", "migrated:" + name) is None]
+    if not pending:
+        return 0
+    data = {}
+    if os.path.exists(tinydb_path) and os.path.getsize(tinydb_path) > 0:
+        with open(tinydb_path) as f:
+            data = json.load(f)
+    migrated = 0
+    for name in pending:
+        t = storage.table(name)
+        ops = []
+        for doc in data.get(name, {}).values():
+            if not all(col in doc for col in t.key):  # skip malformed documents
+                continue
+            ops.append(("upsert", name, {col: doc.get(col) for col in t.all_columns}))
+        ops.append(("upsert", "meta", {"name": "migrated:" + name, "value": len(ops)}))
+        storage.write_batch(ops)
+        migrated += len(ops) - 1
+    return migrated
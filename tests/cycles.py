@@ -0,0 +1,66 @@
+"""
+Checks and brute force references shared by the gift cycle tests
+"""
+import random
+from itertools import permutations
+from gift_cycle import assignments
+
+
+def random_bans(people: list, density: float, rng: random.Random):
+    return {p: [q for q in people if q != p and rng.random() < density] for p in people}
+
+
+def is_valid_cycle(order: list, people: list, bans: dict):
+    """
+    True if order visits everyone exactly once and no one gives to someone they're banned from
+    """
+    if sorted(order) != sorted(people):
+        return False
+    return all(receiver != giver and receiver not in bans.get(giver, ())
+               for giver, receiver in assignments(order).items())
+
+
+def is_valid_assignment(assignment: dict, people: list, bans: dict):
+    """
+    True if the giver -> receiver assignment is a single cycle through everyone that respects the bans
+    """
+    if sorted(assignment) != sorted(people) or sorted(assignment.values()) != sorted(people):
+        return False
+    order = [people[0]]
+    while len(order) < len(people):
+        order.append(assignment[order[-1]])
+    return assignment[order[-1]] == people[0] and is_valid_cycle(order, people, bans)
+
+
+def allowed(bans: dict, giver, receiver):
+    return giver != receiver and receiver not in bans.get(giver, ())
+
+
+def brute_force_cycle(people: list, bans: dict):
+    first, rest = people[0], people[1:]
+    return any(is_valid_cycle([first, *order], people, bans) for order in permutations(rest))
+
+
+def brute_force_checks(people: list, bans: dict):
+    """
+    What check_bans looks for: a perfect giver -> receiver matching and a strongly connected allowed graph
+    """
+    cover = any(all(allowed(bans, g, r) for g, r in zip(people, receivers)) for receivers in permutations(people))
+
+    def reach(start, forward):
+        seen, stack = {start}, [start]
+        while stack:
+            p = stack.pop()
+            for q in people:
+                if q not in seen and (allowed(bans, p, q) if forward else allowed(bans, q, p)):
+                    seen.add(q)
+                    stack.append(q)
+        return len(seen) == len(people)
+
+    return cover and reach(people[0], True) and reach(people[0], False)
+
+
+def apply_changes(assignment: dict, changes: dict, removed=None):
+    assignment = {**assignment, **changes}
+    assignment.pop(removed, None)
+    return assignment
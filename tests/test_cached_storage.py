@@ -0,0 +1,116 @@
+import json
+import pytest
+from startup import Lazy
+from storage import SQLiteStorage
+from cached_storage import CachedStorage
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "main.sqlite3"), str(tmp_path / "main.journal")
+
+
+def crash(cached: CachedStorage):
+    """
+    Stops using a cached storage without flushing it, like a killed process
+    """
+    cached._journal.close()
+    cached.backend.close()
+
+
+def test_journal_replay_restores_unflushed_writes(paths):
+    db_path, journal_path = paths
+    cached = CachedStorage(SQLiteStorage(db_path), journal_path)
+    cached.upsert("watchlist", {"user_id": 1, "film_id": "0078748", "title": "Alien", "year": 1979})
+    cached.flush()
+    cached.upsert("watchlist", {"user_id": 2, "film_id": "0078748", "title": "Alien", "year": 1979})
+    cached.remove("watchlist", (1, "0078748"))
+    cached.update("watchlist", (2, "0078748"), year=1980)
+    assert SQLiteStorage(db_path).get("watchlist", (1, "0078748")) is not None  # not flushed yet
+    crash(cached)
+
+    restored = CachedStorage(SQLiteStorage(db_path), journal_path)
+    assert restored.stats["replayed"] == 3
+    assert restored.get("watchlist", (1, "0078748")) is None
+    assert restored.get("watchlist", (2, "0078748"))["year"] == 1980
+    assert restored.search("watchlist", film_id="0078748") == [restored.get("watchlist", (2, "0078748"))]
+    restored.close()
+    assert SQLiteStorage(db_path).all("watchlist") == [
+        {"user_id": 2, "film_id": "0078748", "title": "Alien", "year": 1980}
+    ]
+
+
+def test_journal_replay_drops_a_torn_batch(paths):
+    db_path, journal_path = paths
+    cached = CachedStorage(SQLiteStorage(db_path), journal_path)
+    cached.upsert("meta", {"name": "a", "value": "1"})
+    crash(cached)
+    with open(journal_path, "a") as f:  # a batch cut off by the crash
+        f.write(json.dumps({"batch": [{"op": "upsert", "table": "meta", "row": {"name": "b", "value": "2"}}]})[:-5])
+
+    restored = CachedStorage(SQLiteStorage(db_path), journal_path)
+    assert restored.all("meta") == [{"name": "a", "value": "1"}]
+
+
+def test_journal_replay_reads_single_op_lines(paths):
+    db_path, journal_path = paths
+    SQLiteStorage(db_path).close()
+    with open(journal_path, "w") as f:
+        f.write(json.dumps({"op": "upsert", "table": "meta", "row": {"name": "a", "value": "1"}}) + "\n")
+        f.write(json.dumps({"op": "remove", "table": "meta", "key": ["a"]}) + "\n")
+        f.write(json.dumps({"op": "upsert", "table": "meta", "row": {"name": "b", "value": "2"}}) + "\n")
+
+    restored = CachedStorage(SQLiteStorage(db_path), journal_path)
+    assert restored.all("meta") == [{"name": "b", "value": "2"}]
+
+
+def test_write_batch_is_all_or_nothing(paths):
+    db_path, journal_path = paths
+    cached = CachedStorage(SQLiteStorage(db_path), journal_path)
+    cached.upsert("meta", {"name": "a", "value": "1"})
+    bad_batches = [
+        [("upsert", "meta", {"name": "b", "value": "2"}), ("upsert", "no_such_table", {"name": "c"})],
+        [("remove", "meta", "a"), ("upsert", "meta", {"value": "no key"})],
+        [("remove", "meta", "a"), ("replace", "meta", {"name": "a"})]
+    ]
+    for batch in bad_batches:
+        with pytest.raises((KeyError, ValueError)):
+            cached.write_batch(batch)
+    assert cached.all("meta") == [{"name": "a", "value": "1"}]
+    assert cached.pending == 1
+    crash(cached)
+    assert CachedStorage(SQLiteStorage(db_path), journal_path).all("meta") == [{"name": "a", "value": "1"}]
+
+
+def test_pending_writes_are_coalesced(paths):
+    db_path, journal_path = paths
+    cached = CachedStorage(SQLiteStorage(db_path), journal_path)
+    for value in range(5):
+        cached.upsert("meta", {"name": "a", "value": str(value)})
+    assert cached.pending == 1
+    assert cached.flush() == 1
+    assert SQLiteStorage(db_path).get("meta", "a")["value"] == "4"
+
+
+def test_lazy_cached_storage_survives_a_restart(paths):
+    """
+    The main storage as main.py builds it: SQLite behind the write-behind cache, created on first use
+    """
+    def open_storage():
+        return Lazy(lambda: CachedStorage(SQLiteStorage(paths[0]), paths[1]), "storage")
+
+    storage = open_storage()
+    storage.write_batch([
+        ("upsert", "polls", {"poll_id": 1, "title": "Lunch", "choices": ["Pizza", "Curry"], "counts": [2, 1]}),
+        ("upsert", "tictactoe", {"game_id": 5, "player1": 10, "player2": 0, "board": "120000000", "turn": 1,
+                                 "difficulty": "hard", "updated": 1000.0})
+    ])
+    storage.flush()
+    storage.update("polls", 1, counts=[2, 2])  # left in the journal
+    crash(storage.instance())
+
+    storage = open_storage()
+    assert storage.get("polls", 1)["counts"] == [2, 2]
+    assert storage.search("tictactoe", player1=10)[0]["board"] == "120000000"
+    storage.close()
+    assert SQLiteStorage(paths[0]).get("polls", 1)["choices"] == ["Pizza", "Curry"]
@@ -0,0 +1,24 @@
+import random
+from gift_cycle import check_bans
+from cycles import random_bans, brute_force_cycle, brute_force_checks
+
+
+def test_check_bans_matches_brute_force():
+    rng = random.Random(11)
+    for _ in range(400):
+        n = rng.randint(2, 6)
+        people = list(range(n))
+        bans = random_bans(people, rng.choice([0.2, 0.4, 0.6, 0.8]), rng)
+        problems = check_bans(people, bans)
+        assert bool(problems) != brute_force_checks(people, bans), (people, bans, problems)
+        if brute_force_cycle(people, bans):
+            assert not problems
+        for problem in problems:
+            assert all(receiver in bans[giver] for giver, receiver in problem["bans"])
+
+
+def test_check_bans_names_the_blocking_bans():
+    problems = check_bans([1, 2, 3], {1: [2, 3]}, {1: "Ann", 2: "Bob", 3: "Cat"})
+    assert len(problems) == 1
+    assert "Ann" in problems[0]["reason"]
+    assert sorted(problems[0]["bans"]) == [(1, 2), (1, 3)]
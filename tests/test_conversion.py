@@ -0,0 +1,64 @@
+import asyncio
+import pytest
+
+conversion = pytest.importorskip("conversion")  # needs aiohttp
+
+
+class FakeResponse:
+    def __init__(self, status: int, data: dict = None, headers: dict = None):
+        self.status = status
+        self.data = data
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise conversion.HttpError(f"HTTP {self.status}", self.status)
+
+    def json(self):
+        return self.data
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    """
+    Responses for RateSource.refresh to receive, in order
+    """
+    queue = []
+
+    async def request(method, url, **kwargs):
+        return queue.pop(0)
+
+    monkeypatch.setattr(conversion.shared_client, "request", request)
+    return queue
+
+
+def test_failed_refresh_is_retried_after_a_backoff(responses, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(conversion.time, "time", lambda: now[0])
+    source = conversion.RateSource("fiat", "https://rates.example", 3600, retry_backoff=60)
+    responses.extend([FakeResponse(503), FakeResponse(503), FakeResponse(200, {"rates": {"USD": 1, "EUR": 0.9}})])
+    for backoff in (60, 120):
+        with pytest.raises(conversion.HttpError):
+            asyncio.run(source.refresh())
+        assert source.next_refresh == now[0] + backoff
+        assert source.rates == {}
+        now[0] = source.next_refresh
+        assert source.due
+    asyncio.run(source.refresh())
+    assert source.rates == {"USD": 1, "EUR": 0.9}
+    assert source.failures == 0 and source.next_refresh == now[0] + 3600
+
+
+def test_backoff_never_exceeds_the_interval(responses):
+    source = conversion.RateSource("crypto", "https://rates.example", 300, retry_backoff=60)
+    source.failures = 10
+    responses.append(FakeResponse(500))
+    with pytest.raises(conversion.HttpError):
+        asyncio.run(source.refresh())
+    assert source.next_refresh - conversion.time.time() <= 300
+
+
+def test_missing_api_key_fails_without_a_request(responses):
+    source = conversion.RateSource("coinlayer", "https://rates.example", 3600, params={"access_key": None})
+    with pytest.raises(conversion.HttpError, match="access_key"):
+        asyncio.run(source.refresh())
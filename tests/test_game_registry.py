@@ -0,0 +1,55 @@
+import pytest
+
+ttt = pytest.importorskip("tictactoe")  # needs discord-py-interactions
+from startup import Lazy  # noqa: E402
+from storage import SQLiteStorage  # noqa: E402
+from cached_storage import CachedStorage  # noqa: E402
+
+
+@pytest.fixture
+def open_registry(tmp_path):
+    """
+    Opens a registry over the main storage as main.py builds it, again after each call, like a restart
+    """
+    opened = []
+
+    def open_registry(timeout: float = 3600):
+        if opened:
+            opened[-1].close()
+        opened.append(Lazy(lambda: CachedStorage(SQLiteStorage(str(tmp_path / "main.sqlite3")),
+                                                 str(tmp_path / "main.journal")), "storage"))
+        return ttt.GameRegistry(opened[-1], timeout)
+
+    return open_registry
+
+
+def game(game_id: int, player1: int, player2: int = 0):
+    return {"game_id": game_id, "player1": player1, "player2": player2, "board": "000000000", "turn": 1,
+            "difficulty": "perfect"}
+
+
+def test_games_survive_a_restart(open_registry):
+    registry = open_registry()
+    registry.save(game(1, 10))
+    registry.save(dict(game(1, 10), board="100020000", turn=1))
+    registry.save(game(2, 11, 12))
+    assert registry.end(2)
+    assert not registry.end(2)
+
+    registry = open_registry()
+    assert len(registry) == 1
+    assert registry.get(1)["board"] == "100020000"
+    assert registry.playing(10) and not registry.playing(11)
+
+
+def test_idle_games_are_evicted(open_registry):
+    registry = open_registry(timeout=60)
+    registry.save(game(1, 10))
+    registry.save(game(2, 11))
+    updated = registry.get(2)["updated"]
+    evicted = registry.evict(now=updated + 61)
+    assert sorted(g["game_id"] for g in evicted) == [1, 2]
+    assert registry.evict(now=updated + 61) == []
+
+    registry = open_registry()
+    assert len(registry) == 0
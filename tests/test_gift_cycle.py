@@ -0,0 +1,50 @@
+import random
+import pytest
+from gift_cycle import gift_cycle, check_bans, NoCycleError
+from cycles import random_bans, is_valid_cycle, brute_force_cycle
+
+
+@pytest.mark.parametrize("n", [2, 3, 5, 10, 200])
+def test_gift_cycle_without_bans(n):
+    people = list(range(100, 100 + n))
+    order = gift_cycle(people, rng=random.Random(n))
+    assert is_valid_cycle(order, people, {})
+
+
+@pytest.mark.parametrize("density", [0.1, 0.3, 0.5])
+def test_gift_cycle_respects_bans(density):
+    rng = random.Random(int(density * 100))
+    for n in (20, 60, 300):  # big enough that random bans leave a cycle
+        people = [f"p{i}" for i in range(n)]
+        bans = random_bans(people, density, rng)
+        assert not check_bans(people, bans)
+        order = gift_cycle(people, bans, rng=random.Random(n))
+        assert is_valid_cycle(order, people, bans)
+
+
+def test_gift_cycle_small_groups_match_brute_force():
+    rng = random.Random(7)
+    for _ in range(300):
+        n = rng.randint(2, 6)
+        people = list(range(n))
+        bans = random_bans(people, rng.choice([0.2, 0.4, 0.6]), rng)
+        exists = brute_force_cycle(people, bans)
+        try:
+            order = gift_cycle(people, bans, rng=random.Random(rng.random()))
+        except NoCycleError as e:
+            assert not exists or not e.definite  # only a give up may miss an existing cycle
+        else:
+            assert exists and is_valid_cycle(order, people, bans)
+
+
+def test_gift_cycle_too_few_people():
+    with pytest.raises(NoCycleError):
+        gift_cycle([1])
+    with pytest.raises(NoCycleError):
+        gift_cycle([1, 1])
+
+
+def test_gift_cycle_impossible_bans_are_definite():
+    with pytest.raises(NoCycleError) as e:
+        gift_cycle([1, 2, 3], {1: [2, 3]})
+    assert e.value.definite
@@ -0,0 +1,62 @@
+import pytest
+
+pytest.importorskip("discord_slash")
+from tictactoe import TicTacToe, Solver, DIFFICULTIES  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def solver():
+    return Solver()
+
+
+def opponent_lines(solver: Solver, board: TicTacToe, to_move: int, bot: int):
+    """
+    Plays every opponent move against every perfect bot move
+    :return: the winners of all finished games (0 for draws)
+    """
+    if board.game_over:
+        yield max(board.check_win(), 0)
+        return
+    moves = solver.best_moves(board, bot) if to_move == bot else \
+        [i for i in range(9) if board.is_blank(i)]
+    assert moves
+    for i in moves:
+        next_board = board.copy()
+        next_board.update(to_move, i)
+        yield from opponent_lines(solver, next_board, 3 - to_move, bot)
+
+
+@pytest.mark.parametrize("bot", [1, 2])
+@pytest.mark.parametrize("first", [1, 2])
+def test_perfect_solver_never_loses(solver, bot, first):
+    winners = set(opponent_lines(solver, TicTacToe(), first, bot))
+    assert 3 - bot not in winners
+    assert 0 in winners  # the opponent can always hold a draw
+
+
+def test_empty_board_is_a_draw(solver):
+    assert solver.value(TicTacToe(), 1) == 0
+    assert solver.value(TicTacToe(), 2) == 0
+
+
+def test_solver_takes_a_win_and_blocks(solver):
+    board = TicTacToe()
+    board.update(full_board="110220000")
+    assert solver.best_moves(board, 1) == [2]  # win
+    board = TicTacToe()
+    board.update(full_board="110200000")
+    assert solver.best_moves(board, 2) == [2]  # block
+
+
+@pytest.mark.parametrize("difficulty", list(DIFFICULTIES))
+def test_choose_plays_a_blank_cell(solver, difficulty):
+    board = TicTacToe()
+    board.update(full_board="120210000")
+    for _ in range(50):
+        assert board.is_blank(solver.choose(board, 1, difficulty))
+
+
+def test_choose_on_a_finished_game(solver):
+    board = TicTacToe()
+    board.update(full_board="111220000")
+    assert solver.choose(board, 2) is None
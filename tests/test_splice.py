@@ -0,0 +1,52 @@
+import random
+import pytest
+from gift_cycle import gift_cycle, assignments, splice_in, splice_out, NoCycleError
+from cycles import random_bans, is_valid_assignment, apply_changes
+
+
+def test_splice_out_keeps_a_single_cycle():
+    rng = random.Random(3)
+    for _ in range(200):
+        n = rng.randint(3, 12)
+        people = list(range(n))
+        bans = random_bans(people, 0.3, rng)
+        try:
+            assignment = assignments(gift_cycle(people, bans, rng=rng))
+        except NoCycleError:
+            continue
+        leaving = rng.choice(people)
+        try:
+            changes = splice_out(assignment, leaving, bans, rng)
+        except NoCycleError:
+            continue
+        assert len(changes) in (1, 3)
+        remaining = [p for p in people if p != leaving]
+        assert is_valid_assignment(apply_changes(assignment, changes, leaving), remaining, bans)
+
+
+def test_splice_out_without_bans_changes_one_assignment():
+    assignment = assignments([1, 2, 3, 4])
+    changes = splice_out(assignment, 2, {}, random.Random(0))
+    assert changes == {1: 3}
+    assert is_valid_assignment(apply_changes(assignment, changes, 2), [1, 3, 4], {})
+
+
+def test_splice_out_needs_three_people():
+    with pytest.raises(NoCycleError):
+        splice_out(assignments([1, 2]), 1)
+
+
+def test_splice_in_keeps_a_single_cycle():
+    rng = random.Random(5)
+    for _ in range(200):
+        n = rng.randint(2, 12)
+        people = list(range(n + 1))
+        bans = random_bans(people, 0.3, rng)
+        joining = people[-1]
+        try:
+            assignment = assignments(gift_cycle(people[:-1], bans, rng=rng))
+            changes = splice_in(assignment, joining, bans, rng)
+        except NoCycleError:
+            continue
+        assert len(changes) == 2 and joining in changes and joining in changes.values()
+        assert is_valid_assignment(apply_changes(assignment, changes), people, bans)
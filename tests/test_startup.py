@@ -0,0 +1,52 @@
+import pytest
+from startup import Lazy, StartupTimer
+from storage import SQLiteStorage, CACHE_TABLES
+from cached_storage import CachedStorage
+from ttl_cache import TTLCache
+
+
+@pytest.fixture
+def lazy_storage(tmp_path):
+    """
+    The main storage the way main.py builds it: SQLite behind the write-behind cache, created on first use
+    """
+    return Lazy(lambda: CachedStorage(SQLiteStorage(str(tmp_path / "main.sqlite3")), str(tmp_path / "main.journal")),
+                "storage", StartupTimer())
+
+
+def test_lazy_creates_once_and_records_the_time():
+    timer = StartupTimer()
+    created = []
+    lazy = Lazy(lambda: created.append(1) or object(), "thing", timer)
+    assert not lazy.initialized
+    assert lazy.instance() is lazy.instance()
+    assert created == [1] and "init:thing" in timer.phases
+
+
+def test_lazy_forwards_storage_methods(lazy_storage):
+    lazy_storage.upsert("meta", {"name": "a", "value": "1"})
+    assert lazy_storage.get("meta", "a") == {"name": "a", "value": "1"}
+    assert lazy_storage.contains("meta", "a")
+    assert lazy_storage.remove("meta", "a")
+    assert lazy_storage.get("meta", "a") is None
+
+
+def test_ttl_cache_on_lazy_storage(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = TTLCache("search", 60, 10, Lazy(lambda: SQLiteStorage(path, CACHE_TABLES), "cache"))
+    assert cache.get("alien") is None
+    cache.set("alien", [{"imdbID": "0078748"}])
+    reopened = TTLCache("search", 60, 10, Lazy(lambda: SQLiteStorage(path, CACHE_TABLES), "cache"))
+    assert reopened.get("alien") == [{"imdbID": "0078748"}]
+    assert reopened.stats["disk_hits"] == 1
+
+
+def test_poll_tally_on_lazy_storage(lazy_storage):
+    polls = pytest.importorskip("polls")  # needs discord.py and aiohttp
+    tally = polls.PollTally(lazy_storage)
+    tally.save(1, polls.new_poll("Lunch", "Where?", 0, ["Pizza", "Curry"]))
+    tally.vote(1, 10, 0)
+    tally.vote(1, 11, 0)
+    tally.vote(1, 10, 1)
+    assert tally.get(1)["counts"] == [1, 1]
+    assert tally.vote(2, 10, 0) is None
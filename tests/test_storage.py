@@ -0,0 +1,68 @@
+import json
+import pytest
+from storage import SQLiteStorage, SANTA_TABLES, migrate_tinydb
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "main.sqlite3"), str(tmp_path / "main.journal")
+
+
+def test_sqlite_write_batch_rolls_back(paths):
+    storage = SQLiteStorage(paths[0])
+    storage.upsert("meta", {"name": "a", "value": "1"})
+    with pytest.raises(KeyError):
+        storage.write_batch([("remove", "meta", "a"), ("upsert", "no_such_table", {})])
+    assert storage.all("meta") == [{"name": "a", "value": "1"}]
+
+
+def test_migrate_tinydb_runs_once(tmp_path):
+    tinydb_path = str(tmp_path / "main.db")
+    with open(tinydb_path, "w") as f:
+        json.dump({
+            "santa": {"1": {"userID": 10, "firstName": "Ann", "santaID": 20}, "2": {"firstName": "no key"}},
+            "modifiers": {"1": {"id": 10, "ban": [20]}}
+        }, f)
+    storage = SQLiteStorage(str(tmp_path / "santa.sqlite3"), SANTA_TABLES)
+    assert migrate_tinydb(storage, tinydb_path, ("santa", "modifiers")) == 2
+    assert migrate_tinydb(storage, tinydb_path, ("santa", "modifiers")) == 0
+    row = storage.get("santa", 10)
+    assert row["santaID"] == 20 and row["notified"] is None  # drawn before notified was recorded
+    assert storage.get("modifiers", 10)["ban"] == [20]
+
+
+def test_santa_notified_round_trips_as_a_boolean(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "santa.sqlite3"), SANTA_TABLES)
+    storage.write_batch([
+        ("upsert", "santa", {"userID": 1, "santaID": 2, "received": False, "notified": False}),
+        ("upsert", "santa", {"userID": 2, "santaID": 1, "received": False, "notified": True}),
+        ("upsert", "santa", {"userID": 3, "santaID": 1})  # drawn before notified was recorded
+    ])
+    rows = {row["userID"]: row for row in storage.all("santa")}
+    assert rows[1]["notified"] is False and rows[1]["received"] is False
+    assert rows[2]["notified"] is True
+    assert rows[3]["notified"] is None
+    # what /assign_chimneys resumes: rows left unnotified by a failed DM
+    assert [row["userID"] for row in rows.values() if row.get("notified") is False] == [1]
+    assert [row["userID"] for row in storage.search("santa", notified=False)] == [1]
+
+
+def test_migrate_tinydb_without_a_file(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "santa.sqlite3"), SANTA_TABLES)
+    assert migrate_tinydb(storage, str(tmp_path / "missing.db"), ("santa", "modifiers")) == 0
+    assert storage.get("meta", "migrated:santa") is not None  # not retried on every start
+
+
+def test_santa_draw_round_trips_through_sqlite(tmp_path):
+    path = str(tmp_path / "santa.sqlite3")
+    storage = SQLiteStorage(path, SANTA_TABLES)
+    storage.write_batch([("upsert", "modifiers", {"id": 1, "ban": [3]})] + [
+        ("upsert", "santa", {"userID": user_id, "firstName": str(user_id), "santaID": santa_id, "received": False,
+                             "notified": False})
+        for user_id, santa_id in ((1, 3), (2, 1), (3, 2))
+    ])
+    storage.close()
+    storage = SQLiteStorage(path, SANTA_TABLES)
+    assert {row["userID"]: row["santaID"] for row in storage.all("santa")} == {1: 3, 2: 1, 3: 2}
+    assert storage.search("santa", santaID=1)[0]["userID"] == 2
+    assert storage.get("modifiers", 1)["ban"] == [3]
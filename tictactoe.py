@@ -1,20 +1,68 @@
 import random
+import time
+from array import array
 from discord_slash.utils import manage_components
 from discord_slash.model import ButtonStyle
+from storage import Storage
+
+# Cell i of the board is bit i of a player's bitboard:
+# 0 | 1 | 2
+# 3 | 4 | 5
+# 6 | 7 | 8
+FULL_BOARD = 0b111111111
+WIN_MASKS = (
+    0b000000111, 0b000111000, 0b111000000,  # rows
+    0b001001001, 0b010010010, 0b100100100,  # columns
+    0b100010001, 0b001010100                # diagonals
+)
+POPCOUNT = tuple(bin(bits).count("1") for bits in range(FULL_BOARD + 1))
+CELLS = tuple(tuple(i for i in range(9) if bits >> i & 1) for bits in range(FULL_BOARD + 1))  # bitboard -> cells
+TERNARY = tuple(sum(3 ** i for i in CELLS[bits]) for bits in range(FULL_BOARD + 1))  # bitboard -> base-3 digits
+DIFFICULTIES = {  # difficulty -> chance of playing a best move instead of a random one
+    "easy": 0.3,
+    "medium": 0.6,
+    "hard": 0.85,
+    "perfect": 1.0
+}
+
+
+def has_line(bits: int):
+    for mask in WIN_MASKS:
+        if bits & mask == mask:
+            return True
+    return False
 
 
 class TicTacToe:
+    """
+    A tic-tac-toe board, stored as one 9-bit bitboard per player
+    """
     def __init__(self):
-        self.board = [0, 0, 0, 0, 0, 0, 0, 0, 0]
-        self.blanks = 9
+        self.bits = [0, 0, 0]  # player -> bitboard, index 0 unused
         self.game_over = False
 
     def __str__(self):
-        return (f"{self.board[0]} | {self.board[1]} | {self.board[2]}\n"
+        board = self.board
+        return (f"{board[0]} | {board[1]} | {board[2]}\n"
                 f"----------\n"
-                f"{self.board[3]} | {self.board[4]} | {self.board[5]}\n"
+                f"{board[3]} | {board[4]} | {board[5]}\n"
                 f"----------\n"
-                f"{self.board[6]} | {self.board[7]} | {self.board[8]}")
+                f"{board[6]} | {board[7]} | {board[8]}")
+
+    @property
+    def board(self):
+        """
+        The board as a list of 9 cells: 0 for blank, otherwise the player number
+        """
+        return [1 if self.bits[1] >> i & 1 else 2 if self.bits[2] >> i & 1 else 0 for i in range(9)]
+
+    @property
+    def occupied(self):
+        return self.bits[1] | self.bits[2]
+
+    @property
+    def blanks(self):
+        return 9 - POPCOUNT[self.occupied]
 
     def update(self, player=None, i=None, full_board=None):
         if self.game_over:
@@ -22,47 +70,45 @@ class TicTacToe:
         if i is not None and player is not None:
             if not self.is_blank(i):
                 raise ValueError("Board is not empty at i=" + str(i))
-            self.board[i] = player
-            self.blanks -= 1
+            if player:
+                self.bits[player] |= 1 << i
         elif full_board is not None:
+            bits = [0, 0, 0]
             for i in range(len(full_board)):
-                if full_board[i] == "0":
-                    self.blanks += 1
-                self.update(int(full_board[i:i+1]), i=i)
+                bits[int(full_board[i])] |= 1 << i
+            self.bits = [0, bits[1], bits[2]]
         elif player is None:
             raise ValueError("player value missing from function call.")
         else:
             raise ValueError("Too many arguments.")
-        if self.blanks == 0:
-            self.game_over = True
-        if not self.check_win() == -1:
+        if self.occupied == FULL_BOARD or has_line(self.bits[1]) or has_line(self.bits[2]):
             self.game_over = True
 
     def copy(self):
         new_obj = TicTacToe()
-        new_obj.board = self.board.copy()
-        new_obj.blanks = self.blanks
+        new_obj.bits = self.bits.copy()
         return new_obj
 
     def is_blank(self, index: int):
-        return self.board[index] == 0
+        return not self.occupied >> index & 1
 
     def check_win(self):
-        if check_win(self, 1):
+        if has_line(self.bits[1]):
             return 1
-        if check_win(self, 2):
+        if has_line(self.bits[2]):
             return 2
         return -1
 
     def get_buttons(self, force_stop=False):
         buttons = []
+        board = self.board
         for i in range(9):
             buttons.append(
                 manage_components.create_button(
-                    style=[ButtonStyle.grey, ButtonStyle.blue, ButtonStyle.red][self.board[i]],
+                    style=[ButtonStyle.grey, ButtonStyle.blue, ButtonStyle.red][board[i]],
                     label=" ",
                     custom_id=f"tictactoe_{i}",
-                    disabled=self.board[i] > 0 or self.game_over or force_stop
+                    disabled=board[i] > 0 or self.game_over or force_stop
                 )
             )
         buttons.append(manage_components.create_button(
@@ -79,57 +125,166 @@ class TicTacToe:
         return actionrows
 
     def get_string(self):
-        st = ""
-        for i in range(9):
-            st += str(self.board[i])
-        return st
+        return "".join(str(cell) for cell in self.board)
 
 
-def check_win(board: TicTacToe, player: int):
-    consecutive = 0
-    for x in range(3):
-        for y in range(3):
-            if board.board[3 * y + x] == player:
-                consecutive += 1
-        if consecutive == 3:
-            # print("vertical")
-            return True
-        consecutive = 0
-    for x in range(3):
-        for y in range(3):
-            if board.board[3 * x + y] == player:
-                consecutive += 1
-        if consecutive == 3:
-            # print("horizontal")
-            return True
-        consecutive = 0
-    for n in range(3):
-        if board.board[4*n] == player:
-            consecutive += 1
-    if consecutive == 3:
-        # print("top-left diag")
-        return True
-    consecutive = 0
-    for n in range(3):
-        if board.board[(n+1)*2] == player:
-            consecutive += 1
-    if consecutive == 3:
-        # print("top-right diag")
+def encode(bits1: int, bits2: int, player: int):
+    """
+    Index of a position in the Solver tables: the board in base 3 (cell i is digit i), times 2, plus the side to move
+    """
+    return (TERNARY[bits1] + 2 * TERNARY[bits2]) * 2 + player - 1
+
+
+class Solver:
+    """
+    Perfect play lookup tables for every position reachable from an empty board, with either player starting.
+    Built once by a minimax search over all positions. Values are from the side to move's point of view:
+    positive wins (higher is sooner), 0 draws, negative loses.
+    """
+    SIZE = 3 ** 9 * 2
+
+    def __init__(self):
+        self.values = array("b", bytes(self.SIZE))
+        self.best = array("H", bytes(2 * self.SIZE))  # bitmask of the best moves, 0 for finished or unreachable
+        self.positions = 0
+        for player in (1, 2):
+            self._solve(0, 0, player)
+
+    def _solve(self, bits1: int, bits2: int, player: int):
+        index = encode(bits1, bits2, player)
+        if self.best[index] or has_line(bits1) or has_line(bits2) or bits1 | bits2 == FULL_BOARD:
+            return self.values[index]  # solved already, or finished (value 0, losing is scored by the winner)
+        self.positions += 1
+        blank = FULL_BOARD & ~(bits1 | bits2)
+        best_value, best_moves = -128, 0
+        for i in CELLS[blank]:
+            if player == 1:
+                new1, new2 = bits1 | 1 << i, bits2
+                won = has_line(new1)
+            else:
+                new1, new2 = bits1, bits2 | 1 << i
+                won = has_line(new2)
+            # a win now is worth more than a later one, counted in blanks left
+            value = POPCOUNT[blank] if won else -self._solve(new1, new2, 3 - player)
+            if value > best_value:
+                best_value, best_moves = value, 1 << i
+            elif value == best_value:
+                best_moves |= 1 << i
+        self.values[index] = best_value
+        self.best[index] = best_moves
+        return best_value
+
+    def value(self, board: TicTacToe, player: int):
+        return self.values[encode(board.bits[1], board.bits[2], player)]
+
+    def best_moves(self, board: TicTacToe, player: int):
+        """
+        :return: the cells of all optimal moves for player, empty if the game is over
+        """
+        return list(CELLS[self.best[encode(board.bits[1], board.bits[2], player)]])
+
+    def choose(self, board: TicTacToe, player: int, difficulty: str = "perfect"):
+        """
+        Picks a move: one of the best moves with the difficulty's chance, otherwise any blank cell
+        :param board: the current board
+        :param player: the player to move
+        :param difficulty: a key of DIFFICULTIES
+        :return: the cell index, or None if the game is over
+        """
+        if board.game_over:
+            return None
+        moves = []
+        if random.random() < DIFFICULTIES[difficulty]:
+            moves = self.best_moves(board, player)
+        if not moves:  # random move, or a position the tables don't cover
+            moves = list(CELLS[FULL_BOARD & ~board.occupied])
+        return random.choice(moves)
+
+
+class GameRegistry:
+    """
+    Live games, keyed by their message id, held in memory and persisted to the "tictactoe" table.
+    Each move (with the bot's reply, if any) is saved with a single upsert of the game row.
+    The registry is rebuilt from storage on first use. Games without a move for timeout seconds can be evicted.
+    """
+    def __init__(self, storage: Storage, timeout: float = 24 * 3600):
+        """
+        :param storage: storage with a "tictactoe" table
+        :param timeout: seconds without a move before a game is abandoned
+        """
+        self.storage = storage
+        self.timeout = timeout
+        self._games = None  # game_id -> game row
+
+    def _all(self):
+        if self._games is None:
+            now = time.time()
+            self._games = {}
+            for row in self.storage.all("tictactoe"):
+                if row.get("updated") is None:  # saved before games were timestamped
+                    row["updated"] = now
+                self._games[row["game_id"]] = row
+        return self._games
+
+    def __len__(self):
+        return len(self._all())
+
+    def get(self, game_id: int):
+        game = self._all().get(game_id)
+        return None if game is None else dict(game)
+
+    def playing(self, user_id: int):
+        """
+        :return: True if the user is in a live game
+        """
+        return any(user_id in (game["player1"], game["player2"]) for game in self._all().values())
+
+    def save(self, game: dict):
+        """
+        Stores a new game or a game's new state
+        :param game: a game row: game_id, player1, player2, board, turn, difficulty
+        """
+        game = dict(game, updated=time.time())
+        self.storage.upsert("tictactoe", game)
+        self._all()[game["game_id"]] = game
+
+    def end(self, game_id: int):
+        """
+        Removes a finished or stopped game
+        :return: False if there was no such game
+        """
+        if self._all().pop(game_id, None) is None:
+            return False
+        self.storage.remove("tictactoe", game_id)
         return True
-    return False
+
+    def evict(self, now: float = None):
+        """
+        Removes games that haven't seen a move within the timeout, in one batch
+        :return: the evicted games
+        """
+        cutoff = (time.time() if now is None else now) - self.timeout
+        games = self._all()
+        evicted = [games.pop(game_id) for game_id in [g for g, game in games.items() if game["updated"] < cutoff]]
+        if evicted:
+            self.storage.write_batch([("remove", "tictactoe", game["game_id"]) for game in evicted])
+        return evicted
+
+
+def check_win(board: TicTacToe, player: int):
+    return has_line(board.bits[player])
 
 
 def compute_step(board: TicTacToe, player: int):
-    if check_win(board, player):
+    opponent = 1 if player == 2 else 2
+    if has_line(board.bits[player]) or has_line(board.bits[opponent]):
         return None
-    elif check_win(board, 1 if player == 2 else 2):
-        return None
-    elif board.blanks == 0:
+    elif board.occupied == FULL_BOARD:
         return None
     winning_moves = find_vacancy(board, player)  # check if CPU can win
     if len(winning_moves) > 0:
         return winning_moves[0]
-    opponent_moves = find_vacancy(board, 1 if player == 2 else 2)  # block enemy from winning
+    opponent_moves = find_vacancy(board, opponent)  # block enemy from winning
     if len(opponent_moves) > 0:
         return opponent_moves[0]
     future_wins = find_vacancy(board, player, 2)
@@ -138,54 +293,24 @@ def compute_step(board: TicTacToe, player: int):
         best_moves[i] += 1
     if max(best_moves) > 0:
         return best_moves.index(max(best_moves))
-    x = list(range(9))
+    x = list(CELLS[FULL_BOARD & ~board.occupied])
     random.shuffle(x)
-    for i in x:
-        if board.is_blank(i):
-            return i
+    return x[0]
 
 
 def find_vacancy(board: TicTacToe, player: int, free_slots=1):
+    """
+    Finds the blank cells of lines the opponent hasn't played in and that have exactly free_slots blanks
+    :return: sorted cell indexes, a cell appears once per such line it's in
+    """
+    opponent_bits = board.bits[1 if player == 2 else 2]
+    blank = FULL_BOARD & ~board.occupied
     vacant = []
-    # check rows:
-    for i in range(0, 9, 3):
-        row = ""
-        for j in range(3):
-            row += str(board.board[i+j])
-        if row.count(str(1 if player == 2 else 2)) > 0:  # check if opponent played this row
-            continue
-        if not row.count("0") == free_slots:  # check free slots
-            continue
-        for j in range(3):
-            if row[j] == "0":
-                vacant.append(i+j)
-    for i in range(3):
-        column = ""
-        for j in range(0, 9, 3):
-            column += str(board.board[i+j])
-        if column.count(str(1 if player == 2 else 2)) > 0:  # check if opponent played this column
-            continue
-        if not column.count("0") == free_slots:  # check free slots
+    for mask in WIN_MASKS:
+        if opponent_bits & mask:  # opponent played this line
             continue
-        for j in range(3):
-            if column[j] == "0":
-                vacant.append(i+(j*3))
-    diag1 = ""
-    for i in [0, 4, 8]:
-        diag1 += str(board.board[i])
-    if not diag1.count(str(1 if player == 2 else 2)) > 0:  # check if opponent played this diagonal
-        if diag1.count("0") == free_slots:  # check free slots
-            for i in range(3):
-                if diag1[i] == "0":
-                    vacant.append([0, 4, 8][i])
-    diag2 = ""
-    for i in [2, 4, 6]:
-        diag2 += str(board.board[i])
-    if not diag2.count(str(1 if player == 2 else 2)) > 0:  # check if opponent played this diagonal
-        if diag2.count("0") == free_slots:  # check free slots
-            for i in range(3):
-                if diag2[i] == "0":
-                    vacant.append([2, 4, 6][i])
+        if POPCOUNT[blank & mask] == free_slots:
+            vacant.extend(CELLS[blank & mask])
     vacant.sort()
     return vacant
 
@@ -0,0 +1,136 @@
+import re
+import threading
+from array import array
+from datetime import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError, available_timezones
+
+
+def normalize_location(location: str):
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s,]", " ", location)).strip(" ,").casefold()
+
+
+@lru_cache(maxsize=256)
+def get_zone(name: str):
+    """
+    Gets a timezone, keeping its parsed transition table around for later lookups
+    :param name: IANA timezone name, e.g. "Europe/London"
+    :return: a ZoneInfo, or None if there's no such zone
+    """
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def localize(zone_name: str, year: int, month: int, day: int, hour: int, minute: int):
+    """
+    Builds an aware datetime using the UTC offset in effect at that date in the zone (not today's offset)
+    :raise ValueError: if the date doesn't exist or the zone is unknown
+    """
+    zone = get_zone(zone_name)
+    if zone is None:
+        raise ValueError("Unknown timezone " + zone_name)
+    return datetime(year, month, day, hour, minute, tzinfo=zone)
+
+
+class Gazetteer:
+    """
+    An in-memory city index loaded from a GeoNames dump (e.g. cities15000.txt from download.geonames.org).
+    Names map to row numbers, rows are kept in flat arrays. Where names clash the most populous city wins.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.lats = array("f")
+        self.lons = array("f")
+        self.populations = array("Q")
+        self.zone_ids = array("H")
+        self.zones = []  # zone id -> IANA name
+        self.names = {}  # normalized name (optionally ", country code") -> row
+        self._load()
+
+    def _load(self):
+        zone_index = {}
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                cols = line.rstrip("\n").split("\t")
+                if len(cols) < 18:
+                    continue
+                row = len(self.lats)
+                zone = cols[17]
+                if zone not in zone_index:
+                    zone_index[zone] = len(self.zones)
+                    self.zones.append(zone)
+                self.lats.append(float(cols[4]))
+                self.lons.append(float(cols[5]))
+                self.populations.append(int(cols[14] or 0))
+                self.zone_ids.append(zone_index[zone])
+                country = cols[8].casefold()
+                for name in {normalize_location(cols[1]), normalize_location(cols[2])}:
+                    for key in (name, f"{name}, {country}"):
+                        current = self.names.get(key)
+                        if current is None or self.populations[current] < self.populations[row]:
+                            self.names[key] = row
+
+    def __len__(self):
+        return len(self.lats)
+
+    def lookup(self, location: str):
+        """
+        Finds a city by name ("Paris" or "Paris, FR"). Falls back to the text before the first comma.
+        :return: the row number, or None if not found
+        """
+        key = normalize_location(location)
+        row = self.names.get(key)
+        if row is None and "," in key:
+            row = self.names.get(key.split(",")[0].strip())
+        return row
+
+    def zone(self, row: int):
+        return self.zones[self.zone_ids[row]] or None
+
+    def coordinates(self, row: int):
+        return self.lats[row], self.lons[row]
+
+
+class OfflineTimezoneResolver:
+    """
+    Resolves locations to IANA timezone names without the network.
+    Accepts IANA names ("Europe/London"), city names from the gazetteer, or "lat, lon" coordinates.
+    Coordinates are matched against timezone polygons through tzwhere's spatial index, loaded on first use.
+    """
+    COORDINATES = re.compile(r"\A\s*(-?\d+(?:\.\d+)?)\s*[,\s]\s*(-?\d+(?:\.\d+)?)\s*\Z")
+
+    def __init__(self, gazetteer: Gazetteer = None):
+        self.gazetteer = gazetteer
+        self.zone_names = {name.casefold(): name for name in available_timezones()}
+        self._polygons = None
+        self._polygons_lock = threading.Lock()
+
+    def _zone_at(self, lat: float, lon: float):
+        with self._polygons_lock:
+            if self._polygons is None:
+                from tzwhere import tzwhere  # slow to load, only needed for coordinates
+                self._polygons = tzwhere.tzwhere(forceTZ=True)
+        return self._polygons.tzNameAt(lat, lon, forceTZ=True)
+
+    def resolve(self, location: str):
+        """
+        :param location: an IANA zone name, a city name or "lat, lon"
+        :return: an IANA timezone name, or None if the location isn't known offline
+        """
+        zone = self.zone_names.get(location.strip().replace(" ", "_").casefold())
+        if zone is not None:
+            return zone
+        match = self.COORDINATES.match(location)
+        if match:
+            lat, lon = float(match.group(1)), float(match.group(2))
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                return self._zone_at(lat, lon)
+            return None
+        if self.gazetteer is not None:
+            row = self.gazetteer.lookup(location)
+            if row is not None:
+                zone = self.gazetteer.zone(row)
+                return zone if zone is not None else self._zone_at(*self.gazetteer.coordinates(row))
+        return None
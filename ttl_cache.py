@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+from storage import Storage
+
+
+class TTLCache:
+    """
+    Two-level cache: an in-process LRU in front of an optional persistent store.
+    Entries expire after a TTL on both levels. Values kept on disk must be JSON serializable.
+    """
+    def __init__(self, namespace: str, ttl: float, max_items: int = 512, storage: Storage = None):
+        """
+        :param namespace: name separating this cache's entries in the shared cache table
+        :param ttl: default time to live of an entry, in seconds
+        :param max_items: maximum entries kept in memory
+        :param storage: storage with a "cache" table to persist entries in, or None for memory only
+        """
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_items = max_items
+        self.storage = storage
+        self._items = OrderedDict()  # key -> (expires, value)
+        self._lock = threading.Lock()  # lookups can come from worker threads
+        self.stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0
+        }
+
+    @property
+    def hit_ratio(self):
+        lookups = self.stats["hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        return (self.stats["hits"] + self.stats["disk_hits"]) / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key: str, default=None):
+        """
+        Looks a key up in memory, then on disk
+        :return: the cached value, or default if missing or expired
+        """
+        with self._lock:
+            now = time.time()
+            item = self._items.get(key)
+            if item is not None:
+                if item[0] > now:
+                    self._items.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return item[1]
+                del self._items[key]
+            if self.storage is not None:
+                row = self.storage.get("cache", (self.namespace, key))
+                if row is not None:
+                    if row["expires"] > now:
+                        self._remember(key, row["value"], row["expires"])
+                        self.stats["disk_hits"] += 1
+                        return row["value"]
+                    self.storage.remove("cache", (self.namespace, key))
+            self.stats["misses"] += 1
+            return default
+
+    def set(self, key: str, value, ttl: float = None):
+        """
+        Caches a value on both levels
+        :param key: the cache key
+        :param value: the value to cache
+        :param ttl: time to live in seconds, the cache's default if omitted
+        """
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remember(key, value, expires)
+            if self.storage is not None:
+                self.storage.upsert("cache", {"namespace": self.namespace, "key": key, "value": value,
+                                              "expires": expires})
+
+    def _remember(self, key: str, value, expires: float):
+        self._items[key] = (expires, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def purge_expired(self):
+        """
+        Drops expired entries from memory and disk
+        :return: number of disk entries dropped
+        """
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (expires, _) in self._items.items() if expires <= now]:
+                del self._items[key]
+        if self.storage is None:
+            return 0
+        expired = [("remove", "cache", (row["namespace"], row["key"]))
+                   for row in self.storage.search("cache", namespace=self.namespace) if row["expires"] <= now]
+        if expired:
+            self.storage.write_batch(expired)
+        return len(expired)
@@ -1,5 +1,5 @@
 from discord_slash.utils import manage_components
-import requests
+from http_client import shared_client, HttpError
 
 
 def get_number_emoji_dict(n: int):
@@ -84,7 +84,7 @@ def list2str(var, max_items=1, join_str=", "):
         return str(var)
 
 
-def magnet_shorten(token: str, magnet: str):
+async def magnet_shorten(token: str, magnet: str):
     """
     Shortens a torrent magnet link.
     :param magnet: (str) a magnet string
@@ -97,18 +97,25 @@ def magnet_shorten(token: str, magnet: str):
         "domain": "tinyurl.com"
         }
     try:
-        res = requests.post(api_address, api_parameters)
-        res.raise_for_status()
-    except Exception:
+        results = await shared_client.post_json(api_address, data=api_parameters)
+    except HttpError:
         raise NameError("Encountered an API error.")
     else:
-        results = res.json()
         if results["code"] == 0:
             return results["data"]["tiny_url"]
         else:
             raise NameError("API failed")
 
 
+def person_links(people: list):
+    """
+    Formats people as markdown links to their IMDb pages
+    :param people: a list of {"name", "personID"} dicts
+    :return: a list of link strings
+    """
+    return [f"[{p['name']}](https://www.imdb.com/name/nm{p['personID']}/)" for p in people if p.get("name")]
+
+
 def none2str(x):
     """
     returns a string if variable is None
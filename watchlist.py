@@ -0,0 +1,116 @@
+from collections import Counter
+from storage import Storage
+
+
+class WatchlistIndex:
+    """
+    Inverted index over the "watchlist" table: user -> set of film ids and film -> set of users.
+    All watchlist writes go through it so the index stays in sync with storage.
+    Rows also carry the film's title and year, so listing a watchlist doesn't need IMDb.
+    The index is built from storage on first use.
+    """
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self._films = None  # user_id -> set of film ids
+        self._users = None  # film_id -> set of user ids
+        self._details = {}  # film_id -> {"title", "year"}, for films with known details
+
+    def _index(self):
+        if self._films is None:
+            films, users = {}, {}
+            for row in self.storage.all("watchlist"):
+                films.setdefault(row["user_id"], set()).add(row["film_id"])
+                users.setdefault(row["film_id"], set()).add(row["user_id"])
+                if row.get("title") is not None:
+                    self._details[row["film_id"]] = {"title": row["title"], "year": row.get("year")}
+            self._films, self._users = films, users
+        return self._films
+
+    def films(self, user_id: int):
+        return set(self._index().get(user_id, ()))
+
+    def users(self, film_id: str):
+        self._index()
+        return set(self._users.get(film_id, ()))
+
+    def contains(self, user_id: int, film_id: str):
+        return film_id in self._index().get(user_id, ())
+
+    def add(self, user_id: int, film_id: str, title: str = None, year: int = None):
+        """
+        Adds a film to a user's watchlist
+        :param user_id: the user
+        :param film_id: the film's imdbID, with the "tt" prefix
+        :param title: the film's title, if known
+        :param year: the film's release year, if known
+        :return: False if the film was already on it
+        """
+        if self.contains(user_id, film_id):
+            return False
+        if title is None and film_id in self._details:
+            title, year = self._details[film_id]["title"], self._details[film_id]["year"]
+        self.storage.upsert("watchlist", {"user_id": user_id, "film_id": film_id, "title": title, "year": year})
+        self._films.setdefault(user_id, set()).add(film_id)
+        self._users.setdefault(film_id, set()).add(user_id)
+        if title is not None:
+            self.set_details(film_id, title, year)
+        return True
+
+    def details(self, film_id: str):
+        """
+        :return: the film's {"title", "year"}, or None if they aren't known yet
+        """
+        self._index()
+        details = self._details.get(film_id)
+        return None if details is None else dict(details)
+
+    def set_details(self, film_id: str, title: str, year: int = None):
+        """
+        Stores a film's title and year on every watchlist row of the film, in one batch
+        """
+        self._index()
+        if self._details.get(film_id) == {"title": title, "year": year}:
+            return
+        self._details[film_id] = {"title": title, "year": year}
+        self.storage.write_batch([
+            ("upsert", "watchlist", {"user_id": user_id, "film_id": film_id, "title": title, "year": year})
+            for user_id in self._users.get(film_id, ())
+        ])
+
+    def remove(self, user_id: int, film_id: str):
+        """
+        Removes a film from a user's watchlist
+        :return: False if the film wasn't on it
+        """
+        if not self.contains(user_id, film_id):
+            return False
+        self.storage.remove("watchlist", (user_id, film_id))
+        for index, outer, inner in ((self._films, user_id, film_id), (self._users, film_id, user_id)):
+            index[outer].discard(inner)
+            if not index[outer]:
+                del index[outer]
+        if film_id not in self._users:
+            self._details.pop(film_id, None)
+        return True
+
+    def common(self, user_ids: list):
+        """
+        Films on every one of the users' watchlists
+        :return: a sorted list of film ids
+        """
+        index = self._index()
+        sets = sorted((index.get(user_id, set()) for user_id in user_ids), key=len)
+        if not sets:
+            return []
+        return sorted(sets[0].intersection(*sets[1:]))
+
+    def ranked(self, user_ids: list):
+        """
+        Films on any of the users' watchlists, most wanted first
+        :return: a list of (film id, number of users wanting it) tuples
+        """
+        index = self._index()
+        counts = Counter()
+        for user_id in set(user_ids):
+            counts.update(index.get(user_id, ()))
+        return sorted(counts.items(), key=lambda item: (-item[1], item[0]))